@@ -0,0 +1,222 @@
+# Content-addressed cache for downloaded artifacts, shared by the installers.
+# Entries are keyed by the artifact URL and its SHA-256 digest and can live on
+# a shared filesystem so every node reuses the same downloads. Entries are
+# published with an atomic rename, so readers never take a lock and never see
+# a partially written file. The least recently used entries are evicted once
+# the cache grows beyond its size limit.
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+import downloader
+import extractor
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'LMOD_INSTALLERS_CACHE',
+    os.path.expanduser('~/.cache/rostam-lmod-installers'))
+DEFAULT_MAX_SIZE = 2 * 2**30
+
+
+class CacheStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def record_hit(self, size):
+        with self.lock:
+            self.hits += 1
+            self.bytes_saved += size
+
+    def record_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes_saved': self.bytes_saved,
+            }
+
+    def __str__(self):
+        return (f'Artifact cache: {self.hits} hits, {self.misses} misses, '
+                f'{downloader.format_size(self.bytes_saved)} saved.')
+
+
+# Counters of all caches in this process, printed at the end of each main
+stats = CacheStats()
+
+
+# Hard link src to dst, or copy it when both are not on the same filesystem,
+# and return the size of dst.
+def link_or_copy(src, dst):
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return os.path.getsize(dst)
+
+
+class ArtifactCache:
+    # A cache_dir of None (or '') disables caching and fetch() always
+    # downloads. With more than one segment, downloads are split into that
+    # many concurrent range requests.
+    def __init__(self,
+                 cache_dir=DEFAULT_CACHE_DIR,
+                 max_size=DEFAULT_MAX_SIZE,
+                 segments=1):
+        self.cache_dir = cache_dir or None
+        self.max_size = max_size
+        self.segments = segments
+
+    @staticmethod
+    def key(url, sha256=None):
+        return hashlib.sha256(f'{url}\n{sha256 or ""}'.encode()).hexdigest()
+
+    def object_path(self, key):
+        return os.path.join(self.cache_dir, 'objects', key[:2], key)
+
+    # Hit the cache entry for key into dest_file and return whether it exists
+    def link_cached(self, key, dest_file):
+        cached_file = self.object_path(key)
+        try:
+            size = link_or_copy(cached_file, dest_file)
+        except FileNotFoundError:
+            return False
+        # Touch the entry so eviction sees it as recently used
+        try:
+            os.utime(cached_file)
+        except OSError:
+            pass
+        stats.record_hit(size)
+        return True
+
+    # Serialize the processes downloading the same artifact, so a partial
+    # download is only ever resumed by one of them
+    @contextlib.contextmanager
+    def download_lock(self, key):
+        with open(os.path.join(self.cache_dir, 'tmp', f'{key}.lock'),
+                  'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # Place the artifact at url into dest_file, downloading it only if it is
+    # not already in the cache.
+    def fetch(self, url, dest_file, sha256=None, status=None):
+        if self.cache_dir is None:
+            downloader.download_file(url,
+                                     dest_file,
+                                     status,
+                                     sha256,
+                                     segments=self.segments)
+            return
+
+        key = self.key(url, sha256)
+        if self.link_cached(key, dest_file):
+            return
+
+        # Download into the cache's temporary directory and publish the entry
+        # with an atomic rename once it is complete and verified.
+        tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        cached_file = self.object_path(key)
+        os.makedirs(tmp_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(cached_file), exist_ok=True)
+        # A fixed name lets a later run resume the partial download left by an
+        # interrupted one. Another process may have finished the download
+        # while this one waited for the lock.
+        with self.download_lock(key):
+            if self.link_cached(key, dest_file):
+                return
+            stats.record_miss()
+            tmp_file = os.path.join(tmp_dir, key)
+            downloader.download_file(url,
+                                     tmp_file,
+                                     status,
+                                     sha256,
+                                     segments=self.segments)
+            link_or_copy(tmp_file, dest_file)
+            os.replace(tmp_file, cached_file)
+
+        self.evict(keep=cached_file)
+
+    # Extract the tar archive at url into dest_dir while it downloads, without
+    # a separate pass over a downloaded file. A cached archive is extracted
+    # from the cache instead, and a downloaded one is written to the cache in
+    # the same pass. Returns an ExtractStats.
+    def fetch_extract(self, url, dest_dir, sha256=None, status=None):
+        def extract(reader):
+            return extractor.extract_stream(reader, dest_dir)
+
+        if self.cache_dir is None:
+            return downloader.stream_url(url, extract, status, sha256)[0]
+
+        key = self.key(url, sha256)
+        cached_file = self.object_path(key)
+        try:
+            cached_fh = open(cached_file, 'rb')
+        except FileNotFoundError:
+            pass
+        else:
+            with cached_fh:
+                stats.record_hit(os.fstat(cached_fh.fileno()).st_size)
+                try:
+                    os.utime(cached_file)
+                except OSError:
+                    pass
+                return extractor.extract_stream(cached_fh, dest_dir)
+        stats.record_miss()
+
+        tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(cached_file), exist_ok=True)
+        tmp_fd, tmp_file = tempfile.mkstemp(prefix=f'{key}.', dir=tmp_dir)
+        os.close(tmp_fd)
+        try:
+            extract_stats = downloader.stream_url(url, extract, status, sha256,
+                                                  tmp_file)[0]
+            os.replace(tmp_file, cached_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+        self.evict(keep=cached_file)
+        return extract_stats
+
+    # Remove the least recently used entries until the cache fits max_size.
+    # Entries removed concurrently by another process are skipped.
+    def evict(self, keep=None):
+        entries = []
+        for dir_path, _, file_names in os.walk(
+                os.path.join(self.cache_dir, 'objects')):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,152 @@
+# Cache of the installed trees of source-built packages. An entry is keyed on
+# the package, its version, its configure arguments, the compiler, the glibc
+# version and the machine architecture, and holds the tree as left by
+# "make install". A hit restores the tree instead of compiling it. Entries are
+# stored among the artifact cache's objects, so they are shared the same way
+# and evicted by the same size limit.
+#
+# Text files mentioning the install directory are rewritten when an entry is
+# restored elsewhere. An entry with binaries that embed the install directory
+# is only restored into the same directory.
+
+import functools
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+
+import extractor
+import relocation
+
+# Name of the entry's description inside its tarball, stored first
+INFO_FILE = '.binary-cache.json'
+
+
+# First line of "$CC --version"
+@functools.lru_cache(maxsize=None)
+def compiler_version(cc):
+    try:
+        cc_proc = subprocess.run([cc, '--version'],
+                                 capture_output=True,
+                                 text=True)
+    except OSError:
+        return None
+    return cc_proc.stdout.split('\n', 1)[0].strip() or None
+
+
+def glibc_version():
+    try:
+        return os.confstr('CS_GNU_LIBC_VERSION')
+    except (AttributeError, ValueError, OSError):
+        return ' '.join(platform.libc_ver())
+
+
+class BinaryCache:
+    # cache is the ArtifactCache whose directory holds the entries
+    def __init__(self, cache):
+        self.cache = cache
+
+    # Return the key of a build and the build description it hashes. cc is
+    # the compiler that builds the package, the C compiler by default.
+    @staticmethod
+    def key(package, version, configure_args=(), cc=None):
+        if cc is None:
+            cc = os.environ.get('CC', 'cc')
+        build = {
+            'package': package,
+            'version': version,
+            'configure_args': list(configure_args),
+            'compiler': compiler_version(cc),
+            'cc': cc,
+            'glibc': glibc_version(),
+            'arch': platform.machine(),
+        }
+        key = hashlib.sha256(
+            json.dumps(build, sort_keys=True).encode()).hexdigest()
+        return key, build
+
+    def read_info(self, entry_file):
+        with tarfile.open(entry_file, 'r|*') as archive:
+            member = archive.next()
+            if member is None or member.name != INFO_FILE:
+                return None
+            return json.load(archive.extractfile(member))
+
+    # Return the description of the entry for key if it can be restored into
+    # install_dir, else None
+    def lookup(self, key, install_dir):
+        if self.cache.cache_dir is None:
+            return None
+        try:
+            info = self.read_info(self.cache.object_path(key))
+        except (OSError, tarfile.TarError, ValueError):
+            return None
+        if info is None or (info['binary_files'] and info['install_dir'] !=
+                            os.path.abspath(install_dir)):
+            return None
+        return info
+
+    # Restore the entry for key into install_dir and return whether there
+    # was a usable one
+    def restore(self, key, install_dir):
+        install_dir = os.path.abspath(install_dir)
+        info = self.lookup(key, install_dir)
+        if info is None:
+            return False
+        entry_file = self.cache.object_path(key)
+
+        shutil.rmtree(install_dir, ignore_errors=True)
+        extractor.extract_archive(entry_file, install_dir)
+        os.remove(os.path.join(install_dir, INFO_FILE))
+        if info['install_dir'] != install_dir:
+            relocation.relocate_files(install_dir, info['text_files'],
+                                      info['install_dir'], install_dir)
+        # Touch the entry so eviction sees it as recently used
+        try:
+            os.utime(entry_file)
+        except OSError:
+            pass
+        return True
+
+    # Store the installed tree in install_dir as the entry for key
+    def store(self, key, build, install_dir):
+        if self.cache.cache_dir is None:
+            return
+        install_dir = os.path.abspath(install_dir)
+        text_files, binary_files = relocation.find_prefix_files(
+            install_dir, install_dir)
+        info = dict(build,
+                    install_dir=install_dir,
+                    text_files=text_files,
+                    binary_files=binary_files,
+                    stored=time.time())
+        info_data = json.dumps(info, indent=2).encode()
+
+        # Write the entry in the cache's temporary directory and publish it
+        # with an atomic rename
+        entry_file = self.cache.object_path(key)
+        tmp_dir = os.path.join(self.cache.cache_dir, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(entry_file), exist_ok=True)
+        tmp_fd, tmp_file = tempfile.mkstemp(prefix=f'{key}.', dir=tmp_dir)
+        try:
+            with os.fdopen(tmp_fd, 'wb') as fh, \
+                    tarfile.open(fileobj=fh, mode='w:gz',
+                                 compresslevel=1) as archive:
+                tar_info = tarfile.TarInfo(INFO_FILE)
+                tar_info.size = len(info_data)
+                tar_info.mtime = info['stored']
+                archive.addfile(tar_info, io.BytesIO(info_data))
+                for name in sorted(os.listdir(install_dir)):
+                    archive.add(os.path.join(install_dir, name), name)
+            os.replace(tmp_file, entry_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        self.cache.evict(keep=entry_file)
@@ -0,0 +1,120 @@
+# Release discovery across all upstreams at once. Every installer's
+# query_latest() runs as a task of a single asyncio event loop with its own
+# timeout, so checking the whole toolchain for updates takes about as long as
+# the slowest upstream instead of the sum of all of them. The HTTP client is
+# blocking, so the queries themselves run on a thread pool driven by the
+# loop. A blocked thread cannot be interrupted, so the timeout is also the
+# deadline of every request the query makes, which ends the thread too.
+#
+# Given version specs, each package resolves to the latest release that
+# satisfies its spec instead, which resolves all the packages of a lockfile
+# in one batch.
+
+import asyncio
+import concurrent.futures
+import os
+import time
+
+import installer_engine
+
+# Seconds to wait for each upstream
+DEFAULT_TIMEOUT = 30
+
+
+async def query_package(executor, package, installer, metadata, timeout,
+                        spec):
+    loop = asyncio.get_running_loop()
+    result = {
+        'package': package,
+        'spec': spec,
+        'version': None,
+        'url': None,
+        'error': None,
+    }
+    start = time.monotonic()
+    try:
+        result['version'], result['url'] = await asyncio.wait_for(
+            loop.run_in_executor(executor, installer.query_latest,
+                                 metadata.with_timeout(timeout), spec),
+            timeout)
+    except (asyncio.TimeoutError, TimeoutError):
+        result['error'] = f'No answer within {timeout}s.'
+    except Exception as e:
+        result['error'] = str(e) or repr(e)
+    result['time'] = time.monotonic() - start
+    return result
+
+
+async def discover_async(installers, metadata, timeout, specs):
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(len(installers), 1))
+    try:
+        return await asyncio.gather(*[
+            query_package(executor, package, installer, metadata, timeout,
+                          specs.get(package))
+            for package, installer in installers.items()
+        ])
+    finally:
+        # A timed out query ends at its request deadline, so do not wait for
+        # it here
+        executor.shutdown(wait=False)
+
+
+# Query the latest release of every installer in installers, a dict of
+# package names to installer modules, concurrently. specs maps package names
+# to the version specs they resolve against instead. Returns a list of dicts
+# with the package, its spec, its latest (matching) version and artifact URL,
+# the time the query took, and the error that made it fail, if any.
+def discover(installers, metadata, timeout=DEFAULT_TIMEOUT, specs=None):
+    return asyncio.run(
+        discover_async(installers, metadata, timeout, specs or {}))
+
+
+# Versions of package with a modulefile under module_base or an entry in the
+# install index, oldest first
+def installed_versions(module_base, package, index):
+    versions = set(index.load().get(package, {}))
+    package_dir = os.path.join(module_base, package)
+    if os.path.isdir(package_dir):
+        versions.update(name for name in os.listdir(package_dir)
+                        if not name.startswith('.')
+                        and os.path.isfile(os.path.join(package_dir, name)))
+    return sorted(versions, key=installer_engine.version_key)
+
+
+# Compare discovered releases with the installed versions and add their
+# "installed" versions and "status" to them. A release resolved from a spec is
+# up to date only if that very version is installed.
+def compare_installed(releases, module_base, index):
+    for release in releases:
+        installed = installed_versions(module_base, release['package'], index)
+        release['installed'] = installed
+        if release['error'] is not None:
+            release['status'] = 'unknown'
+        elif not installed:
+            release['status'] = 'not installed'
+        elif release['version'] in installed or (
+                release['spec'] is None
+                and installer_engine.version_key(release['version']) <=
+                installer_engine.version_key(installed[-1])):
+            release['status'] = 'up to date'
+        else:
+            release['status'] = 'update available'
+    return releases
+
+
+def format_table(releases):
+    with_specs = any(release['spec'] for release in releases)
+    lines = [
+        f'{"Package":<12}' + (f'{"Spec":<20}' if with_specs else '') +
+        f'{"Installed":<16}{"Available":<16}Status'
+    ]
+    for release in releases:
+        installed = release['installed'][-1] if release['installed'] else '-'
+        status = release['status']
+        if release['error'] is not None:
+            status += f' ({release["error"]})'
+        lines.append(f'{release["package"]:<12}' +
+                     (f'{release["spec"] or "-":<20}' if with_specs else '') +
+                     f'{installed:<16}{release["version"] or "-":<16}{status}')
+    return '\n'.join(lines)
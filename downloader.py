@@ -0,0 +1,408 @@
+# Shared download engine for the installers. Response bodies are streamed to
+# disk in fixed-size chunks through one reusable buffer, so memory use stays
+# flat regardless of the archive size. The SHA-256 digest is computed on the
+# same chunks while they stream in, so verifying it costs no extra read.
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.error
+
+import http_client
+
+# Size of the reusable buffer each chunk is read into
+CHUNK_SIZE = 1 << 20
+# Minimum number of seconds between two progress updates
+PROGRESS_INTERVAL = 0.2
+# Number of bytes between two journal updates of a resumable download
+COMMIT_INTERVAL = 8 * 2**20
+# Downloads smaller than this are not split into segments
+MIN_SEGMENT_SIZE = 4 * 2**20
+
+
+def format_size(num_bytes):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if num_bytes < 1024 or unit == 'GiB':
+            break
+        num_bytes /= 1024
+    return f'{num_bytes:.1f} {unit}'
+
+
+def print_progress(status, received, total, elapsed):
+    rate = format_size(received / elapsed if elapsed > 0 else 0)
+    if total:
+        done = f'{format_size(received)}/{format_size(total)}'
+    else:
+        done = format_size(received)
+    print(f'\x1b[1K\r{status} {done} ({rate}/s)', end='', flush=True)
+
+
+# Copy a readable binary stream into a writable one and return the number of
+# bytes copied. Progress is printed after the status text if one is given, and
+# every chunk is fed to the digest object if one is given. If commit is given,
+# dst is flushed and commit(bytes copied so far) is called every
+# COMMIT_INTERVAL bytes.
+def copy_stream(src,
+                dst,
+                total=0,
+                status=None,
+                chunk_size=CHUNK_SIZE,
+                digest=None,
+                commit=None):
+    buffer = memoryview(bytearray(chunk_size))
+    received = committed = 0
+    start = last_update = time.monotonic()
+    while True:
+        num_read = src.readinto(buffer)
+        if not num_read:
+            break
+        dst.write(buffer[:num_read])
+        if digest is not None:
+            digest.update(buffer[:num_read])
+        received += num_read
+        if commit is not None and received - committed >= COMMIT_INTERVAL:
+            dst.flush()
+            commit(received)
+            committed = received
+
+        now = time.monotonic()
+        if status is not None and now - last_update >= PROGRESS_INTERVAL:
+            print_progress(status, received, total, now - start)
+            last_update = now
+    if status is not None:
+        print_progress(status, received, total, time.monotonic() - start)
+    return received
+
+
+# Read-only stream over an HTTP response that feeds every byte read from it to
+# a digest, copies it to tee if given, and prints progress after the status
+# text if one is given.
+class StreamReader:
+    def __init__(self, src, digest, tee=None, total=0, status=None):
+        self.src = src
+        self.digest = digest
+        self.tee = tee
+        self.total = total
+        self.status = status
+        self.received = 0
+        self.start = self.last_update = time.monotonic()
+
+    def read(self, size=-1):
+        data = self.src.read(size)
+        self.digest.update(data)
+        if self.tee is not None:
+            self.tee.write(data)
+        self.received += len(data)
+
+        now = time.monotonic()
+        if self.status is not None and (
+                not data or now - self.last_update >= PROGRESS_INTERVAL):
+            print_progress(self.status, self.received, self.total,
+                           now - self.start)
+            self.last_update = now
+        return data
+
+
+# Stream the body of url into consume(reader) without storing it, and return
+# what consume returns together with the number of bytes received and their
+# SHA-256 digest. Whatever consume leaves unread is drained so the digest
+# covers the whole body. If tee_file is given, the body is also written to it,
+# and removed again if sha256 is given and does not match.
+def stream_url(url, consume, status=None, sha256=None, tee_file=None):
+    digest = hashlib.sha256()
+    with http_client.urlopen(url) as http_response:
+        assert http_response.status == 200, f'Failed to download {url}'
+        total = int(http_response.headers.get('Content-Length') or 0)
+        with open(tee_file if tee_file else os.devnull, 'wb') as tee:
+            reader = StreamReader(http_response, digest,
+                                  tee if tee_file else None, total, status)
+            result = consume(reader)
+            while reader.read(CHUNK_SIZE):
+                pass
+    assert not total or reader.received == total, \
+        f'Downloaded {reader.received} bytes from {url}, expected {total}.'
+
+    actual_sha256 = digest.hexdigest()
+    if sha256 is not None and actual_sha256 != sha256.lower():
+        if tee_file:
+            os.remove(tee_file)
+        raise ValueError(
+            f'SHA-256 of {url} is {actual_sha256}, expected {sha256}.')
+    return result, reader.received, actual_sha256
+
+
+# Download url into dest_file and return the number of bytes written and their
+# SHA-256 digest. The body is written to dest_file.part and renamed into place
+# once it is complete and verified. The bytes committed so far are recorded in
+# dest_file.journal, so a rerun after an interruption resumes with a range
+# request instead of starting over. If sha256 is given and does not match, the
+# partial download is removed. With more than one segment, the download is
+# split into concurrent range requests.
+def download_file(url,
+                  dest_file,
+                  status=None,
+                  sha256=None,
+                  chunk_size=CHUNK_SIZE,
+                  segments=1):
+    if segments > 1:
+        return download_segmented(url, dest_file, segments, status, sha256,
+                                  chunk_size)
+
+    part_file = dest_file + '.part'
+    journal_file = dest_file + '.journal'
+    journal = load_journal(journal_file, url)
+    committed = 0
+    request_headers = {}
+    if (journal is not None and 'committed' in journal
+            and os.path.isfile(part_file)
+            and os.path.getsize(part_file) >= journal['committed']):
+        committed = journal['committed']
+        request_headers['Range'] = f'bytes={committed}-'
+        # Only resume if the artifact has not changed since
+        validator = journal.get('etag') or journal.get('last_modified')
+        if validator:
+            request_headers['If-Range'] = validator
+
+    try:
+        http_response = http_client.urlopen(url, request_headers)
+    except urllib.error.HTTPError as e:
+        # The partial file is as long as or longer than the artifact now is
+        if e.code != 416 or not committed:
+            raise
+        committed = 0
+        http_response = http_client.urlopen(url)
+
+    digest = hashlib.sha256()
+    with http_response:
+        content_range = http_response.headers.get('Content-Range') or ''
+        if (committed and http_response.status == 206
+                and content_range.startswith(f'bytes {committed}-')):
+            # Drop whatever was written after the last commit, and hash the
+            # bytes that are kept so the digest covers the whole file
+            with open(part_file, 'r+b') as fh:
+                fh.truncate(committed)
+            hash_file(part_file, digest, chunk_size)
+            mode = 'ab'
+        else:
+            assert http_response.status == 200, f'Failed to download {url}'
+            committed = 0
+            mode = 'wb'
+        total = int(http_response.headers.get('Content-Length') or 0)
+
+        journal = {
+            'url': url,
+            'etag': http_response.headers.get('ETag'),
+            'last_modified': http_response.headers.get('Last-Modified'),
+            'committed': committed,
+        }
+        save_journal(journal_file, journal)
+
+        def commit(received):
+            journal['committed'] = committed + received
+            save_journal(journal_file, journal)
+
+        with open(part_file, mode) as dest_file_handle:
+            received = copy_stream(http_response, dest_file_handle, total,
+                                   status, chunk_size, digest, commit)
+    assert not total or received == total, \
+        f'Downloaded {received} bytes from {url}, expected {total}.'
+
+    actual_sha256 = digest.hexdigest()
+    if sha256 is not None and actual_sha256 != sha256.lower():
+        os.remove(part_file)
+        os.remove(journal_file)
+        raise ValueError(
+            f'SHA-256 of {url} is {actual_sha256}, expected {sha256}.')
+    os.replace(part_file, dest_file)
+    os.remove(journal_file)
+    return committed + received, actual_sha256
+
+
+# Return the URL to send range requests to (after redirects), the total size
+# and the ETag of url, or None if the server does not honour range requests
+def probe_ranges(url):
+    with http_client.urlopen(url, {'Range': 'bytes=0-0'}) as http_response:
+        content_range = http_response.headers.get('Content-Range') or ''
+        match = re.match(r'bytes 0-0/(\d+)$', content_range)
+        if http_response.status != 206 or not match:
+            # Closing the response without reading the full body drops the
+            # connection instead of downloading everything
+            return None
+        http_response.read()
+        return (http_response.geturl(), int(match.group(1)),
+                http_response.headers.get('ETag'))
+
+
+# The journal next to a download's .part file records how much of it has been
+# written: the bytes committed by a single stream, or which byte ranges of a
+# segmented download are complete. It is ignored if it belongs to another URL.
+def load_journal(journal_file, url):
+    try:
+        with open(journal_file) as fh:
+            journal = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(journal, dict) or journal.get('url') != url:
+        return None
+    return journal
+
+
+def save_journal(journal_file, journal):
+    tmp_fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(
+        os.path.abspath(journal_file)))
+    try:
+        with os.fdopen(tmp_fd, 'w') as fh:
+            json.dump(journal, fh)
+        os.replace(tmp_file, journal_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+# Feed the contents of path to digest
+def hash_file(path, digest, chunk_size=CHUNK_SIZE):
+    buffer = memoryview(bytearray(chunk_size))
+    with open(path, 'rb') as fh:
+        while True:
+            num_read = fh.readinto(buffer)
+            if not num_read:
+                break
+            digest.update(buffer[:num_read])
+    return digest
+
+
+# Download url into dest_file with concurrent range requests, each written at
+# its offset in a preallocated dest_file.part. Completed segments are recorded
+# in dest_file.journal, so a rerun after an interruption only fetches the
+# missing segments. Falls back to a single stream if the server does not
+# support ranges. Returns the number of bytes and their SHA-256 digest.
+def download_segmented(url,
+                       dest_file,
+                       segments,
+                       status=None,
+                       sha256=None,
+                       chunk_size=CHUNK_SIZE):
+    probe = probe_ranges(url)
+    if probe is None or probe[1] < MIN_SEGMENT_SIZE:
+        return download_file(url, dest_file, status, sha256, chunk_size)
+    range_url, total, etag = probe
+
+    part_file = dest_file + '.part'
+    journal_file = dest_file + '.journal'
+    journal = load_journal(journal_file, url)
+    if (journal is None or 'segments' not in journal
+            or (journal.get('etag'), journal.get('total')) != (etag, total)
+            or not os.path.isfile(part_file)
+            or os.path.getsize(part_file) != total):
+        segment_size = -(-total // segments)
+        journal = {
+            'url': url,
+            'etag': etag,
+            'total': total,
+            'segments': [[start, min(start + segment_size, total) - 1, False]
+                         for start in range(0, total, segment_size)],
+        }
+        with open(part_file, 'wb') as fh:
+            try:
+                os.posix_fallocate(fh.fileno(), 0, total)
+            except (AttributeError, OSError):
+                fh.truncate(total)
+        save_journal(journal_file, journal)
+
+    lock = threading.Lock()
+    start_time = time.monotonic()
+    progress = {
+        'received': sum(end - start + 1
+                        for start, end, done in journal['segments'] if done),
+        'last_update': start_time,
+    }
+
+    def fetch_segment(segment):
+        start, end, _ = segment
+        headers = {'Range': f'bytes={start}-{end}'}
+        if etag:
+            headers['If-Range'] = etag
+        buffer = memoryview(bytearray(chunk_size))
+        offset = start
+        with http_client.urlopen(range_url, headers) as http_response:
+            content_range = http_response.headers.get('Content-Range') or ''
+            assert http_response.status == 206 and content_range.startswith(
+                f'bytes {start}-{end}/'
+            ), f'Range request for bytes {start}-{end} of {url} failed.'
+            while offset <= end:
+                num_read = http_response.readinto(buffer)
+                if not num_read:
+                    break
+                os.pwrite(fd, buffer[:num_read], offset)
+                offset += num_read
+                with lock:
+                    progress['received'] += num_read
+                    now = time.monotonic()
+                    if (status is not None and
+                            now - progress['last_update'] >= PROGRESS_INTERVAL):
+                        print_progress(status, progress['received'], total,
+                                       now - start_time)
+                        progress['last_update'] = now
+        assert offset == end + 1, \
+            f'Received {offset - start} of {end - start + 1} bytes of {url} at {start}.'
+        with lock:
+            segment[2] = True
+            save_journal(journal_file, journal)
+
+    pending = [segment for segment in journal['segments'] if not segment[2]]
+    fd = os.open(part_file, os.O_WRONLY)
+    try:
+        if pending:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(pending)) as pool:
+                for future in [
+                        pool.submit(fetch_segment, segment)
+                        for segment in pending
+                ]:
+                    future.result()
+    finally:
+        os.close(fd)
+    if status is not None:
+        print_progress(status, total, total, time.monotonic() - start_time)
+
+    # Segments arrive out of order, so the digest needs one pass over the file
+    actual_sha256 = hash_file(part_file, hashlib.sha256(),
+                              chunk_size).hexdigest()
+    if sha256 is not None and actual_sha256 != sha256.lower():
+        os.remove(part_file)
+        os.remove(journal_file)
+        raise ValueError(
+            f'SHA-256 of {url} is {actual_sha256}, expected {sha256}.')
+    os.replace(part_file, dest_file)
+    os.remove(journal_file)
+    return total, actual_sha256
+
+
+# Find the SHA-256 digest of file_name in a sha256sum-style listing. Lines
+# that are not digests, such as a PGP signature armor, are ignored.
+def parse_sha256sums(sums_text, file_name):
+    for match in re.finditer(r'^([0-9a-fA-F]{64}) [ *]?(\S+)\s*$', sums_text,
+                             re.MULTILINE):
+        if os.path.basename(match.group(2)) == file_name:
+            return match.group(1).lower()
+    return None
+
+
+# Fetch a sha256sum-style listing, through the metadata cache if one is
+# given, and return the digest of file_name, or None if the listing cannot be
+# fetched or does not mention the file.
+def query_sha256sums(sums_url, file_name, metadata=None):
+    try:
+        if metadata is not None:
+            sums_text = metadata.read(sums_url)
+        else:
+            with http_client.urlopen(sums_url) as http_response:
+                sums_text = http_response.read().decode('utf-8')
+    except OSError:
+        return None
+    return parse_sha256sums(sums_text, file_name)
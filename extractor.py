@@ -0,0 +1,243 @@
+# Archive extraction engine shared by the installers. Decompression runs in the
+# calling thread while a thread pool creates and writes the extracted files,
+# which overlaps the CPU-bound decompression with the file creation round trips
+# that dominate on NFS and Lustre. File contents are handed to the pool under a
+# fixed memory budget. When pixz, pigz or unzip is installed, it is used
+# instead.
+
+import concurrent.futures
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
+import zipfile
+
+# Upper bound for the file contents waiting to be written by the pool
+MEMORY_BUDGET = 64 * 2**20
+# Members larger than this are streamed to disk by the decompressing thread
+LARGE_MEMBER_SIZE = 8 * 2**20
+DEFAULT_JOBS = min(16, 4 * (os.cpu_count() or 1))
+
+# Parallel decompressors used through "tar -I" for each compression suffix
+TAR_FILTERS = {
+    '.xz': 'pixz',
+    '.txz': 'pixz',
+    '.gz': 'pigz',
+    '.tgz': 'pigz',
+}
+
+
+class ExtractStats:
+    def __init__(self, num_bytes, seconds, method):
+        self.num_bytes = num_bytes
+        self.seconds = seconds
+        self.method = method
+
+    @property
+    def throughput(self):
+        return self.num_bytes / self.seconds / 1e6 if self.seconds > 0 else 0
+
+    def __str__(self):
+        return (f'{self.num_bytes / 1e6:.1f} MB in {self.seconds:.2f}s, '
+                f'{self.throughput:.1f} MB/s with {self.method}')
+
+
+# Blocks until the requested number of bytes fits in the budget. A request
+# larger than the whole budget is admitted once nothing else is in flight.
+class MemoryBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, num_bytes):
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight == 0 or self.
+                                    in_flight + num_bytes <= self.limit)
+            self.in_flight += num_bytes
+
+    def release(self, num_bytes):
+        with self.condition:
+            self.in_flight -= num_bytes
+            self.condition.notify_all()
+
+
+# Return the path of a member name under dest_dir, refusing names that escape
+# it. Only the directory the member goes in is resolved, so that a member
+# replaces an existing symlink of the same name instead of following it.
+def member_path(dest_dir, name):
+    path = os.path.join(dest_dir, name)
+    head, tail = os.path.split(path)
+    if tail in ('', os.curdir, os.pardir):
+        resolved = os.path.realpath(path)
+    else:
+        resolved = os.path.join(os.path.realpath(head), tail)
+    root = os.path.realpath(dest_dir)
+    assert resolved == root or resolved.startswith(root + os.sep), \
+        f'Archive member {name} would be extracted outside {dest_dir}.'
+    return path
+
+
+# Remove a symlink at path, left by an earlier extraction, so that writing a
+# file there does not write through it
+def remove_link(path):
+    if os.path.islink(path):
+        os.remove(path)
+
+
+def write_file(path, data, mode=None, mtime=None):
+    with open(path, 'wb') as fh:
+        fh.write(data)
+    if mode is not None:
+        os.chmod(path, mode)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+# Extract a tar archive, read sequentially from archive_path or from the
+# fileobj stream if given
+def extract_tar(archive_path, dest_dir, jobs, fileobj=None):
+    budget = MemoryBudget(MEMORY_BUDGET)
+    num_bytes = 0
+    links = []
+    futures = []
+
+    def write_budgeted(path, data, mode, mtime):
+        try:
+            write_file(path, data, mode, mtime)
+        finally:
+            budget.release(len(data))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool, \
+            tarfile.open(archive_path, 'r|*', fileobj) as archive:
+        for member in archive:
+            path = member_path(dest_dir, member.name)
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+            elif member.isfile():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                remove_link(path)
+                src = archive.extractfile(member)
+                num_bytes += member.size
+                if member.size > LARGE_MEMBER_SIZE:
+                    with open(path, 'wb') as fh:
+                        shutil.copyfileobj(src, fh)
+                    os.chmod(path, member.mode)
+                    os.utime(path, (member.mtime, member.mtime))
+                else:
+                    budget.acquire(member.size)
+                    futures.append(
+                        pool.submit(write_budgeted, path, src.read(),
+                                    member.mode, member.mtime))
+            elif member.issym() or member.islnk():
+                # Links are created once every regular file has been written
+                links.append(member)
+        for future in futures:
+            future.result()
+
+    for member in links:
+        path = member_path(dest_dir, member.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.lexists(path):
+            os.remove(path)
+        if member.issym():
+            os.symlink(member.linkname, path)
+        else:
+            os.link(member_path(dest_dir, member.linkname),
+                    path,
+                    follow_symlinks=False)
+    return num_bytes
+
+
+def extract_zip(archive_path, dest_dir, jobs):
+    with zipfile.ZipFile(archive_path) as archive:
+        members = archive.infolist()
+    for member in members:
+        path = member_path(dest_dir, member.filename)
+        os.makedirs(path if member.is_dir() else os.path.dirname(path),
+                    exist_ok=True)
+
+    # zlib releases the GIL, so each worker decompresses its own members
+    # through its own handle on the archive
+    local = threading.local()
+    handles = []
+
+    def extract_member(member):
+        if not hasattr(local, 'archive'):
+            local.archive = zipfile.ZipFile(archive_path)
+            handles.append(local.archive)
+        path = member_path(dest_dir, member.filename)
+        remove_link(path)
+        with local.archive.open(member) as src, open(path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        # Keep the Unix permissions if the archive recorded them
+        mode = member.external_attr >> 16 & 0o7777
+        if mode:
+            os.chmod(path, mode)
+
+    files = [member for member in members if not member.is_dir()]
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(extract_member, files))
+    finally:
+        for handle in handles:
+            handle.close()
+    return sum(member.file_size for member in files)
+
+
+# Extract with an installed parallel tool and return the tool's name and the
+# number of extracted bytes, or None if no suitable tool is installed.
+def extract_external(archive_path, dest_dir):
+    if zipfile.is_zipfile(archive_path):
+        if shutil.which('unzip') is None:
+            return None
+        subprocess.run(['unzip', '-q', '-o', archive_path, '-d', dest_dir],
+                       check=True)
+        with zipfile.ZipFile(archive_path) as archive:
+            return 'unzip', sum(member.file_size
+                                for member in archive.infolist())
+
+    suffix = os.path.splitext(archive_path)[1]
+    tool = TAR_FILTERS.get(suffix)
+    if tool is None or shutil.which(tool) is None:
+        return None
+    # GNU tar reports "Total bytes read: N (...)" on stderr with --totals
+    tar_proc = subprocess.run(
+        ['tar', '--totals', '-I', tool, '-xf', archive_path, '-C', dest_dir],
+        capture_output=True,
+        text=True,
+        check=True)
+    match = re.search(r'Total bytes read: (\d+)', tar_proc.stderr)
+    return tool, int(match.group(1)) if match else 0
+
+
+# Extract a tar archive from a sequential stream, such as an HTTP response,
+# into dest_dir and return an ExtractStats
+def extract_stream(fileobj, dest_dir, jobs=DEFAULT_JOBS):
+    os.makedirs(dest_dir, exist_ok=True)
+    start = time.monotonic()
+    num_bytes = extract_tar(None, dest_dir, jobs, fileobj)
+    return ExtractStats(num_bytes,
+                        time.monotonic() - start,
+                        f'streaming and {jobs} writer threads')
+
+
+# Extract a tar or zip archive into dest_dir and return an ExtractStats
+def extract_archive(archive_path, dest_dir, jobs=DEFAULT_JOBS, external=True):
+    os.makedirs(dest_dir, exist_ok=True)
+    start = time.monotonic()
+
+    extracted = extract_external(archive_path, dest_dir) if external else None
+    if extracted is not None:
+        method, num_bytes = extracted
+        return ExtractStats(num_bytes, time.monotonic() - start, method)
+
+    if zipfile.is_zipfile(archive_path):
+        num_bytes = extract_zip(archive_path, dest_dir, jobs)
+    else:
+        num_bytes = extract_tar(archive_path, dest_dir, jobs)
+    return ExtractStats(num_bytes,
+                        time.monotonic() - start, f'{jobs} writer threads')
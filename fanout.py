@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# Python version must be at least 3.6
+import sys
+if sys.version_info[0] < 3 or sys.version_info[1] < 6:
+    print("Python version must be at least 3.6")
+    sys.exit(1)
+
+# Deploy a package installed once by one of the installers to many prefixes
+# and hosts. The install directory is packed into a relocatable tarball once,
+# then streamed to every target over ssh (or a local shell for local prefixes)
+# with bounded concurrency. Each target is verified with a batched Lmod check
+# as soon as its deployment finishes.
+#
+# A target is [host:]prefix. The package is deployed to
+# <prefix>/<package>/<version> with its modulefile in
+# <prefix>/modules/<package>/<version>, the layout of the installers'
+# defaults. Text files mentioning the original install directory are
+# rewritten for the new one. Binaries with a compiled-in prefix, like Git's,
+# cannot be rewritten, so targets with another install directory fail
+# without being deployed.
+
+import argparse
+import concurrent.futures
+import io
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+
+import downloader
+import install_index
+import installer_engine
+import lmod_check
+import relocation
+
+# Names of the relocation manifest and the modulefile inside the tarball
+RELOCATE_FILE = '.relocate'
+MODULE_FILE = '.modulefile'
+
+
+def add_bytes(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = time.time()
+    archive.addfile(info, io.BytesIO(data))
+
+
+# Pack install_dir, its modulefile and the relocation manifest into a gzip
+# tarball. pigz compresses in parallel when it is installed. Returns the text
+# files that are relocated and the binary files with install_dir compiled in.
+def pack(install_dir, module_file, tarball):
+    relocatable_files, binary_files = relocation.find_prefix_files(
+        install_dir, install_dir)
+    with open(module_file, 'rb') as fh:
+        module_file_content = fh.read()
+
+    if shutil.which('pigz'):
+        with tempfile.TemporaryDirectory() as extra_dir:
+            with open(os.path.join(extra_dir, RELOCATE_FILE), 'w') as fh:
+                fh.writelines(f'{name}\n' for name in relocatable_files)
+            with open(os.path.join(extra_dir, MODULE_FILE), 'wb') as fh:
+                fh.write(module_file_content)
+            subprocess.run([
+                'tar', '-I', 'pigz', '-cf', tarball, '-C', install_dir, '.',
+                '-C', extra_dir, RELOCATE_FILE, MODULE_FILE
+            ],
+                           check=True)
+    else:
+        with tarfile.open(tarball, 'w:gz', compresslevel=1) as archive:
+            archive.add(install_dir, '.')
+            add_bytes(archive, RELOCATE_FILE,
+                      ''.join(f'{name}\n' for name in relocatable_files).encode())
+            add_bytes(archive, MODULE_FILE, module_file_content)
+    return relocatable_files, binary_files
+
+
+# Escape text for the pattern and the replacement of a sed s### command
+def sed_escape(text):
+    return re.sub(r'([\\.*\[\]^$#&])', r'\\\1', text)
+
+
+# Shell script that unpacks the tarball from stdin on a target
+def deploy_script(old_install_dir, install_dir, module_file):
+    substitution = f's#{sed_escape(old_install_dir)}#{sed_escape(install_dir)}#g'
+    install_dir = shlex.quote(install_dir)
+    module_file = shlex.quote(module_file)
+    return '\n'.join([
+        'set -e',
+        f'rm -rf {install_dir}',
+        f'mkdir -p {install_dir} "$(dirname {module_file})"',
+        f'tar xzf - -C {install_dir}',
+        f'cd {install_dir}',
+        f'if [ -s {RELOCATE_FILE} ]; then',
+        f'  tr "\\n" "\\0" <{RELOCATE_FILE} | xargs -0 sed -i {shlex.quote(substitution)}',
+        'fi',
+        f'sed {shlex.quote(substitution)} {MODULE_FILE} >{module_file}',
+        f'rm -f {RELOCATE_FILE} {MODULE_FILE}',
+    ])
+
+
+def deploy_target(target, tarball, package, version, entry, binary_files,
+                  ssh):
+    host, _, prefix = target.rpartition(':')
+    install_dir = os.path.join(prefix, package, version)
+    module_base = os.path.join(prefix, 'modules')
+    module_name = os.path.join(package, version)
+    module_file = os.path.join(module_base, module_name)
+    command = os.path.basename(entry['executable'])
+    executable = os.path.join(install_dir,
+                              os.path.relpath(entry['executable'],
+                                              entry['install_dir']))
+    result = {'target': target, 'problems': []}
+
+    if not host and os.path.realpath(install_dir) == os.path.realpath(
+            entry['install_dir']):
+        result['skipped'] = 'The package is installed here already.'
+        return result
+    if binary_files and os.path.normpath(install_dir) != os.path.normpath(
+            entry['install_dir']):
+        result['problems'].append(
+            f'{len(binary_files)} binary files have {entry["install_dir"]} '
+            f'compiled in and cannot be relocated to {install_dir}, e.g. '
+            f'{", ".join(binary_files[:3])}.')
+        return result
+
+    script = deploy_script(entry['install_dir'], install_dir, module_file)
+    start = time.monotonic()
+    with open(tarball, 'rb') as fh:
+        deploy_proc = subprocess.run(
+            ssh + [host, f'sh -c {shlex.quote(script)}'] if host else
+            ['sh', '-c', script],
+            stdin=fh,
+            capture_output=True,
+            text=True)
+    result['deploy_time'] = time.monotonic() - start
+    if deploy_proc.returncode != 0:
+        result['problems'].append(f'Deploying failed.\n{deploy_proc.stderr}')
+        return result
+
+    # The executable is compared by path below, since it may not exist here
+    start = time.monotonic()
+    check = lmod_check.ModuleCheck(module_name,
+                                   command,
+                                   version=version,
+                                   module_file=module_file)
+    lmod_result = lmod_check.run_checks(
+        [check],
+        ssh + [host, 'bash -l -s'] if host else None,
+        module_paths=[module_base])[0]
+    result['problems'] += lmod_check.find_problems(check, lmod_result)
+    which_output = lmod_result.get('which', (None, ''))[1].strip()
+    if which_output and which_output != executable:
+        result['problems'].append(
+            f'{command} executable loaded by Lmod is {which_output}, '
+            f'expected {executable}.')
+    result['check_time'] = time.monotonic() - start
+    return result
+
+
+def main(module_base, package, version, targets, jobs, ssh):
+    index = install_index.InstallIndex(module_base)
+    versions = index.load().get(package, {})
+    assert versions, f'{package} is not in the install index of {module_base}.'
+    if version is None:
+        version = max(versions, key=installer_engine.version_key)
+    entry = index.lookup(package, version)
+    assert entry is not None, f'{package} {version} is not installed.'
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tarball = os.path.join(tmp_dir, f'{package}-{version}.tar.gz')
+        print(f'Packing {entry["install_dir"]}...', end='', flush=True)
+        start = time.monotonic()
+        relocatable_files, binary_files = pack(entry['install_dir'],
+                                               entry['module_file'], tarball)
+        print(f'\x1b[1K\rPacked {entry["install_dir"]} into '
+              f'{downloader.format_size(os.path.getsize(tarball))} '
+              f'in {time.monotonic() - start:.1f}s, '
+              f'{len(relocatable_files)} files to relocate, '
+              f'{len(binary_files)} binaries with a fixed prefix.')
+
+        print(f'Deploying {package} {version} to {len(targets)} targets...',
+              end='',
+              flush=True)
+        start = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            results = list(
+                pool.map(
+                    lambda target: deploy_target(target, tarball, package,
+                                                 version, entry, binary_files,
+                                                 ssh),
+                    targets))
+        print(f'\x1b[1K\rDeployed {package} {version} to {len(targets)} '
+              f'targets in {time.monotonic() - start:.1f}s.')
+
+    num_failed = 0
+    for result in results:
+        if result['problems']:
+            num_failed += 1
+            print(f'FAILED {result["target"]}:')
+            for problem in result['problems']:
+                print(f'  {problem.rstrip()}')
+        elif 'skipped' in result:
+            print(f'skip   {result["target"]}: {result["skipped"]}')
+        else:
+            print(f'ok     {result["target"]} '
+                  f'(deploy: {result["deploy_time"]:.1f}s, '
+                  f'check: {result["check_time"]:.1f}s)')
+    return 1 if num_failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Deploy an installed package to many prefixes and hosts, and check its module on each.'
+    )
+    parser.add_argument('--version', action='version', version='%(prog)s 1.0')
+    parser.add_argument('--module-base-dir',
+                        type=str,
+                        default=os.path.expanduser('~/.local/modules/'),
+                        help='The base directory for the module files of the installed package.')
+    parser.add_argument('--package',
+                        type=str,
+                        required=True,
+                        help='The installed package to deploy.')
+    parser.add_argument('--package-version',
+                        type=str,
+                        default=None,
+                        help='The version to deploy. Defaults to the latest installed one.')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=8,
+                        help='The number of targets deployed concurrently.')
+    parser.add_argument('--ssh',
+                        type=str,
+                        default='ssh -o BatchMode=yes',
+                        help='The command that runs a shell command on a host, called as <ssh> <host> <command>.')
+    parser.add_argument('targets',
+                        nargs='+',
+                        help='Targets as [host:]prefix, e.g. node01:/opt/local or /scratch/local.')
+    args = parser.parse_args()
+
+    sys.exit(
+        main(args.module_base_dir, args.package, args.package_version,
+             args.targets, args.jobs, shlex.split(args.ssh)))
@@ -0,0 +1,371 @@
+# Shared HTTP client for the installers. Connections are kept alive and pooled
+# per host, so the metadata query and the artifact download (and the
+# redirects between them) reuse TCP connections, and reconnects to a host
+# resume its TLS session. Failed requests are retried with exponential
+# backoff. Proxied and non-HTTP URLs are handed to urllib.request instead.
+# With an offline mirror, every URL is served from a local directory tree
+# instead of the network. With an upstream server, every URL is requested
+# from that server instead of its host, which is how the benchmarks stand in
+# for the real upstreams.
+
+import email.utils
+import http.client
+import os
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+TIMEOUT = 60
+MAX_RETRIES = 3
+BACKOFF = 0.5
+MAX_REDIRECTS = 10
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+USER_AGENT = 'rostam-lmod-installers'
+
+
+class HTTPStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.reused = 0
+        self.retries = 0
+        self.connect_time = 0.0
+        self.bytes_received = 0
+
+    def record(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                name: getattr(self, name)
+                for name in ('requests', 'connections', 'reused', 'retries',
+                             'connect_time', 'bytes_received')
+            }
+
+    def __str__(self):
+        return (f'HTTP: {self.requests} requests, '
+                f'{self.bytes_received / 1e6:.1f} MB received, '
+                f'{self.connections} connections opened in '
+                f'{self.connect_time:.2f}s, {self.reused} reused, '
+                f'{self.retries} retries.')
+
+
+# Counters of all requests in this process, printed at the end of each main
+stats = HTTPStats()
+
+
+# An HTTPS connection that offers the previous TLS session of its host when
+# it connects, and times the connection setup
+class HTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, host, pool, **kwargs):
+        super().__init__(host, context=pool.ssl_context, **kwargs)
+        self.pool = pool
+
+    def connect(self):
+        start = time.monotonic()
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self.pool.ssl_context.wrap_socket(
+            self.sock,
+            server_hostname=server_hostname,
+            session=self.pool.tls_sessions.get(server_hostname))
+        stats.record(connections=1, connect_time=time.monotonic() - start)
+
+    # With TLS 1.3 the session ticket only arrives after the handshake, so
+    # the session is saved once the connection has been used
+    def remember_session(self):
+        if self.sock is not None and self.sock.session is not None:
+            self.pool.tls_sessions[self._tunnel_host or
+                                   self.host] = self.sock.session
+
+    def close(self):
+        self.remember_session()
+        super().close()
+
+
+class HTTPConnection(http.client.HTTPConnection):
+    def __init__(self, host, pool, **kwargs):
+        super().__init__(host, **kwargs)
+        self.pool = pool
+
+    def connect(self):
+        start = time.monotonic()
+        super().connect()
+        stats.record(connections=1, connect_time=time.monotonic() - start)
+
+
+# A response that hands its connection back to the pool once the body has
+# been read completely, and closes it otherwise
+class PooledResponse:
+    def __init__(self, pool, key, connection, response, url):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.response.read()
+        else:
+            data = self.response.read(size)
+        stats.record(bytes_received=len(data))
+        return data
+
+    def readinto(self, buffer):
+        num_read = self.response.readinto(buffer)
+        stats.record(bytes_received=num_read)
+        return num_read
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        if self.connection is None:
+            return
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.release(self.key, self.connection)
+        else:
+            self.connection.close()
+        self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Seconds left until deadline for requesting url, or None without a deadline.
+# Raises TimeoutError once it has passed.
+def remaining(deadline, url):
+    if deadline is None:
+        return None
+    seconds = deadline - time.monotonic()
+    if seconds <= 0:
+        raise TimeoutError(f'No answer from {url} in time.')
+    return seconds
+
+
+class ConnectionPool:
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.ssl_context = ssl.create_default_context()
+        self.tls_sessions = {}
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    # Return an idle connection to key, or a new one if there is none or
+    # reuse is off
+    def acquire(self, key, reuse=True):
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections and reuse:
+                stats.record(reused=1)
+                return connections.pop()
+        scheme, host = key
+        connection_class = HTTPSConnection if scheme == 'https' else HTTPConnection
+        return connection_class(host, self, timeout=self.timeout)
+
+    def release(self, key, connection):
+        if isinstance(connection, HTTPSConnection):
+            connection.remember_session()
+        with self.lock:
+            self.idle.setdefault(key, []).append(connection)
+
+    def request_once(self, url, headers, timeout=None):
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query,
+                                        ''))
+        connection = self.acquire(key)
+        reused = connection.sock is not None
+        try:
+            response = self.send(connection, path, headers, timeout)
+        except (BrokenPipeError, ConnectionResetError):
+            if not reused:
+                raise
+            # The server closed the pooled connection while it was idle,
+            # which is no failure of the request, so it is repeated right
+            # away on a new connection rather than retried with backoff
+            connection = self.acquire(key, reuse=False)
+            response = self.send(connection, path, headers, timeout)
+        return PooledResponse(self, key, connection, response, url)
+
+    def send(self, connection, path, headers, timeout=None):
+        # Pooled connections keep their socket, so the timeout of this
+        # request is set on it, and reset by the next one
+        connection.timeout = self.timeout if timeout is None else timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(connection.timeout)
+        try:
+            connection.request('GET', path, headers=headers)
+            return connection.getresponse()
+        except BaseException:
+            connection.close()
+            raise
+
+    # GET url following redirects and retrying transient failures. Like
+    # urllib.request.urlopen, raises urllib.error.HTTPError for error
+    # statuses, including 304 Not Modified. A timeout bounds the whole
+    # request, retries and redirects included, up to the response headers.
+    def urlopen(self, url, headers=None, timeout=None):
+        headers = dict({'User-Agent': USER_AGENT}, **(headers or {}))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for _ in range(MAX_REDIRECTS):
+            for attempt in range(MAX_RETRIES + 1):
+                try:
+                    response = self.request_once(url, headers,
+                                                 remaining(deadline, url))
+                except (OSError, http.client.HTTPException):
+                    if attempt == MAX_RETRIES or (
+                            deadline is not None
+                            and time.monotonic() >= deadline):
+                        raise
+                else:
+                    if (response.status not in RETRY_STATUSES
+                            or attempt == MAX_RETRIES):
+                        break
+                    response.read()
+                    response.close()
+                stats.record(retries=1)
+                backoff = BACKOFF * 2**attempt
+                if deadline is not None:
+                    backoff = min(backoff, max(deadline - time.monotonic(), 0))
+                time.sleep(backoff)
+            stats.record(requests=1)
+
+            if response.status in (301, 302, 303, 307, 308):
+                location = response.headers.get('Location')
+                response.read()
+                response.close()
+                url = urllib.parse.urljoin(url, location)
+                # Credentials are meant for the original host only
+                headers = {
+                    name: value
+                    for name, value in headers.items()
+                    if name.lower() != 'authorization'
+                }
+                if use_urllib(url):
+                    # Keep Range and the conditional headers, which the
+                    # caller relies on to interpret the response
+                    return urllib.request.urlopen(
+                        urllib.request.Request(url, headers=headers),
+                        timeout=remaining(deadline, url) or self.timeout)
+                continue
+            if response.status >= 300:
+                response.read()
+                response.close()
+                raise urllib.error.HTTPError(url, response.status,
+                                             response.response.reason,
+                                             response.headers, None)
+            return response
+        raise urllib.error.URLError(f'Too many redirects for {url}')
+
+
+# A response served from a file in the offline mirror
+class MirrorResponse:
+    def __init__(self, path, url):
+        self.fh = open(path, 'rb')
+        self.url = url
+        self.status = 200
+        st = os.fstat(self.fh.fileno())
+        self.headers = http.client.HTTPMessage()
+        self.headers['Content-Length'] = str(st.st_size)
+        self.headers['Last-Modified'] = email.utils.formatdate(st.st_mtime,
+                                                               usegmt=True)
+
+    def read(self, size=-1):
+        return self.fh.read(size)
+
+    def readinto(self, buffer):
+        return self.fh.readinto(buffer)
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Map url to its file in a mirror directory: <mirror_dir>/<host>/<path>, where
+# directory URLs map to an index.html file
+def mirror_path(mirror_dir, url):
+    parts = urllib.parse.urlsplit(url)
+    path = urllib.parse.unquote(parts.path)
+    if not path or path.endswith('/'):
+        path += 'index.html'
+    if parts.query:
+        path += '?' + parts.query
+    root = os.path.abspath(mirror_dir)
+    mirrored_file = os.path.normpath(
+        os.path.join(root, parts.netloc, path.lstrip('/')))
+    assert mirrored_file.startswith(root + os.sep), \
+        f'{url} maps outside the mirror {mirror_dir}.'
+    return mirrored_file
+
+
+# Whether url has to go through urllib.request, which supports proxies and
+# other schemes
+def use_urllib(url):
+    scheme = urllib.parse.urlsplit(url).scheme
+    return scheme not in ('http', 'https') or scheme in urllib.request.getproxies()
+
+
+pool = ConnectionPool()
+
+# Directory populated by "mirror.py sync" that replaces the network, if set
+offline_mirror = None
+
+# Base URL of a server that replaces every upstream host, if set. It serves
+# <base>/<host>/<path>, the layout of the offline mirror.
+upstream_server = None
+
+
+# Map url to its location on the upstream server, if one is set
+def upstream_url(url):
+    if not upstream_server or url.startswith(upstream_server):
+        return url
+    parts = urllib.parse.urlsplit(url)
+    base = urllib.parse.urlsplit(upstream_server)
+    return urllib.parse.urlunsplit(
+        (base.scheme, base.netloc,
+         f'{base.path.rstrip("/")}/{parts.netloc}{parts.path or "/"}',
+         parts.query, ''))
+
+
+# Open url through the shared pool, or from the offline mirror if one is set,
+# and return a response with status, headers, read() and readinto(). timeout
+# bounds the request instead of TIMEOUT, if given.
+def urlopen(url, headers=None, timeout=None):
+    if offline_mirror:
+        mirrored_file = mirror_path(offline_mirror, url)
+        stats.record(requests=1)
+        try:
+            return MirrorResponse(mirrored_file, url)
+        except FileNotFoundError:
+            raise urllib.error.HTTPError(
+                url, 404, f'Not in the offline mirror: {mirrored_file}',
+                http.client.HTTPMessage(), None)
+    url = upstream_url(url)
+    if use_urllib(url):
+        request = urllib.request.Request(url, headers=headers or {})
+        stats.record(requests=1)
+        return urllib.request.urlopen(
+            request, timeout=TIMEOUT if timeout is None else timeout)
+    return pool.urlopen(url, headers, timeout)
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+# Python version must be at least 3.6
+import sys
+if sys.version_info[0] < 3 or sys.version_info[1] < 6:
+    print("Python version must be at least 3.6")
+    sys.exit(1)
+
+# Install several packages at once. The network-bound fetch stages of all
+# packages run concurrently, and each package's install stage starts as soon
+# as its own fetch stage finishes. With --check-updates, only the latest
+# upstream versions are listed next to the installed ones.
+
+import concurrent.futures
+import os
+import threading
+import time
+import traceback
+
+import artifact_cache
+import binary_cache
+import discovery
+import http_client
+import install_cmake
+import install_git
+import install_gnu_parallel
+import install_index
+import install_ninja
+import install_ruby
+import installer_engine
+import metadata_cache
+import run_report
+
+INSTALLERS = {
+    'cmake': install_cmake,
+    'git': install_git,
+    'ninja': install_ninja,
+    'parallel': install_gnu_parallel,
+    'ruby': install_ruby,
+}
+
+# Packages built from source, at least optionally, whose install stages take a
+# binary cache
+BINARY_CACHED = {'git', 'ninja', 'parallel', 'ruby'}
+
+# Packages whose fetch stages take the binary cache too, and skip the download
+# when it can restore the build
+BINARY_CACHED_FETCH = {'git'}
+
+# Packages that install a binary release unless told to build from source
+FROM_SOURCE = {'ninja'}
+
+
+# Route the prints of each worker thread to its own log file so the status
+# lines of concurrently running installers do not clobber each other.
+class ThreadOutput:
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def stream(self):
+        return getattr(self.local, 'stream', self.default)
+
+    def write(self, text):
+        return self.stream().write(text)
+
+    def flush(self):
+        self.stream().flush()
+
+    def redirect(self, stream):
+        self.local.stream = stream
+
+    def restore(self):
+        self.local.__dict__.pop('stream', None)
+
+
+class Task:
+    def __init__(self, name, pool, fn, deps, log_file):
+        self.name = name
+        self.pool = pool
+        self.fn = fn
+        self.deps = list(deps)
+        self.log_file = log_file
+        self.start = None
+        self.end = None
+        self.result = None
+        self.error = None
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+# Run tasks on per-kind thread pools, submitting each task the moment all of
+# its dependencies have completed. A task receives the results of its
+# dependencies as positional arguments.
+class Scheduler:
+    def __init__(self, pool_sizes, output):
+        self.pool_sizes = pool_sizes
+        self.output = output
+        self.tasks = {}
+
+    def add(self, name, pool, fn, deps=(), log_file=None):
+        assert name not in self.tasks, f'Task {name} is already scheduled.'
+        assert pool in self.pool_sizes, f'Unknown pool {pool}.'
+        for dep in deps:
+            assert dep in self.tasks, f'Task {name} depends on unknown task {dep}.'
+        self.tasks[name] = Task(name, pool, fn, deps, log_file)
+
+    def _run_task(self, task):
+        task.start = time.monotonic()
+        try:
+            if task.log_file:
+                with open(task.log_file, 'a') as log:
+                    self.output.redirect(log)
+                    try:
+                        return task.fn(*[self.tasks[dep].result
+                                         for dep in task.deps])
+                    except BaseException:
+                        traceback.print_exc(file=log)
+                        raise
+                    finally:
+                        self.output.restore()
+            return task.fn(*[self.tasks[dep].result for dep in task.deps])
+        finally:
+            task.end = time.monotonic()
+
+    def run(self, on_done=None):
+        pools = {
+            kind: concurrent.futures.ThreadPoolExecutor(max_workers=size)
+            for kind, size in self.pool_sizes.items()
+        }
+        pending = dict(self.tasks)
+        running = {}
+        finished = set()
+        try:
+            while pending or running:
+                # Submit every task whose dependencies are all done. Tasks
+                # depending on a failed task are dropped.
+                for name, task in list(pending.items()):
+                    if any(self.tasks[dep].error is not None
+                           for dep in task.deps):
+                        task.error = RuntimeError(
+                            'skipped because a dependency failed')
+                        del pending[name]
+                        finished.add(name)
+                        if on_done:
+                            on_done(task)
+                    elif all(dep in finished for dep in task.deps):
+                        future = pools[task.pool].submit(self._run_task, task)
+                        running[future] = task
+                        del pending[name]
+                if not running:
+                    continue
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        task.result = future.result()
+                    except Exception as e:
+                        task.error = e
+                    finished.add(task.name)
+                    if on_done:
+                        on_done(task)
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+        return self.tasks
+
+
+# Run an installer's install stage unless its fetch stage found the package to
+# be up to date already
+def install_fetched(installer, module_base, fetched, index, binaries=None):
+    if fetched is None:
+        return None
+    if binaries is None:
+        return installer.install_stage(module_base, fetched, index)
+    return installer.install_stage(module_base,
+                                   fetched,
+                                   index,
+                                   binaries=binaries)
+
+
+# Print the latest upstream version of each package next to its installed
+# versions. Returns 1 if an upstream could not be queried.
+def check_updates(module_base,
+                  packages,
+                  cache_dir=artifact_cache.DEFAULT_CACHE_DIR,
+                  metadata_ttl=metadata_cache.DEFAULT_TTL,
+                  timeout=discovery.DEFAULT_TIMEOUT,
+                  offline_mirror=None,
+                  version_specs=None):
+    if offline_mirror:
+        print(f'Using offline mirror {offline_mirror}.')
+        http_client.offline_mirror = offline_mirror
+        cache_dir = None
+
+    metadata = metadata_cache.MetadataCache(cache_dir, metadata_ttl)
+    index = install_index.InstallIndex(module_base)
+    print(f'Querying {len(packages)} upstreams...', end='', flush=True)
+    start = time.monotonic()
+    releases = discovery.discover(
+        {package: INSTALLERS[package]
+         for package in packages}, metadata, timeout, version_specs)
+    print(f'\x1b[1K\rQueried {len(packages)} upstreams in '
+          f'{time.monotonic() - start:.1f}s.')
+    discovery.compare_installed(releases, module_base, index)
+    print(discovery.format_table(releases))
+    return 1 if any(release['error'] for release in releases) else 0
+
+
+# releases maps packages to the releases a lockfile pins them to, which are
+# fetched without querying their upstreams
+def main(module_base,
+         module_dir,
+         packages,
+         work_dir,
+         network_jobs,
+         build_jobs,
+         verify=False,
+         cache_dir=artifact_cache.DEFAULT_CACHE_DIR,
+         cache_max_size=artifact_cache.DEFAULT_MAX_SIZE,
+         metadata_ttl=metadata_cache.DEFAULT_TTL,
+         force=False,
+         segments=1,
+         offline_mirror=None,
+         use_binary_cache=True,
+         version_specs=None,
+         releases=None,
+         from_source=()):
+    cache, metadata, index = installer_engine.setup(module_base, cache_dir,
+                                                    cache_max_size,
+                                                    metadata_ttl, segments,
+                                                    offline_mirror)
+    binaries = binary_cache.BinaryCache(cache) if use_binary_cache else None
+    output = ThreadOutput(sys.stdout)
+    scheduler = Scheduler({'network': network_jobs, 'build': build_jobs},
+                          output)
+    for package in packages:
+        installer = INSTALLERS[package]
+        package_dir = os.path.abspath(os.path.join(work_dir, package))
+        os.makedirs(package_dir, exist_ok=True)
+        log_file = os.path.join(package_dir, f'{package}.log')
+        fetch_options = {'from_source': True} if package in from_source else {}
+        if binaries is not None and package in BINARY_CACHED_FETCH:
+            fetch_options['binaries'] = binaries
+
+        scheduler.add(f'{package}:fetch',
+                      'network',
+                      lambda installer=installer, package_dir=package_dir,
+                      version_spec=(version_specs or {}).get(package),
+                      release=(releases or {}).get(package),
+                      fetch_options=fetch_options:
+                      installer.fetch_stage(module_dir,
+                                            package_dir,
+                                            verify,
+                                            cache,
+                                            metadata,
+                                            None if force else index,
+                                            version_spec=version_spec,
+                                            release=release,
+                                            **fetch_options),
+                      log_file=log_file)
+        scheduler.add(f'{package}:install',
+                      'build',
+                      lambda fetched, package=package: install_fetched(
+                          INSTALLERS[package], module_base, fetched, index,
+                          binaries if package in BINARY_CACHED else None),
+                      deps=[f'{package}:fetch'],
+                      log_file=log_file)
+    print(f'Scheduled {len(scheduler.tasks)} tasks for {", ".join(packages)}.')
+
+    def report(task):
+        if task.start is None:
+            print(f'Skipped {task.name}: {task.error}')
+        elif task.error is not None:
+            print(f'Failed {task.name} after {task.duration:.1f}s: '
+                  f'{task.error!r} (see {task.log_file})')
+        else:
+            print(f'Finished {task.name} in {task.duration:.1f}s.')
+
+    sys.stdout = output
+    wall_start = time.monotonic()
+    try:
+        tasks = scheduler.run(on_done=report)
+    finally:
+        sys.stdout = output.default
+    wall_time = time.monotonic() - wall_start
+
+    # The serial run would have executed every stage back to back
+    serial_time = sum(task.duration for task in tasks.values()
+                      if task.start is not None)
+    print(f'Wall time: {wall_time:.1f}s, serial time: {serial_time:.1f}s, '
+          f'saved: {serial_time - wall_time:.1f}s.')
+    print(artifact_cache.stats)
+    print(http_client.stats)
+
+    failed = [task.name for task in tasks.values() if task.error is not None]
+    if failed:
+        print(f'Failed tasks: {", ".join(failed)}.')
+        return 1
+    print('Done.')
+    return 0
+
+
+if __name__ == '__main__':
+    parser = installer_engine.argument_parser(
+        'Download and install several packages concurrently and generate their modules.',
+        skip=['--version-spec'])
+    parser.add_argument('--packages',
+                        nargs='+',
+                        choices=sorted(INSTALLERS),
+                        default=sorted(INSTALLERS),
+                        help='The packages to install.')
+    parser.add_argument('--work-dir',
+                        type=str,
+                        default='.',
+                        help='The directory for downloads and build trees.')
+    parser.add_argument('--network-jobs',
+                        type=int,
+                        default=len(INSTALLERS),
+                        help='The number of concurrent query and download stages.')
+    parser.add_argument('--build-jobs',
+                        type=int,
+                        default=1,
+                        help='The number of concurrent install stages.')
+    parser.add_argument('--version-spec',
+                        action='append',
+                        default=[],
+                        metavar='PACKAGE:SPEC',
+                        help="Install the latest version of PACKAGE that satisfies SPEC, e.g. 'cmake:>=3.27,<3.29' or 'git:~=2.44'. May be repeated.")
+    parser.add_argument('--check-updates',
+                        action='store_true',
+                        help='Only list the latest upstream versions next to the installed ones, without installing anything.')
+    parser.add_argument('--query-timeout',
+                        type=float,
+                        default=discovery.DEFAULT_TIMEOUT,
+                        help='Seconds to wait for each upstream with --check-updates.')
+    parser.add_argument('--from-source',
+                        nargs='+',
+                        choices=sorted(FROM_SOURCE),
+                        default=[],
+                        help='Build these packages from source instead of installing their binary releases.')
+    args = parser.parse_args()
+    version_specs = dict(
+        version_spec.split(':', 1) for version_spec in args.version_spec)
+    for package in version_specs:
+        assert package in INSTALLERS, f'Unknown package {package}.'
+
+    if args.check_updates:
+        sys.exit(
+            check_updates(args.module_base_dir, args.packages,
+                          args.cache_dir, args.metadata_ttl,
+                          args.query_timeout, args.offline_mirror,
+                          version_specs))
+
+    with run_report.run('install_all', args.report, args.history):
+        sys.exit(
+            main(args.module_base_dir, args.module_dir, args.packages,
+                 args.work_dir, args.network_jobs, args.build_jobs, args.verify,
+                 args.cache_dir, args.cache_max_size * 2**20, args.metadata_ttl,
+                 args.force, args.segments, args.offline_mirror,
+                 not args.no_binary_cache, version_specs,
+                 from_source=args.from_source))
@@ -6,17 +6,28 @@ if sys.version_info[0] < 3 or sys.version_info[1] < 6:
     print("Python version must be at least 3.6")
     sys.exit(1)
 
-import argparse
 import json
 import os
+import re
 import subprocess
 import urllib.parse
-import urllib.request
-import textwrap
 
+import artifact_cache
+import downloader
+import installer_engine
+import metadata_cache
+import run_report
+import version_index
 
-def query_cmake_org_latest_files(cmake_org_files_json):
-    release_info = json.load(urllib.request.urlopen(cmake_org_files_json))
+CMAKE_ORG_FILES_JSON = 'https://cmake.org/files/LatestRelease/cmake-latest-files-v1.json'
+# Lists a v<major>.<minor>/ directory per release series
+CMAKE_ORG_FILES = 'https://cmake.org/files/'
+
+
+def query_cmake_org_latest_files(cmake_org_files_json, metadata=None):
+    if metadata is None:
+        metadata = metadata_cache.MetadataCache(None)
+    release_info = json.loads(metadata.read(cmake_org_files_json))
     installer_query = list(
         filter(
             lambda i: os.uname().sysname in i['os'] and os.uname(
@@ -30,11 +41,89 @@ def query_cmake_org_latest_files(cmake_org_files_json):
     return installer_name, cmake_version
 
 
-def download_check_installer(installer_url, installer_name):
-    # Download the installer
-    http_result = urllib.request.urlretrieve(installer_url, installer_name)
-    assert http_result[
-        0] == installer_name, f'Failed to download {installer_name} from "{installer_url}".'
+# Release series on cmake.org/files as (series, directory URL) pairs
+def parse_cmake_org_series(files_html):
+    return dict((match.group(1),
+                 urllib.parse.urljoin(CMAKE_ORG_FILES, match.group(0)))
+                for match in re.finditer(r'v(\d+\.\d+)/', files_html)).items()
+
+
+# Installers for this system in a series directory as (version, installer
+# name) pairs, without release candidates. Older releases name the system
+# with a capital letter.
+def parse_cmake_org_installers(series_html):
+    pattern = (rf'cmake-(\d+\.\d+\.\d+)-{re.escape(os.uname().sysname)}-'
+               rf'{re.escape(os.uname().machine)}\.sh')
+    return dict((match.group(1), match.group(0)) for match in re.finditer(
+        pattern, series_html, re.IGNORECASE)).items()
+
+
+# Return the latest CMake version that satisfies the version spec and the
+# URL of its installer. The series directories are listed newest first,
+# skipping those the spec rules out, until one has a match.
+def query_cmake_org_version(spec, metadata=None):
+    if metadata is None:
+        metadata = metadata_cache.MetadataCache(None)
+    spec = version_index.VersionSpec(spec)
+    series = version_index.load(metadata, CMAKE_ORG_FILES, 'cmake.org-series',
+                                parse_cmake_org_series)
+    for series_key, _, series_url in reversed(series.releases):
+        if not spec.allows_series(series_key):
+            continue
+        installers = version_index.load(
+            metadata, series_url,
+            f'cmake.org-installers-{os.uname().sysname}-{os.uname().machine}',
+            parse_cmake_org_installers)
+        release = installers.resolve(spec)
+        if release is not None:
+            cmake_version, installer_name = release
+            return cmake_version, urllib.parse.urljoin(series_url,
+                                                       installer_name)
+    raise AssertionError(f'No CMake release matches {spec}.')
+
+
+# Look up the installer's digest in the release's SHA-256 listing, next to
+# release_url
+def query_cmake_installer_sha256(release_url,
+                                 cmake_version,
+                                 installer_name,
+                                 metadata=None):
+    sums_url = urllib.parse.urljoin(release_url,
+                                    f'cmake-{cmake_version}-SHA-256.txt')
+    return downloader.query_sha256sums(sums_url, installer_name, metadata)
+
+
+# Return the latest CMake version, or the latest one that satisfies the
+# version spec, and the URL of its installer
+def query_latest(metadata=None, spec=None):
+    if spec is not None:
+        return query_cmake_org_version(spec, metadata)
+    installer_name, cmake_version = query_cmake_org_latest_files(
+        CMAKE_ORG_FILES_JSON, metadata)
+    return cmake_version, urllib.parse.urljoin(CMAKE_ORG_FILES_JSON,
+                                               installer_name)
+
+
+# Return the digest of the installer at url of CMake version, or None if
+# cmake.org does not list one
+def query_digest(version, url, metadata=None):
+    return query_cmake_installer_sha256(
+        url, version, os.path.basename(urllib.parse.urlsplit(url).path),
+        metadata)
+
+
+def download_check_installer(installer_url,
+                             installer_name,
+                             sha256=None,
+                             cache=None):
+    # Download the installer through the artifact cache, verifying its digest
+    # while it streams in
+    if cache is None:
+        cache = artifact_cache.ArtifactCache(None)
+    cache.fetch(installer_url,
+                installer_name,
+                sha256=sha256,
+                status=f'Downloading {installer_url}...')
 
     # Assert that the installer file exists
     assert os.path.isfile(
@@ -77,99 +166,93 @@ def install_check_cmake(installer_name, cmake_version, install_dir):
 
 # Create an Lmod module file
 def create_check_modulefile(module_base, cmake_version, install_dir):
-    module_name = os.path.join('cmake', cmake_version)
-    # Create an Lmod module file
-    module_file = os.path.join(module_base, module_name)
-    os.makedirs(os.path.dirname(module_file), exist_ok=True)
-
-    module_file_content = textwrap.dedent(f'''\
-    #%Module
-    proc ModulesHelp {{ }} {{
-      puts stderr {{CMake {cmake_version}}}
-    }}
-    module-whatis {{CMake {cmake_version}}}
-    set root    {install_dir}
-    conflict    cmake
-    prepend-path    MANPATH         $root/man
-    prepend-path    PATH            $root/bin
-    prepend-path    ACLOCAL_PATH    $root/share/aclocal
-    setenv          CMAKE_COMMAND   $root/bin/cmake
-    setenv          CMAKE_VERSION   {cmake_version}''')
-
-    with open(module_file, 'w') as fh:
-        fh.write(module_file_content)
-
-    # Make sure the Lmod can load the module
-    lmod_proc = subprocess.run(f'module show cmake/{cmake_version}',
-                               shell=True,
-                               capture_output=True,
-                               text=True,
-                               env=dict(os.environ, LMOD_PAGER=''))
-    assert lmod_proc.returncode == 0, 'Lmod failed to load the module'
-    assert module_file in lmod_proc.stderr, 'Lmod failed to load the module'
-
-    return module_name
-
-
-def check_module(module_name, cmake_version, cmake_executable):
-    # Make sure the correct CMake executable is in the path.
-    cmake_proc = subprocess.run(f'module load {module_name} && which cmake',
-                                shell=True,
-                                capture_output=True,
-                                text=True,
-                                env=dict(os.environ, LMOD_PAGER=''))
-    assert cmake_proc.returncode == 0, 'CMake executable is not in the PATH set by the Lmod modulefile.'
-    assert os.path.samefile(
-        cmake_proc.stdout.rstrip(), cmake_executable
-    ), f'CMake executable loaded by Lmod is not the expected {cmake_version} verison. {cmake_proc.stdout}'
-
-    # Make sure the CMake executable is in the path works and is the version we expected.
-    cmake_proc = subprocess.run(
-        f'module load {module_name} && cmake --version',
-        shell=True,
-        capture_output=True,
-        text=True,
-        env=dict(os.environ, LMOD_PAGER=''))
-    assert cmake_proc.returncode == 0, 'Failed to run the CMake executable.\n' + \
-        cmake_proc.stderr
-    assert cmake_version in cmake_proc.stdout, f'CMake executable loaded in the Lmod file is not the expected {cmake_version} version: {cmake_proc.stdout}'
-
-
-def main(module_base, module_dir):
-    assert os.path.isdir(
-        module_base), f'Module base directory {module_base} does not exist.'
-    print(f'Using module base directory {module_base}.')
-
-    cmake_org_files_json = 'https://cmake.org/files/LatestRelease/cmake-latest-files-v1.json'
-
-    # Detect latest CMake release page from cmake.org's latest release JSON file
-    print('Querying CMake.org latest files...', end='', flush=True)
-    installer_name, cmake_version = query_cmake_org_latest_files(
-        cmake_org_files_json)
-    print(
-        f'\x1b[1K\rLatest CMake: {cmake_version}, Installer: {installer_name}')
+    return installer_engine.write_modulefile(
+        module_base, 'cmake', 'CMake', cmake_version, install_dir, [
+            ('prepend-path', 'MANPATH', '$root/man'),
+            ('prepend-path', 'PATH', '$root/bin'),
+            ('prepend-path', 'ACLOCAL_PATH', '$root/share/aclocal'),
+            ('setenv', 'CMAKE_COMMAND', '$root/bin/cmake'),
+            ('setenv', 'CMAKE_VERSION', cmake_version),
+        ])
+
+
+def check_module(module_name, cmake_version, cmake_executable, module_file=None):
+    installer_engine.check_module(module_name, 'cmake', cmake_executable,
+                                  cmake_version, module_file)
+
+
+# A release pinned by a lockfile, a dict with its "version", installer "url"
+# and "sha256" digest, is fetched as is, without querying cmake.org
+def fetch_stage(module_dir,
+                work_dir='.',
+                verify=False,
+                cache=None,
+                metadata=None,
+                index=None,
+                version_spec=None,
+                release=None):
+    if release is None:
+        # Detect latest CMake release page from cmake.org's latest release
+        # JSON file, or the release matching the version spec from its file
+        # listings
+        print('Querying CMake.org latest files...', end='', flush=True)
+        with run_report.stage('cmake', 'query'):
+            cmake_version, installer_url = query_latest(
+                metadata, version_spec)
+    else:
+        cmake_version, installer_url = release['version'], release['url']
+    installer_name = os.path.basename(urllib.parse.urlsplit(installer_url).path)
+    print(f'\x1b[1K\r{"Latest" if release is None else "Locked"} CMake: '
+          f'{cmake_version}, Installer: {installer_name}')
+
+    # Skip the download if this version is already installed and intact
+    if index is not None and index.is_current('cmake', cmake_version):
+        print(f'CMake {cmake_version} is already up to date.')
+        return None
 
     # Install directory
     install_dir = os.path.join(module_dir, 'cmake', cmake_version)
-    # Concat installer file name to base url
-    installer_url = urllib.parse.urljoin(cmake_org_files_json, installer_name)
-
-    print(f'Downloading {installer_url} to {installer_name}...',
+    installer_path = os.path.join(work_dir, installer_name)
+    if release is None:
+        with run_report.stage('cmake', 'query digest'):
+            sha256 = query_cmake_installer_sha256(installer_url, cmake_version,
+                                                  installer_name, metadata)
+    else:
+        sha256 = release['sha256']
+    assert sha256 or not verify, \
+        f'No upstream SHA-256 digest found for {installer_name}.'
+
+    print(f'Downloading {installer_url} to {installer_path}...',
           end='',
           flush=True)
-    download_check_installer(installer_url, installer_name)
-    print(f'\x1b[1K\rDownloaded {installer_name}.')
+    with run_report.stage('cmake', 'download'):
+        download_check_installer(installer_url, installer_path, sha256, cache)
+    print(f'\x1b[1K\rDownloaded {installer_path}.')
+
+    return {
+        'version': cmake_version,
+        'install_dir': install_dir,
+        'installer_path': installer_path,
+        'sha256': sha256,
+    }
+
+
+def install_stage(module_base, fetched, index=None):
+    cmake_version = fetched['version']
+    install_dir = fetched['install_dir']
+    installer_path = fetched['installer_path']
 
     print(f'Installing CMake {cmake_version} in {install_dir}...',
           end='',
           flush=True)
-    cmake_executable = install_check_cmake(installer_name, cmake_version,
-                                           install_dir)
+    with run_report.stage('cmake', 'install'):
+        cmake_executable = install_check_cmake(installer_path, cmake_version,
+                                               install_dir)
     print(f'\x1b[1K\rInstalled CMake {cmake_version} in {install_dir}.')
 
-    print(f'Removing {installer_name}...', end='', flush=True)
-    os.remove(installer_name)
-    print(f'\x1b[1K\rRemoved {installer_name}.')
+    print(f'Removing {installer_path}...', end='', flush=True)
+    os.remove(installer_path)
+    print(f'\x1b[1K\rRemoved {installer_path}.')
 
     print(f'Creating module file under {module_base}...', end='', flush=True)
     module_name = create_check_modulefile(module_base, cmake_version,
@@ -177,25 +260,52 @@ def main(module_base, module_dir):
     print(f'\x1b[1K\rCreated module file {module_name} under {module_base}.')
 
     print(f'Check created module {module_name}...', end='', flush=True)
-    check_module(module_name, cmake_version, cmake_executable)
+    with run_report.stage('cmake', 'lmod check'):
+        check_module(module_name, cmake_version, cmake_executable,
+                     os.path.join(module_base, module_name))
     print(f'\x1b[1K\rChecked created module {module_name}.')
 
-    print('Done.')
+    if index is not None:
+        index.record('cmake', cmake_version, install_dir,
+                     os.path.join(module_base, module_name), cmake_executable,
+                     fetched['sha256'])
+
+    return module_name
+
+
+def main(module_base,
+         module_dir,
+         verify=False,
+         cache_dir=artifact_cache.DEFAULT_CACHE_DIR,
+         cache_max_size=artifact_cache.DEFAULT_MAX_SIZE,
+         metadata_ttl=metadata_cache.DEFAULT_TTL,
+         force=False,
+         segments=1,
+         offline_mirror=None,
+         version_spec=None):
+    cache, metadata, index = installer_engine.setup(module_base, cache_dir,
+                                                    cache_max_size,
+                                                    metadata_ttl, segments,
+                                                    offline_mirror)
+    fetched = fetch_stage(module_dir,
+                          verify=verify,
+                          cache=cache,
+                          metadata=metadata,
+                          index=None if force else index,
+                          version_spec=version_spec)
+    if fetched is not None:
+        install_stage(module_base, fetched, index)
+
+    installer_engine.finish()
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(
-        description='Download the latest CMake installer from cmake.org and generate a module.'
-    )
-    parser.add_argument('--version', action='version', version='%(prog)s 1.0')
-    parser.add_argument('--module-base-dir',
-                        type=str,
-                        default=os.path.expanduser('~/.local/modules/'),
-                        help='The base directory for the module files.')
-    parser.add_argument('--module-dir',
-                        type=str,
-                        default=os.path.expanduser('~/.local/'),
-                        help='The directory for the module files.')
+    parser = installer_engine.argument_parser(
+        'Download the latest CMake installer from cmake.org and generate a module.',
+        skip=['--no-binary-cache'])
     args = parser.parse_args()
 
-    main(args.module_base_dir, args.module_dir)
+    with run_report.run('cmake', args.report, args.history):
+        main(args.module_base_dir, args.module_dir, args.verify, args.cache_dir,
+             args.cache_max_size * 2**20, args.metadata_ttl, args.force,
+             args.segments, args.offline_mirror, args.version_spec)
@@ -6,87 +6,258 @@ if sys.version_info[0] < 3 or sys.version_info[1] < 6:
     print("Python version must be at least 3.6")
     sys.exit(1)
 
-import argparse
 import json
 import os
 import re
 import shutil
 import subprocess
 import tarfile
+import time
 import urllib.parse
-import urllib.request
-import textwrap
-
-
-# Detect latest Git release from its kernel.org webpage
-def query_latest_git_release(latest_url):
-    def query_kernel_org(url):
-        latest_html = urllib.request.urlopen(latest_url).read().decode("utf-8")
-        # releases = re.findall(r'(?<=git-).[0-9.]*(?=.tar.gz)', latest_html)
-        # return max(releases, key=lambda k: [int(x) for x in k.split('.')])
-        releases = re.findall(r"[a-z-\.0-9]+\.tar\.xz", latest_html)
-        archive_name = max(
-            releases, key=lambda k: [
-                int(x) for x in re.split(
-                    r"-|\.", k) if x.isdigit()])
-        archive_url = urllib.parse.urljoin(latest_url, archive_name)
-        return archive_name, archive_url
-
-    def query_github(url):
-        # Get Git release info from GitHub as a JSON object
-        with urllib.request.urlopen(url) as http_response:
-            assert http_response.status == 200
-            git_release_info = http_response.read().decode("utf-8")
-
-        # Load HTTP response as a JSON object
-        tags_info = json.loads(git_release_info)
-        # Remove tags that include "-rc"
-        tags_info = [tag for tag in tags_info if "-rc" not in tag["name"]]
-        # Get the latest version of Git
-        # Lambda that removes the "v" prefix and converts version string to a
-        # list of integers
-
-        def get_version(v):
-            return [int(x) for x in v.lstrip("v").split(".")]
-        latest_tag = max(tags_info, key=get_version)
-        git_version = latest_tag["name"].lstrip("v")
-        # Get the download URL for the latest Git tarball
-        download_url = latest_tag["tarball_url"]
-        return git_version, download_url
 
+import artifact_cache
+import binary_cache
+import downloader
+import extractor
+import installer_engine
+import metadata_cache
+import run_report
+import version_index
+
+GIT_RELEASES_URL = "https://mirrors.edge.kernel.org/pub/software/scm/git/"
+# GIT_RELEASES_URL = "https://api.github.com/repos/git/git/tags"
+
+
+# Releases on the kernel.org index as (version, tarball name) pairs. Each
+# tarball is linked by name, and the docs tarballs (git-htmldocs-*,
+# git-manpages-*) do not match.
+def parse_kernel_org_index(latest_html):
+    return dict(
+        (match.group(1), match.group(0)) for match in re.finditer(
+            r"(?<![\w.-])git-(\d+(?:\.\d+)+)\.tar\.xz", latest_html)).items()
+
+
+# Releases in the GitHub tags listing as (version, tarball URL) pairs,
+# without release candidates
+def parse_github_tags(git_release_info):
+    return [(tag["name"].lstrip("v"), tag["tarball_url"])
+            for tag in json.loads(git_release_info)
+            if "-rc" not in tag["name"]]
+
+
+# Return the version index of the Git releases listed at latest_url, a
+# kernel.org index or the GitHub tags API
+def query_git_releases(latest_url, metadata=None):
+    if metadata is None:
+        metadata = metadata_cache.MetadataCache(None)
     if "kernel.org" in latest_url:
-        return query_kernel_org(latest_url)
+        return version_index.load(metadata, latest_url, "kernel.org-git",
+                                  parse_kernel_org_index)
     elif "github.com" in latest_url:
-        return query_github(latest_url)
+        return version_index.load(metadata, latest_url, "github-tags",
+                                  parse_github_tags)
     else:
         raise ValueError(f"Unsupported URL: {latest_url}")
 
 
-def download_check_archive(archive_name, archive_url):
-    http_result = urllib.request.urlretrieve(archive_url, archive_name)
+# Detect latest Git release, or the latest one that satisfies the version
+# spec, from its kernel.org webpage. Returns the tarball name and URL, or, for
+# GitHub tags, the version and the tarball URL.
+def query_latest_git_release(latest_url, metadata=None, spec=None):
+    releases = query_git_releases(latest_url, metadata)
+    release = releases.latest() if spec is None else releases.resolve(spec)
+    assert release is not None, \
+        f"No Git release at {latest_url} matches {spec or 'any version'}."
+    git_version, release = release
+    if "kernel.org" in latest_url:
+        return release, urllib.parse.urljoin(latest_url, release)
+    return git_version, release
+
+
+# Extract the Git version number from the tarball name
+def archive_version(archive_name):
+    return ".".join(
+        [x for x in re.split(r"-|\.", archive_name) if x.isdigit()])
+
+
+# Return the latest Git version, or the latest one that satisfies the version
+# spec, and the URL of its tarball
+def query_latest(metadata=None, spec=None):
+    archive_name, archive_url = query_latest_git_release(
+        GIT_RELEASES_URL, metadata, spec)
+    return archive_version(archive_name), archive_url
+
+
+# Look up the tarball's digest in kernel.org's signed SHA-256 listing. GitHub
+# tag tarballs are generated on the fly and have no published digest.
+def query_git_archive_sha256(latest_url, archive_name, metadata=None):
+    if "kernel.org" not in latest_url:
+        return None
+    sums_url = urllib.parse.urljoin(latest_url, "sha256sums.asc")
+    return downloader.query_sha256sums(sums_url, archive_name, metadata)
+
+
+# Return the digest of the tarball at url of Git version, or None if it has no
+# published digest
+def query_digest(version, url, metadata=None):
+    archive_name = os.path.basename(urllib.parse.urlsplit(url).path)
+    assert archive_version(archive_name) == version, \
+        f"{url} is not the tarball of Git {version}."
+    return query_git_archive_sha256(GIT_RELEASES_URL, archive_name, metadata)
+
+
+def download_check_archive(archive_name, archive_url, sha256=None, cache=None):
+    if cache is None:
+        cache = artifact_cache.ArtifactCache(None)
+    cache.fetch(archive_url,
+                archive_name,
+                sha256=sha256,
+                status=f"Downloading {archive_url}...")
 
-    assert (http_result[0] == archive_name
-            ), f'Failed to download {archive_name} from "{archive_url}".'
     assert os.path.isfile(
         archive_name), f"Git tarball file {archive_name} does not exist."
 
 
-def install_check_git(build_dir, install_dir, git_version):
+# Names of the files extracted into a build tree, so the next update can
+# remove those a new release dropped without touching build products
+SOURCE_MANIFEST = ".source-files"
+
+
+# Extract the tarball into a persistent build tree, dropping its top-level
+# directory. Files whose content did not change keep their timestamps, so make
+# only rebuilds what the new release touched. Files of the previous release
+# that the new one no longer has are removed, and members that would land
+# outside build_dir, through their names or links, are refused.
+def update_build_tree(archive_path, build_dir):
+    os.makedirs(build_dir, exist_ok=True)
+    names = set()
+    with tarfile.open(archive_path, "r") as archive:
+        for member in archive:
+            relative_name = member.name.partition("/")[2]
+            if not relative_name:
+                continue
+            assert member.isfile() or member.isdir() or member.issym() \
+                or member.islnk(), \
+                f"Unsupported archive member {member.name} in {archive_path}."
+            target = extractor.member_path(build_dir, relative_name)
+            if member.issym():
+                extractor.member_path(
+                    build_dir,
+                    os.path.join(os.path.dirname(relative_name),
+                                 member.linkname))
+            elif member.islnk():
+                member.linkname = member.linkname.partition("/")[2]
+                extractor.member_path(build_dir, member.linkname)
+            if not member.isdir():
+                names.add(relative_name)
+            if (member.isfile() and os.path.isfile(target)
+                    and not os.path.islink(target)
+                    and os.path.getsize(target) == member.size):
+                with archive.extractfile(member) as new_fh, \
+                        open(target, "rb") as old_fh:
+                    if new_fh.read() == old_fh.read():
+                        continue
+            member.name = relative_name
+            if not member.isdir():
+                extractor.remove_link(target)
+            archive.extract(member, build_dir)
+
+    manifest_file = os.path.join(build_dir, SOURCE_MANIFEST)
+    try:
+        with open(manifest_file) as fh:
+            old_names = set(fh.read().splitlines())
+    except FileNotFoundError:
+        old_names = set()
+    for name in sorted(old_names - names):
+        path = extractor.member_path(build_dir, name)
+        if os.path.islink(path) or os.path.isfile(path):
+            os.remove(path)
+    with open(manifest_file, "w") as fh:
+        fh.write("".join(f"{name}\n" for name in sorted(names)))
+
+
+# Download the tarball and extract it into work_dir in a single pipelined
+# pass. The partial build_dir is removed if the download fails verification.
+def download_extract_archive(archive_url,
+                             work_dir,
+                             build_dir,
+                             sha256=None,
+                             cache=None):
+    if cache is None:
+        cache = artifact_cache.ArtifactCache(None)
+    try:
+        cache.fetch_extract(archive_url,
+                            work_dir,
+                            sha256=sha256,
+                            status=f"Downloading {archive_url}...")
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    assert os.path.isdir(
+        build_dir), f"Git source directory {build_dir} does not exist."
+
+
+# configure arguments besides the prefix and the caches, which determine the
+# installed tree
+CONFIGURE_ARGS = ["--with-editor=vim"]
+
+
+# Configure and install Git from build_dir. If ccache_dir is given and ccache
+# is available, compiles go through ccache. If config_cache is given, autoconf
+# reuses the results of earlier runs. The configure and make install times are
+# stored in timings if given.
+def install_check_git(build_dir,
+                      install_dir,
+                      git_version,
+                      ccache_dir=None,
+                      config_cache=None,
+                      timings=None,
+                      configure_args=CONFIGURE_ARGS):
+    configure_command = [
+        "./configure", f"--prefix={install_dir}", "--quiet"
+    ] + list(configure_args)
+    build_env = dict(os.environ)
+    if ccache_dir is not None and shutil.which("ccache"):
+        build_env["CCACHE_DIR"] = ccache_dir
+        configure_command.append(f"CC=ccache {os.environ.get('CC', 'cc')}")
+    if config_cache is not None:
+        configure_command.append(f"--cache-file={config_cache}")
+    if timings is None:
+        timings = {}
+
     # Configure Git
-    subprocess.run(
-        [
-            "./configure", f"--prefix={install_dir}", "--with-editor=vim",
-            "--quiet"
-        ],
-        cwd=build_dir,
-        check=True,
-    )
+    start = time.monotonic()
+    with run_report.stage("git", "configure"):
+        try:
+            subprocess.run(configure_command,
+                           cwd=build_dir,
+                           env=build_env,
+                           check=True)
+        except subprocess.CalledProcessError:
+            # A cache from another compiler or environment makes configure
+            # bail out, so retry once without it
+            if config_cache is None or not os.path.exists(config_cache):
+                raise
+            os.remove(config_cache)
+            subprocess.run(configure_command,
+                           cwd=build_dir,
+                           env=build_env,
+                           check=True)
+    timings["configure"] = time.monotonic() - start
 
     # Install Git
-    subprocess.run(["make", "install", f"-j{os.cpu_count()}", "-s"],
-                   cwd=build_dir,
-                   check=True)
+    start = time.monotonic()
+    with run_report.stage("git", "make install"):
+        subprocess.run(["make", "install", f"-j{os.cpu_count()}", "-s"],
+                       cwd=build_dir,
+                       env=build_env,
+                       check=True)
+    timings["make install"] = time.monotonic() - start
+
+    return check_git(install_dir, git_version)
+
 
+def check_git(install_dir, git_version):
     # Assert that the installed Git file exists.
     git_executable = os.path.join(install_dir, "bin", "git")
     assert os.path.isfile(
@@ -105,115 +276,217 @@ def install_check_git(build_dir, install_dir, git_version):
 
 
 def create_check_modulefile(git_version, module_base, install_dir):
-    module_name = os.path.join("git", git_version)
-    # Create an Lmod module file
-    module_file = os.path.join(module_base, module_name)
-    os.makedirs(os.path.dirname(module_file), exist_ok=True)
-
-    module_file_content = textwrap.dedent(f"""\
-    #%Module
-    proc ModulesHelp {{ }} {{
-    puts stderr {{Git {git_version}}}
-    }}
-    module-whatis {{Git {git_version}}}
-    set root    {install_dir}
-    conflict    git
-    prepend-path    LD_LIBRARY_PATH $root/lib64
-    prepend-path    LIBRARY_PATH    $root/lib64
-    prepend-path    MANPATH         $root/share/man
-    prepend-path    PATH            $root/bin
-    """)
-
-    with open(module_file, "w") as fh:
-        fh.write(module_file_content)
-
-    # Make sure the Lmod can load the module
-    lmod_proc = subprocess.run(
-        f"module show git/{git_version}",
-        shell=True,
-        capture_output=True,
-        text=True,
-        env=dict(os.environ, LMOD_PAGER=""),
-    )
-    assert lmod_proc.returncode == 0, ("Lmod failed to load the module.\n" +
-                                       lmod_proc.stderr)
-    assert module_file in lmod_proc.stderr, "Lmod failed to load the module."
-    return module_name
-
-
-def check_module(module_name, git_version, git_executable):
-    # Make sure the correct Git executable is in the path.
-    git_proc = subprocess.run(
-        f"module load {module_name} && which git",
-        shell=True,
-        capture_output=True,
-        text=True,
-        env=dict(os.environ, LMOD_PAGER=""),
-    )
-    assert git_proc.returncode == 0, "Git executable is not in the PATH set by the Lmod modulefile."
-    assert os.path.samefile(
-        git_proc.stdout.rstrip(), git_executable
-    ), f"Git executable loaded by Lmod is not the expected {git_version} version. {git_proc.stdout}"
-
-    # Make sure the Git executable is in the path works and is the version we
-    # expected.
-    git_proc = subprocess.run(
-        f"module load {module_name} && git --version",
-        shell=True,
-        capture_output=True,
-        text=True,
-        env=dict(os.environ, LMOD_PAGER=""),
-    )
-    assert git_proc.returncode == 0, ("Failed to run the Git executable.\n" +
-                                      git_proc.stderr)
-    assert git_version in git_proc.stdout, f"Git executable loaded in the Lmod file is not the expected {git_version} version: {git_proc.stdout}"
-
-
-def main(module_base, module_dir):
-    assert os.path.isdir(
-        module_base), f"Module base directory {module_base} does not exist."
-    print(f"Using module base directory {module_base}.")
-
-    latest_url = "https://mirrors.edge.kernel.org/pub/software/scm/git/"
-    # latest_url = "https://api.github.com/repos/git/git/tags"
-
-    print(f"Querying {latest_url} for latest Git release...", end="", flush=True)
-    archive_name, archive_url = query_latest_git_release(latest_url)
-
-    # Extract Git version number from the tarball name
-    git_version = ".".join(
-        [x for x in re.split(r"-|\.", archive_name) if x.isdigit()])
-    print(
-        f"\x1b[1K\rLatest Git version: {git_version}, Tarball: {archive_name}")
-
-    print(
-        f"Downloading {archive_name} from {archive_url}...",
-        end="",
-        flush=True)
-    download_check_archive(archive_name, archive_url)
-    print(f"\x1b[1K\rDownloaded {archive_name}.")
-
-    # Extract the tarball
-    print(f"Extracting {archive_name}...", end="", flush=True)
-    with tarfile.open(archive_name, "r") as archive:
-        archive.extractall()
-    print(f"\x1b[1K\rExtracted {archive_name}.")
-
-    build_dir = ".".join(archive_name.split(".")[:-2])
-    install_dir = os.path.join(module_dir, 'git', git_version)
+    return installer_engine.write_modulefile(
+        module_base, "git", "Git", git_version, install_dir, [
+            ("prepend-path", "LD_LIBRARY_PATH", "$root/lib64"),
+            ("prepend-path", "LIBRARY_PATH", "$root/lib64"),
+            ("prepend-path", "MANPATH", "$root/share/man"),
+            ("prepend-path", "PATH", "$root/bin"),
+        ])
+
+
+def check_module(module_name, git_version, git_executable, module_file=None):
+    installer_engine.check_module(module_name, "git", git_executable,
+                                  git_version, module_file)
+
+
+# A release pinned by a lockfile, a dict with its "version", tarball "url",
+# "sha256" digest and optionally the "configure_args" to build it with, is
+# fetched as is, without querying the upstream. If binaries, the BinaryCache,
+# can restore the release, nothing is downloaded.
+def fetch_stage(module_dir,
+                work_dir=".",
+                verify=False,
+                cache=None,
+                metadata=None,
+                index=None,
+                stream=True,
+                version_spec=None,
+                release=None,
+                binaries=None):
+    latest_url = GIT_RELEASES_URL
+
+    if release is None:
+        print(f"Querying {latest_url} for latest Git release...",
+              end="",
+              flush=True)
+        with run_report.stage("git", "query"):
+            archive_name, archive_url = query_latest_git_release(
+                latest_url, metadata, version_spec)
+    else:
+        archive_url = release["url"]
+        archive_name = os.path.basename(urllib.parse.urlsplit(archive_url).path)
+
+    git_version = archive_version(archive_name)
+    print(f"\x1b[1K\r{'Latest' if release is None else 'Locked'} Git "
+          f"version: {git_version}, Tarball: {archive_name}")
+
+    # Skip the download if this version is already installed and intact
+    if index is not None and index.is_current("git", git_version):
+        print(f"Git {git_version} is already up to date.")
+        return None
+
+    if release is None:
+        with run_report.stage("git", "query digest"):
+            sha256 = query_git_archive_sha256(latest_url, archive_name,
+                                              metadata)
+    else:
+        sha256 = release["sha256"]
+    assert sha256 or not verify, \
+        f"No upstream SHA-256 digest found for {archive_name}."
+
+    install_dir = os.path.join(module_dir, "git", git_version)
+    configure_args = (release or {}).get("configure_args", CONFIGURE_ARGS)
+    fetched = {
+        "version": git_version,
+        "install_dir": install_dir,
+        "archive_url": archive_url,
+        "archive_path": None,
+        "build_dir": os.path.join(work_dir,
+                                  ".".join(archive_name.split(".")[:-2])),
+        "work_dir": work_dir,
+        "sha256": sha256,
+        "configure_args": configure_args,
+    }
+
+    # Skip the download if the binary cache can restore the build. Should the
+    # entry be gone by then, install_stage downloads the tarball after all.
+    if binaries is not None and binaries.lookup(
+            binaries.key("git", git_version, configure_args)[0],
+            install_dir) is not None:
+        print(f"Git {git_version} is in the binary cache, "
+              f"skipping the download.")
+        fetched["downloaded"] = False
+        return fetched
+
+    download_source(fetched, cache, stream)
+    return fetched
+
+
+# Download the tarball of a release returned by fetch_stage. With stream, the
+# tarball is extracted into its build directory while it downloads and never
+# stored in the work directory.
+def download_source(fetched, cache=None, stream=True):
+    archive_url = fetched["archive_url"]
+    archive_name = os.path.basename(urllib.parse.urlsplit(archive_url).path)
+    if stream:
+        print(
+            f"Downloading and extracting {archive_name} from {archive_url}...",
+            end="",
+            flush=True)
+        with run_report.stage("git", "download and extract"):
+            download_extract_archive(archive_url, fetched["work_dir"],
+                                     fetched["build_dir"], fetched["sha256"],
+                                     cache)
+        print(f"\x1b[1K\rDownloaded and extracted {archive_name}.")
+        fetched["archive_path"] = None
+    else:
+        archive_path = os.path.join(fetched["work_dir"], archive_name)
+        print(
+            f"Downloading {archive_name} from {archive_url}...",
+            end="",
+            flush=True)
+        with run_report.stage("git", "download"):
+            download_check_archive(archive_path, archive_url,
+                                   fetched["sha256"], cache)
+        print(f"\x1b[1K\rDownloaded {archive_path}.")
+        fetched["archive_path"] = archive_path
+    fetched["downloaded"] = True
+
+
+# If build_cache_dir is given, Git is built incrementally in a persistent
+# build tree per release series (e.g. 2.44) under it, with a ccache directory
+# and an autoconf cache that are kept across runs. This needs the tarball to
+# have been downloaded by fetch_stage without streaming.
+def install_stage(module_base,
+                  fetched,
+                  index=None,
+                  build_cache_dir=None,
+                  binaries=None):
+    git_version = fetched["version"]
+    install_dir = fetched["install_dir"]
+    archive_path = fetched["archive_path"]
+    build_dir = fetched["build_dir"]
+    configure_args = fetched["configure_args"]
+    ccache_dir = None
+    config_cache = None
+
+    # Restore a build of the same version with the same configuration and
+    # toolchain from the binary cache
+    build_key = None
+    restored = False
+    if binaries is not None:
+        build_key, build = binaries.key("git", git_version, configure_args)
+        print(f"Looking up Git {git_version} in the binary cache...",
+              end="",
+              flush=True)
+        start = time.monotonic()
+        with run_report.stage("git", "binary cache"):
+            restored = binaries.restore(build_key, install_dir)
+        if restored:
+            print(f"\x1b[1K\rRestored Git {git_version} in {install_dir} "
+                  f"from the binary cache in {time.monotonic() - start:.1f}s.")
+        else:
+            print(f"\x1b[1K\rGit {git_version} is not in the binary cache.")
+
+    # fetch_stage left the download to a binary cache entry that is gone now
+    if not restored and not fetched.get("downloaded", True):
+        download_source(fetched, stream=build_cache_dir is None)
+        archive_path = fetched["archive_path"]
+
+    # Extract the tarball, unless fetch_stage already did while downloading
+    if not restored and build_cache_dir is not None:
+        assert archive_path is not None, \
+            "Incremental builds need the downloaded tarball."
+        print(f"Extracting {archive_path}...", end="", flush=True)
+        series = ".".join(git_version.split(".")[:2])
+        build_dir = os.path.join(build_cache_dir, f"git-{series}")
+        ccache_dir = os.path.join(build_cache_dir, "ccache")
+        config_cache = os.path.abspath(
+            os.path.join(build_cache_dir, f"config.cache-{series}"))
+        with run_report.stage("git", "extract"):
+            update_build_tree(archive_path, build_dir)
+        print(f"\x1b[1K\rExtracted {archive_path} into {build_dir}.")
+    elif not restored and archive_path is not None:
+        print(f"Extracting {archive_path}...", end="", flush=True)
+        with run_report.stage("git", "extract"):
+            extract_stats = extractor.extract_archive(archive_path,
+                                                      fetched["work_dir"])
+        print(f"\x1b[1K\rExtracted {archive_path} ({extract_stats}).")
 
     # Configure and install Git
-    print(f"Installing Git {git_version} in {install_dir}...",
-          end="",
-          flush=True)
-    git_executable = install_check_git(build_dir, install_dir, git_version)
-    print(f"\x1b[1K\rInstalled Git {git_version} in {install_dir}.")
-
-    # Remove downloaded tarball and build directory
-    print(f"Removing up {archive_name} and {build_dir}...", end="", flush=True)
-    os.remove(archive_name)
-    shutil.rmtree(build_dir, ignore_errors=True)
-    print(f"\x1b[1K\rRemoved {archive_name} and {build_dir}.")
+    if restored:
+        git_executable = check_git(install_dir, git_version)
+    else:
+        print(f"Installing Git {git_version} in {install_dir}...",
+              end="",
+              flush=True)
+        timings = {}
+        git_executable = install_check_git(build_dir, install_dir,
+                                           git_version, ccache_dir,
+                                           config_cache, timings,
+                                           configure_args)
+        print(f"\x1b[1K\rInstalled Git {git_version} in {install_dir} "
+              f"(configure: {timings['configure']:.1f}s, "
+              f"make install: {timings['make install']:.1f}s).")
+        if build_key is not None:
+            print("Storing the build in the binary cache...",
+                  end="",
+                  flush=True)
+            with run_report.stage("git", "binary cache store"):
+                binaries.store(build_key, build, install_dir)
+            print("\x1b[1K\rStored the build in the binary cache.")
+
+    # Remove downloaded tarball and, unless it is kept for the next build,
+    # the build directory
+    if archive_path is not None:
+        print(f"Removing {archive_path}...", end="", flush=True)
+        os.remove(archive_path)
+        print(f"\x1b[1K\rRemoved {archive_path}.")
+    if build_cache_dir is None:
+        print(f"Removing {build_dir}...", end="", flush=True)
+        shutil.rmtree(build_dir, ignore_errors=True)
+        print(f"\x1b[1K\rRemoved {build_dir}.")
 
     # Create a modulefile for Git
     print(f"Creating module file under {module_base}...", end="", flush=True)
@@ -222,29 +495,64 @@ def main(module_base, module_dir):
 
     # Check if the modulefile works
     print(f"Check created module {module_base}...", end="", flush=True)
-    check_module(module_name, git_version, git_executable)
+    with run_report.stage("git", "lmod check"):
+        check_module(module_name, git_version, git_executable,
+                     os.path.join(module_base, module_name))
     print(f"\x1b[1K\rChecked module file {module_name}.")
 
-    print("Done.")
+    if index is not None:
+        index.record("git", git_version, install_dir,
+                     os.path.join(module_base, module_name), git_executable,
+                     fetched["sha256"])
+
+    return module_name
+
+
+def main(module_base,
+         module_dir,
+         verify=False,
+         cache_dir=artifact_cache.DEFAULT_CACHE_DIR,
+         cache_max_size=artifact_cache.DEFAULT_MAX_SIZE,
+         metadata_ttl=metadata_cache.DEFAULT_TTL,
+         force=False,
+         build_cache_dir=None,
+         segments=1,
+         offline_mirror=None,
+         use_binary_cache=True,
+         version_spec=None):
+    cache, metadata, index = installer_engine.setup(module_base, cache_dir,
+                                                    cache_max_size,
+                                                    metadata_ttl, segments,
+                                                    offline_mirror)
+    binaries = binary_cache.BinaryCache(cache) if use_binary_cache else None
+    fetched = fetch_stage(module_dir,
+                          verify=verify,
+                          cache=cache,
+                          metadata=metadata,
+                          index=None if force else index,
+                          stream=build_cache_dir is None and segments == 1,
+                          version_spec=version_spec,
+                          binaries=binaries)
+    if fetched is not None:
+        install_stage(module_base, fetched, index, build_cache_dir, binaries)
+
+    installer_engine.finish()
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description="Download the latest Git tarball from kernel.org and generate a module."
-    )
-    parser.add_argument("--version", action="version", version="%(prog)s 1.0")
-    parser.add_argument(
-        "--module-base-dir",
-        type=str,
-        default=os.path.expanduser("~/.local/modules/"),
-        help="The base directory for the module files.",
+    parser = installer_engine.argument_parser(
+        "Download the latest Git tarball from kernel.org and generate a module."
     )
     parser.add_argument(
-        "--module-dir",
+        "--build-cache-dir",
         type=str,
-        default=os.path.expanduser("~/.local/"),
-        help="The directory for the module files.",
+        default=None,
+        help="Keep the build tree, ccache and autoconf cache in this directory for incremental rebuilds.",
     )
     args = parser.parse_args()
 
-    main(args.module_base_dir, args.module_dir)
+    with run_report.run("git", args.report, args.history):
+        main(args.module_base_dir, args.module_dir, args.verify, args.cache_dir,
+             args.cache_max_size * 2**20, args.metadata_ttl, args.force,
+             args.build_cache_dir, args.segments, args.offline_mirror,
+             not args.no_binary_cache, args.version_spec)
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+# Python version must be at least 3.6
+import sys
+if sys.version_info[0] < 3 or sys.version_info[1] < 6:
+    print("Python version must be at least 3.6")
+    sys.exit(1)
+
+# Recipe for GNU Parallel, built from the latest tarball on ftp.gnu.org
+
+import functools
+
+import installer_engine
+
+RECIPE = installer_engine.Recipe(
+    'parallel',
+    'GNU Parallel',
+    installer_engine.ListingSource(
+        'https://ftp.gnu.org/gnu/parallel/',
+        r'(?P<url>parallel-(?P<version>\d+)\.tar\.bz2)(?!\.sig)'))
+
+query_latest = functools.partial(installer_engine.query_latest, RECIPE)
+query_digest = functools.partial(installer_engine.query_digest, RECIPE)
+fetch_stage = functools.partial(installer_engine.fetch_stage, RECIPE)
+install_stage = functools.partial(installer_engine.install_stage, RECIPE)
+main = functools.partial(installer_engine.main, RECIPE)
+
+if __name__ == '__main__':
+    installer_engine.cli(RECIPE)
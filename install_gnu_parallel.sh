@@ -18,14 +18,13 @@ export FILE_MODULE=${HOME}/.local/modules/parallel/${PARALLEL_VERSION}
 
 [[ ! -d ${DIR_INSTALL} ]] && mkdir -p ${DIR_INSTALL}
 
-curl -JLO https://ftp.gnu.org/gnu/parallel/${TARBALL_NAME}
-tar xf ${TARBALL_NAME}
+# Extract the tarball while it downloads instead of storing it first
+curl -fL https://ftp.gnu.org/gnu/parallel/${TARBALL_NAME} | tar xjf -
 (
   cd parallel-${PARALLEL_VERSION}
   ./configure --prefix=${DIR_INSTALL}
   make install
 )
-rm -f ./${TARBALL_NAME}
 rm -rf parallel-${PARALLEL_VERSION}
 
 mkdir -p $(dirname ${FILE_MODULE})
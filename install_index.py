@@ -0,0 +1,85 @@
+# Index of the packages installed under a module base directory. Each entry
+# records where a package version was installed, its modulefile and
+# executable, the digest of the artifact it was installed from and when its
+# module was last verified. The installers use it to skip versions that are
+# already installed and still intact.
+
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+import time
+
+# Hidden, so Lmod does not mistake it for a modulefile
+INDEX_FILE_NAME = '.install-index.json'
+
+
+class InstallIndex:
+    def __init__(self, module_base):
+        self.index_file = os.path.join(module_base, INDEX_FILE_NAME)
+
+    # A missing index is empty, and so is one that cannot be read or parsed,
+    # e.g. truncated by a crash or a full disk. Installers record the versions
+    # they install again, which rewrites it.
+    def load(self):
+        try:
+            with open(self.index_file) as fh:
+                entries = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def lookup(self, package, version):
+        return self.load().get(package, {}).get(version)
+
+    # Whether the install directory, modulefile and executable of an index
+    # entry still exist
+    @staticmethod
+    def is_intact(entry):
+        return (os.path.isdir(entry['install_dir'])
+                and os.path.isfile(entry['module_file'])
+                and os.access(entry['executable'], os.X_OK))
+
+    # Whether package version is indexed and still intact
+    def is_current(self, package, version):
+        entry = self.lookup(package, version)
+        return entry is not None and self.is_intact(entry)
+
+    # Serialize writers across threads, processes and nodes sharing the
+    # module base directory
+    @contextlib.contextmanager
+    def locked(self):
+        with open(self.index_file + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def record(self,
+               package,
+               version,
+               install_dir,
+               module_file,
+               executable,
+               sha256=None):
+        with self.locked():
+            entries = self.load()
+            entries.setdefault(package, {})[version] = {
+                'install_dir': os.path.abspath(install_dir),
+                'module_file': os.path.abspath(module_file),
+                'executable': os.path.abspath(executable),
+                'sha256': sha256,
+                'verified': time.time(),
+            }
+            tmp_fd, tmp_file = tempfile.mkstemp(
+                prefix=INDEX_FILE_NAME + '.',
+                dir=os.path.dirname(self.index_file))
+            try:
+                with os.fdopen(tmp_fd, 'w') as fh:
+                    json.dump(entries, fh, indent=2, sort_keys=True)
+                os.replace(tmp_file, self.index_file)
+            finally:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
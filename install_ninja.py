@@ -6,53 +6,177 @@ if sys.version_info[0] < 3 or sys.version_info[1] < 6:
     print("Python version must be at least 3.6")
     sys.exit(1)
 
-# Get the lastest version of Ninja from GitHub
+# Get the lastest version of Ninja from GitHub. With --from-source, or on
+# machines GitHub publishes no Linux binary for, Ninja is built from its source
+# tarball instead: in parallel with CMake and an existing ninja or make if
+# CMake is available, or else with Ninja's own bootstrap, through ccache if it
+# is installed. Source builds are kept in the binary cache.
 
-import argparse
 import json
 import os
 import stat
 import shutil
 import subprocess
-import textwrap
-import urllib.request
+import time
 import zipfile
 
+import artifact_cache
+import binary_cache
+import extractor
+import installer_engine
+import metadata_cache
+import run_report
+import version_index
 
-def query_latest_release(release_info_url):
-    # Get Ninja release info from GitHub as a JSON object
-    with urllib.request.urlopen(release_info_url) as http_response:
-        assert http_response.status == 200, f"Failed to get release info from {release_info_url}"
-        release_info = json.loads(http_response.read().decode('utf-8'))
+RELEASE_INFO_URL = "https://api.github.com/repos/ninja-build/ninja/releases/latest"
+RELEASES_URL = "https://api.github.com/repos/ninja-build/ninja/releases?per_page=100"
+SOURCE_URL = "https://github.com/ninja-build/ninja/archive/refs/tags/v{version}.tar.gz"
 
-    # Get the latest version of Ninja
-    ninja_version = release_info["tag_name"].lstrip('v')
 
-    # Get the download URL for the latest Linux version of Ninja
+# Return the download URL and digest (or None) of the Linux zip for this
+# machine among a release's assets, or None if it has none. Releases since
+# 1.12 have a separate aarch64 zip.
+def linux_asset(release_info):
+    aarch64 = os.uname().machine == 'aarch64'
     linux_assets = [asset for asset in release_info['assets']
-                    if asset['name'].endswith('.zip') and 'linux' in asset['name']]
+                    if asset['name'].endswith('.zip') and 'linux' in asset['name']
+                    and ('aarch64' in asset['name']) == aarch64]
+    if not linux_assets:
+        return None
     assert len(linux_assets) == 1, "There should be only one Linux asset"
-    linux_asset = linux_assets[0]
+    asset = linux_assets[0]
 
-    download_url = linux_asset['browser_download_url']
-    return ninja_version, download_url
+    download_url = asset['browser_download_url']
+    # GitHub publishes asset digests as "sha256:<hex>"
+    digest = asset.get('digest') or ''
+    sha256 = digest[len('sha256:'):] if digest.startswith('sha256:') else None
+    return download_url, sha256
 
 
-def download_check_archive(download_url, dest_file):
-    # Download the latest version of Ninja
-    with urllib.request.urlopen(download_url) as http_response:
-        assert http_response.status == 200, f"Failed to download {download_url}"
-        with open(dest_file, 'wb') as dest_file_handle:
-            dest_file_handle.write(http_response.read())
-
-    # Assert that the downloaded file at dest_file is a zip file
-    assert zipfile.is_zipfile(
-        dest_file), f"Downloaded file {dest_file} is not a zip file."
+def query_latest_release(release_info_url, metadata=None):
+    # Get Ninja release info from GitHub as a JSON object
+    if metadata is None:
+        metadata = metadata_cache.MetadataCache(None)
+    release_info = json.loads(metadata.read(release_info_url))
 
+    # Get the latest version of Ninja
+    ninja_version = release_info["tag_name"].lstrip('v')
 
-def install_check_ninja(ninja_version, install_dir):
-    # Check that the Ninja executable exists in the current directory
-    ninja_exe_cur = os.path.abspath('ninja')
+    # Get the download URL for the latest Linux version of Ninja
+    asset = linux_asset(release_info)
+    assert asset is not None, "There should be a Linux asset"
+    download_url, sha256 = asset
+    return ninja_version, download_url, sha256
+
+
+# Releases in the GitHub releases listing that have a Linux zip for this
+# machine as (version, [download URL, digest]) pairs, without drafts and
+# prereleases
+def parse_releases(releases_json):
+    releases = []
+    for release_info in json.loads(releases_json):
+        if release_info.get('draft') or release_info.get('prerelease'):
+            continue
+        asset = linux_asset(release_info)
+        if asset is not None:
+            releases.append((release_info['tag_name'].lstrip('v'),
+                             list(asset)))
+    return releases
+
+
+# Return the latest Ninja version that satisfies the version spec, and the
+# download URL and digest of its Linux zip
+def query_release(spec, metadata=None):
+    if metadata is None:
+        metadata = metadata_cache.MetadataCache(None)
+    releases = version_index.load(metadata, RELEASES_URL,
+                                  f'github-releases-{os.uname().machine}',
+                                  parse_releases)
+    release = releases.resolve(spec)
+    assert release is not None, f'No Ninja release matches {spec}.'
+    ninja_version, (download_url, sha256) = release
+    return ninja_version, download_url, sha256
+
+
+# Whether GitHub publishes a Linux zip of the latest release for this machine
+def binary_available(metadata=None):
+    if metadata is None:
+        metadata = metadata_cache.MetadataCache(None)
+    return linux_asset(json.loads(metadata.read(RELEASE_INFO_URL))) is not None
+
+
+# Releases in the GitHub releases listing as (version, tag) pairs, without
+# drafts and prereleases, whether or not they have a binary for this machine
+def parse_source_releases(releases_json):
+    return [(release_info['tag_name'].lstrip('v'), release_info['tag_name'])
+            for release_info in json.loads(releases_json)
+            if not release_info.get('draft')
+            and not release_info.get('prerelease')]
+
+
+# Return the latest Ninja version, or the latest one that satisfies the
+# version spec, and the URL of its source tarball
+def query_source_release(metadata=None, spec=None):
+    if metadata is None:
+        metadata = metadata_cache.MetadataCache(None)
+    if spec is None:
+        ninja_version = json.loads(
+            metadata.read(RELEASE_INFO_URL))['tag_name'].lstrip('v')
+    else:
+        release = version_index.load(metadata, RELEASES_URL,
+                                     'github-releases-source',
+                                     parse_source_releases).resolve(spec)
+        assert release is not None, f'No Ninja release matches {spec}.'
+        ninja_version = release[0]
+    return ninja_version, SOURCE_URL.format(version=ninja_version)
+
+
+# Return the latest Ninja version, or the latest one that satisfies the
+# version spec, and the URL of its Linux release zip, or of its source tarball
+# if GitHub publishes no binary for this machine
+def query_latest(metadata=None, spec=None):
+    if not binary_available(metadata):
+        return query_source_release(metadata, spec)
+    if spec is not None:
+        return query_release(spec, metadata)[:2]
+    return query_latest_release(RELEASE_INFO_URL, metadata)[:2]
+
+
+# Return the digest GitHub lists for the Linux zip at url of Ninja version, or
+# None if it lists none. Source tarballs are generated on the fly and have no
+# published digest.
+def query_digest(version, url, metadata=None):
+    if url == SOURCE_URL.format(version=version):
+        return None
+    # The latest release needs no listing of all releases
+    latest_version, download_url, sha256 = query_latest_release(
+        RELEASE_INFO_URL, metadata)
+    if latest_version != version:
+        _, download_url, sha256 = query_release(f'=={version}', metadata)
+    assert download_url == url, \
+        f'Ninja {version} is released at {download_url}, not {url}.'
+    return sha256
+
+
+def download_check_archive(download_url, dest_file, sha256=None, cache=None):
+    # Download the latest version of Ninja through the artifact cache,
+    # verifying its digest while it streams in
+    if cache is None:
+        cache = artifact_cache.ArtifactCache(None)
+    cache.fetch(download_url,
+                dest_file,
+                sha256=sha256,
+                status=f'Downloading {download_url}...')
+
+    # Without a digest, at least assert that dest_file is a zip file
+    if sha256 is None:
+        assert zipfile.is_zipfile(
+            dest_file), f"Downloaded file {dest_file} is not a zip file."
+
+
+def install_check_ninja(ninja_version, install_dir, work_dir='.'):
+    # Check that the Ninja executable exists in the working directory
+    ninja_exe_cur = os.path.abspath(os.path.join(work_dir, 'ninja'))
     # Assert the ninja executable path is correct
     assert os.path.isfile(
         ninja_exe_cur), f"The ninja executable {ninja_exe_cur} does not exist."
@@ -74,6 +198,11 @@ def install_check_ninja(ninja_version, install_dir):
     assert os.path.isfile(os.path.join(install_dir, 'ninja')), \
         f'{os.path.join(install_dir, "ninja")} does not exist.'
 
+    return check_ninja(ninja_version, install_dir)
+
+
+def check_ninja(ninja_version, install_dir):
+    ninja_executable = os.path.join(install_dir, 'ninja')
     # Assert that the installed Ninja file is executable
     assert os.access(ninja_executable, os.X_OK), \
         f'{ninja_executable} is not executable.'
@@ -87,104 +216,258 @@ def install_check_ninja(ninja_version, install_dir):
     return ninja_executable
 
 
-# Create an Lmod module file
-def create_check_modulefile(module_base, ninja_version, install_dir):
-    module_name = os.path.join('ninja', ninja_version)
-    module_file = os.path.join(module_base, module_name)
-    os.makedirs(os.path.dirname(module_file), exist_ok=True)
-
-    module_file_content = textwrap.dedent(f"""\
-    #%Module
-    proc ModulesHelp {{ }} {{
-    puts stderr {{Ninja {ninja_version}}}
-    }}
-    module-whatis {{Ninja {ninja_version}}}
-    set root    {install_dir}
-    conflict    ninja
-    prepend-path    PATH            $root""")
-
-    with open(module_file, 'w') as fh:
-        fh.write(module_file_content)
-
-    # Make sure the Lmod can load the module
-    lmod_proc = subprocess.run(f'module show ninja/{ninja_version}',
-                               shell=True,
-                               capture_output=True,
-                               text=True,
-                               env=dict(os.environ, LMOD_PAGER=''))
-    assert lmod_proc.returncode == 0, 'Lmod failed to load the module'
-    assert module_file in lmod_proc.stderr, 'Lmod failed to load the module'
-
-    return module_name
+def run_build_step(command, cwd, env=None):
+    build_proc = subprocess.run(command,
+                                cwd=cwd,
+                                env=env,
+                                capture_output=True,
+                                text=True)
+    assert build_proc.returncode == 0, \
+        f'{" ".join(command)} failed:\n{build_proc.stdout}{build_proc.stderr}'
+
+
+# Build Ninja in source_dir and return the directory of the built binary.
+# With CMake, the build runs in parallel with an existing ninja, or make
+# otherwise. Without it, or for releases before 1.10 that have no CMake
+# build, Ninja bootstraps itself. Compiles go through ccache if it is
+# installed.
+def build_ninja(source_dir, timings):
+    source_dir = os.path.abspath(source_dir)
+    ccache = shutil.which('ccache')
+    cmake = shutil.which('cmake')
+    if cmake and os.path.isfile(os.path.join(source_dir, 'CMakeLists.txt')):
+        build_dir = os.path.join(source_dir, 'build')
+        configure_command = [
+            cmake, '-S', source_dir, '-B', build_dir,
+            '-DCMAKE_BUILD_TYPE=Release', '-DBUILD_TESTING=OFF'
+        ]
+        if shutil.which('ninja'):
+            configure_command += ['-G', 'Ninja']
+        if ccache:
+            configure_command.append(f'-DCMAKE_CXX_COMPILER_LAUNCHER={ccache}')
+        start = time.monotonic()
+        with run_report.stage('ninja', 'configure'):
+            run_build_step(configure_command, source_dir)
+        timings['configure'] = time.monotonic() - start
+
+        start = time.monotonic()
+        with run_report.stage('ninja', 'build'):
+            run_build_step([
+                cmake, '--build', build_dir, '--target', 'ninja',
+                '--parallel', str(os.cpu_count())
+            ], source_dir)
+        timings['build'] = time.monotonic() - start
+        return build_dir
+
+    build_env = dict(os.environ)
+    if ccache:
+        build_env['CXX'] = f'{ccache} {os.environ.get("CXX", "c++")}'
+    start = time.monotonic()
+    with run_report.stage('ninja', 'bootstrap'):
+        run_build_step([sys.executable, 'configure.py', '--bootstrap'],
+                       source_dir, build_env)
+    timings['bootstrap'] = time.monotonic() - start
+    return source_dir
 
 
-def check_module(module_name, ninja_version, ninja_executable):
-    # Make sure the correct ninja executable is in the path.
-    ninja_proc = subprocess.run(f'module load {module_name} && which ninja',
-                                shell=True,
-                                capture_output=True,
-                                text=True,
-                                env=dict(os.environ, LMOD_PAGER=''))
-    assert ninja_proc.returncode == 0, 'ninja executable is not in the PATH set by the Lmod modulefile.'
-    assert os.path.samefile(
-        ninja_proc.stdout.rstrip(), ninja_executable
-    ), f'ninja executable loaded by Lmod is not the expected {ninja_version} verison. {ninja_proc.stdout}'
-
-    # Make sure the ninja executable is in the path works and is the version
-    # we expected.
-    ninja_proc = subprocess.run(
-        f'module load {module_name} && ninja --version',
-        shell=True,
-        capture_output=True,
-        text=True,
-        env=dict(os.environ, LMOD_PAGER=''))
-    assert ninja_proc.returncode == 0, 'Failed to run the ninja executable.\n' + \
-        ninja_proc.stderr
-    assert ninja_version in ninja_proc.stdout, f'ninja executable loaded in the Lmod file is not the expected {ninja_version} version: {ninja_proc.stdout}'
-
-
-def main(module_base, module_dir):
-    # Assert that the base module directory exists
-    assert os.path.isdir(
-        module_base), f'Module base directory {module_base} does not exist.'
-    print(f'Using module base directory {module_base}.')
-
-    # Get the latest Ninja release info from GitHub
-    print('Querying GitHub for the latest Ninja release info...', end='', flush=True)
-    release_info_url = "https://api.github.com/repos/ninja-build/ninja/releases/latest"
-    ninja_version, download_url = query_latest_release(release_info_url)
-    print(f"\x1b[1K\rLatest Ninja version: {ninja_version}.")
+# Create an Lmod module file
+def create_check_modulefile(module_base, ninja_version, install_dir):
+    return installer_engine.write_modulefile(
+        module_base, 'ninja', 'Ninja', ninja_version, install_dir,
+        [('prepend-path', 'PATH', '$root')])
+
+
+def check_module(module_name, ninja_version, ninja_executable, module_file=None):
+    installer_engine.check_module(module_name, 'ninja', ninja_executable,
+                                  ninja_version, module_file)
+
+
+# A release pinned by a lockfile, a dict with its "version", zip or source
+# tarball "url" and "sha256" digest, is fetched as is, without querying
+# GitHub. With from_source, or if GitHub publishes no binary for this machine,
+# the source tarball is fetched to build Ninja from.
+def fetch_stage(module_dir,
+                work_dir='.',
+                verify=False,
+                cache=None,
+                metadata=None,
+                index=None,
+                version_spec=None,
+                release=None,
+                from_source=False):
+    if release is not None:
+        ninja_version, download_url, sha256 = release['version'], release[
+            'url'], release['sha256']
+        from_source = download_url == SOURCE_URL.format(version=ninja_version)
+        print(f'Locked Ninja version: {ninja_version}.')
+    elif from_source or not binary_available(metadata):
+        if not from_source:
+            print(f'GitHub has no Linux Ninja binary for '
+                  f'{os.uname().machine}, building from source.')
+            from_source = True
+        print('Querying GitHub for the latest Ninja release...', end='', flush=True)
+        with run_report.stage('ninja', 'query'):
+            ninja_version, download_url = query_source_release(
+                metadata, version_spec)
+        sha256 = None
+        print(f"\x1b[1K\rLatest Ninja version: {ninja_version}.")
+    else:
+        # Get the latest Ninja release info from GitHub
+        print('Querying GitHub for the latest Ninja release info...', end='', flush=True)
+        release_info_url = RELEASE_INFO_URL
+        with run_report.stage('ninja', 'query'):
+            if version_spec is None:
+                ninja_version, download_url, sha256 = query_latest_release(
+                    release_info_url, metadata)
+            else:
+                ninja_version, download_url, sha256 = query_release(
+                    version_spec, metadata)
+        print(f"\x1b[1K\rLatest Ninja version: {ninja_version}.")
+
+    # Skip the download if this version is already installed and intact
+    if index is not None and index.is_current('ninja', ninja_version):
+        print(f'Ninja {ninja_version} is already up to date.')
+        return None
+    assert sha256 or not verify, \
+        f'No upstream SHA-256 digest found for {download_url}.'
+
+    if from_source:
+        # Extract the tarball while it downloads
+        if cache is None:
+            cache = artifact_cache.ArtifactCache(None)
+        source_dir = os.path.join(work_dir, f'ninja-{ninja_version}')
+        print(f'Downloading and extracting {download_url}...',
+              end='',
+              flush=True)
+        try:
+            with run_report.stage('ninja', 'download and extract'):
+                extract_stats = cache.fetch_extract(
+                    download_url,
+                    work_dir,
+                    sha256=sha256,
+                    status=f'Downloading {download_url}...')
+        except BaseException:
+            shutil.rmtree(source_dir, ignore_errors=True)
+            raise
+        assert os.path.isdir(
+            source_dir), f'Source directory {source_dir} does not exist.'
+        print(f'\x1b[1K\rDownloaded and extracted {download_url} '
+              f'({extract_stats}).')
+        return {
+            'version': ninja_version,
+            'install_dir': os.path.join(module_dir, 'ninja', ninja_version),
+            'archive_path': None,
+            'source_dir': source_dir,
+            'work_dir': work_dir,
+            'sha256': sha256,
+        }
 
     # Target download file name
-    archive_name = "ninja.zip"
+    archive_path = os.path.join(work_dir, "ninja.zip")
 
     # Download the latest version of Ninja
-    print(f'Downloading {download_url} to {archive_name}...',
+    print(f'Downloading {download_url} to {archive_path}...',
           end='',
           flush=True)
-    download_check_archive(download_url, archive_name)
-    print(f'\x1b[1K\rDownloaded {archive_name}.')
-
-    # Unzip the archive
-    print(f"Extracting {archive_name}...", end="", flush=True)
-    with zipfile.ZipFile(archive_name, 'r') as zip_ref:
-        for file in zip_ref.namelist():
-            zip_ref.extract(file, ".")
-    print(f"\x1b[1K\rExtracted {archive_name}.")
-
-    install_dir = os.path.join(module_dir, 'ninja', ninja_version)
+    with run_report.stage('ninja', 'download'):
+        download_check_archive(download_url, archive_path, sha256, cache)
+    print(f'\x1b[1K\rDownloaded {archive_path}.')
+
+    return {
+        'version': ninja_version,
+        'install_dir': os.path.join(module_dir, 'ninja', ninja_version),
+        'archive_path': archive_path,
+        'source_dir': None,
+        'work_dir': work_dir,
+        'sha256': sha256,
+    }
+
+
+# Build Ninja from the source fetched by fetch_stage into install_dir, or
+# restore a build of the same version with the same toolchain from the binary
+# cache, and return the installed executable
+def install_from_source(fetched, binaries=None):
+    ninja_version = fetched['version']
+    install_dir = fetched['install_dir']
+    source_dir = fetched['source_dir']
+
+    build_key = None
+    restored = False
+    if binaries is not None:
+        # Ninja is C++, so the C++ compiler identifies the build
+        build_key, build = binaries.key('ninja',
+                                        ninja_version, ['source'],
+                                        os.environ.get('CXX', 'c++'))
+        print(f'Looking up Ninja {ninja_version} in the binary cache...',
+              end='',
+              flush=True)
+        start = time.monotonic()
+        with run_report.stage('ninja', 'binary cache'):
+            restored = binaries.restore(build_key, install_dir)
+        if restored:
+            print(f'\x1b[1K\rRestored Ninja {ninja_version} in {install_dir} '
+                  f'from the binary cache in {time.monotonic() - start:.1f}s.')
+        else:
+            print(f'\x1b[1K\rNinja {ninja_version} is not in the binary cache.')
+
+    if restored:
+        ninja_executable = check_ninja(ninja_version, install_dir)
+    else:
+        print(f'Building Ninja {ninja_version} in {source_dir}...',
+              end='',
+              flush=True)
+        timings = {}
+        build_dir = build_ninja(source_dir, timings)
+        with run_report.stage('ninja', 'install'):
+            ninja_executable = install_check_ninja(ninja_version, install_dir,
+                                                   build_dir)
+        print(f'\x1b[1K\rBuilt Ninja {ninja_version} in {install_dir} (' +
+              ', '.join(f'{step}: {seconds:.1f}s'
+                        for step, seconds in timings.items()) + ').')
+        if build_key is not None:
+            print('Storing the build in the binary cache...',
+                  end='',
+                  flush=True)
+            with run_report.stage('ninja', 'binary cache store'):
+                binaries.store(build_key, build, install_dir)
+            print('\x1b[1K\rStored the build in the binary cache.')
+
+    print(f'Removing {source_dir}...', end='', flush=True)
+    shutil.rmtree(source_dir, ignore_errors=True)
+    print(f'\x1b[1K\rRemoved {source_dir}.')
+    return ninja_executable
 
-    print(f"Moving Ninja {ninja_version} binary to {install_dir}...",
-          end="",
-          flush=True)
-    # Install Ninja to install_dir
-    ninja_executable = install_check_ninja(ninja_version, install_dir)
-    print(f"\x1b[1K\rMoved Ninja {ninja_version} binary to {install_dir}.")
 
-    # Remove the archive
-    print(f'Removing {archive_name}...', end='', flush=True)
-    os.remove(archive_name)
-    print(f'\x1b[1K\rRemoved {archive_name}.')
+# With a binary cache, a source build of the same version with the same
+# toolchain is restored instead of built. Binary releases are not cached.
+def install_stage(module_base, fetched, index=None, binaries=None):
+    ninja_version = fetched['version']
+    install_dir = fetched['install_dir']
+    archive_path = fetched['archive_path']
+
+    if fetched['source_dir'] is not None:
+        ninja_executable = install_from_source(fetched, binaries)
+    else:
+        # Unzip the archive
+        print(f"Extracting {archive_path}...", end="", flush=True)
+        with run_report.stage('ninja', 'extract'):
+            extract_stats = extractor.extract_archive(archive_path,
+                                                      fetched['work_dir'])
+        print(f"\x1b[1K\rExtracted {archive_path} ({extract_stats}).")
+
+        print(f"Moving Ninja {ninja_version} binary to {install_dir}...",
+              end="",
+              flush=True)
+        # Install Ninja to install_dir
+        with run_report.stage('ninja', 'install'):
+            ninja_executable = install_check_ninja(ninja_version, install_dir,
+                                                   fetched['work_dir'])
+        print(f"\x1b[1K\rMoved Ninja {ninja_version} binary to {install_dir}.")
+
+        # Remove the archive
+        print(f'Removing {archive_path}...', end='', flush=True)
+        os.remove(archive_path)
+        print(f'\x1b[1K\rRemoved {archive_path}.')
 
     # Create a modulefile for Git
     print(f'Creating module file under {module_base}...', end='', flush=True)
@@ -194,25 +477,61 @@ def main(module_base, module_dir):
 
     # Check if the modulefile works
     print(f'Check created module {module_base}...', end='', flush=True)
-    check_module(module_name, ninja_version, ninja_executable)
+    with run_report.stage('ninja', 'lmod check'):
+        check_module(module_name, ninja_version, ninja_executable,
+                     os.path.join(module_base, module_name))
     print(f'\x1b[1K\rChecked created module {module_name}.')
 
-    print("Done.")
+    if index is not None:
+        index.record('ninja', ninja_version, install_dir,
+                     os.path.join(module_base, module_name), ninja_executable,
+                     fetched['sha256'])
+
+    return module_name
+
+
+def main(module_base,
+         module_dir,
+         verify=False,
+         cache_dir=artifact_cache.DEFAULT_CACHE_DIR,
+         cache_max_size=artifact_cache.DEFAULT_MAX_SIZE,
+         metadata_ttl=metadata_cache.DEFAULT_TTL,
+         force=False,
+         segments=1,
+         offline_mirror=None,
+         version_spec=None,
+         from_source=False,
+         use_binary_cache=True):
+    cache, metadata, index = installer_engine.setup(module_base, cache_dir,
+                                                    cache_max_size,
+                                                    metadata_ttl, segments,
+                                                    offline_mirror)
+    fetched = fetch_stage(module_dir,
+                          verify=verify,
+                          cache=cache,
+                          metadata=metadata,
+                          index=None if force else index,
+                          version_spec=version_spec,
+                          from_source=from_source)
+    if fetched is not None:
+        install_stage(
+            module_base, fetched, index,
+            binary_cache.BinaryCache(cache) if use_binary_cache else None)
+
+    installer_engine.finish()
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(
-        description='Download the latest Ninja binary from Github and generate a module.'
+    parser = installer_engine.argument_parser(
+        'Download the latest Ninja binary from Github, or build it from source, and generate a module.'
     )
-    parser.add_argument('--version', action='version', version='%(prog)s 1.0')
-    parser.add_argument('--module-base-dir',
-                        type=str,
-                        default=os.path.expanduser('~/.local/modules/'),
-                        help='The base directory for the module files.')
-    parser.add_argument('--module-dir',
-                        type=str,
-                        default=os.path.expanduser('~/.local/'),
-                        help='The directory for the module files.')
+    parser.add_argument('--from-source',
+                        action='store_true',
+                        help='Build Ninja from its source tarball instead of installing the GitHub binary, e.g. where the binary does not run.')
     args = parser.parse_args()
 
-    main(args.module_base_dir, args.module_dir)
+    with run_report.run('ninja', args.report, args.history):
+        main(args.module_base_dir, args.module_dir, args.verify, args.cache_dir,
+             args.cache_max_size * 2**20, args.metadata_ttl, args.force,
+             args.segments, args.offline_mirror, args.version_spec,
+             args.from_source, not args.no_binary_cache)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+# Python version must be at least 3.6
+import sys
+if sys.version_info[0] < 3 or sys.version_info[1] < 6:
+    print("Python version must be at least 3.6")
+    sys.exit(1)
+
+# Recipe for Ruby, built from the latest stable tarball listed in the index of
+# cache.ruby-lang.org, which also publishes its SHA-256 digest
+
+import functools
+
+import installer_engine
+
+RECIPE = installer_engine.Recipe(
+    'ruby',
+    'Ruby',
+    installer_engine.ListingSource(
+        'https://cache.ruby-lang.org/pub/ruby/index.txt',
+        # Columns: name, URL, SHA-1, SHA-256, SHA-512
+        r'^ruby-(?P<version>\d+\.\d+\.\d+)\t(?P<url>\S+\.tar\.gz)\t\w+\t'
+        r'(?P<sha256>[0-9a-f]{64})\t'),
+    env=[
+        ('prepend-path', 'LD_LIBRARY_PATH', '$root/lib'),
+        ('prepend-path', 'LIBRARY_PATH', '$root/lib'),
+        ('prepend-path', 'MANPATH', '$root/share/man'),
+        ('prepend-path', 'CPATH', '$root/include'),
+        ('prepend-path', 'PATH', '$root/bin'),
+    ])
+
+query_latest = functools.partial(installer_engine.query_latest, RECIPE)
+query_digest = functools.partial(installer_engine.query_digest, RECIPE)
+fetch_stage = functools.partial(installer_engine.fetch_stage, RECIPE)
+install_stage = functools.partial(installer_engine.install_stage, RECIPE)
+main = functools.partial(installer_engine.main, RECIPE)
+
+if __name__ == '__main__':
+    installer_engine.cli(RECIPE)
@@ -0,0 +1,486 @@
+# Common installer engine for packages described by a declarative Recipe: where
+# their releases are listed, which artifact to take, how to build it, and what
+# its modulefile sets. Every recipe runs through the same query, download,
+# extract, build, modulefile and Lmod check pipeline, built on the shared
+# download engine, artifact and metadata caches, extractor and install index.
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import textwrap
+import time
+import urllib.parse
+
+import artifact_cache
+import binary_cache
+import downloader
+import http_client
+import install_index
+import lmod_check
+import metadata_cache
+import run_report
+import version_index
+
+# Modulefile environment of a package installed with the usual prefix layout
+DEFAULT_ENV = [
+    ('prepend-path', 'MANPATH', '$root/share/man'),
+    ('prepend-path', 'PATH', '$root/bin'),
+]
+
+
+# Versions compare by their numeric components, so 2.10 is newer than 2.9
+def version_key(version):
+    return [int(x) for x in re.findall(r'\d+', version)]
+
+
+# A release source that matches pattern against a listing, such as a
+# directory index or an index file. Each match is a release and pattern names
+# its "version", its artifact "url" (absolute or relative to the listing),
+# and optionally its "sha256" digest. Without a digest in the listing, it is
+# looked up in the sha256sum-style listing at sums_url, formatted with the
+# version, if one is given.
+class ListingSource:
+    def __init__(self, listing_url, pattern, sums_url=None):
+        self.listing_url = listing_url
+        self.pattern = pattern
+        self.sums_url = sums_url
+
+    # Releases in the listing as (version, [artifact URL, listed digest or
+    # None]) pairs
+    def parse(self, listing):
+        return [(match.group('version'), [
+            urllib.parse.urljoin(self.listing_url, match.group('url')),
+            match.groupdict().get('sha256')
+        ]) for match in re.finditer(self.pattern, listing, re.MULTILINE)]
+
+    # Return the version index of the releases in the listing
+    def releases(self, metadata):
+        return version_index.load(metadata, self.listing_url,
+                                  f'listing:{self.pattern}', self.parse)
+
+    # Return the version, artifact URL and listed digest (or None) of the
+    # latest release, or of the latest one that satisfies the version spec,
+    # from the listing alone
+    def latest(self, metadata, spec=None):
+        releases = self.releases(metadata)
+        release = releases.latest() if spec is None else releases.resolve(spec)
+        assert release is not None, \
+            f'No release in {self.listing_url} matches {spec or "any version"}.'
+        version, (url, sha256) = release
+        return version, url, sha256
+
+    # Return the version, artifact URL and digest (or None) of the latest
+    # release, or of the latest one that satisfies the version spec
+    def query(self, metadata, spec=None):
+        version, url, sha256 = self.latest(metadata, spec)
+        if sha256 is None and self.sums_url is not None:
+            sha256 = downloader.query_sha256sums(
+                urllib.parse.urljoin(self.listing_url,
+                                     self.sums_url.format(version=version)),
+                os.path.basename(urllib.parse.urlsplit(url).path), metadata)
+        return version, url, sha256
+
+
+class Recipe:
+    # name is the package's module name and, unless command is given, the
+    # executable checked after installing it. The artifact of source.query()
+    # must be a tarball with a <name>-<version> top-level directory, built by
+    # the named build strategy. env lists the (command, variable, value)
+    # lines of the modulefile.
+    def __init__(self,
+                 name,
+                 title,
+                 source,
+                 build='configure',
+                 configure_args=(),
+                 env=DEFAULT_ENV,
+                 command=None):
+        assert build in BUILDERS, f'Unknown build strategy {build}.'
+        self.name = name
+        self.title = title
+        self.source = source
+        self.build = build
+        self.configure_args = list(configure_args)
+        self.env = env
+        self.command = command or name
+
+
+# Return the latest version of the recipe's package, or the latest one that
+# satisfies the version spec, and its artifact URL
+def query_latest(recipe, metadata=None, spec=None):
+    if metadata is None:
+        metadata = metadata_cache.MetadataCache(None)
+    return recipe.source.latest(metadata, spec)[:2]
+
+
+# Return the digest of the artifact at url of the recipe's package version, or
+# None if the upstream does not publish one
+def query_digest(recipe, version, url, metadata=None):
+    if metadata is None:
+        metadata = metadata_cache.MetadataCache(None)
+    _, release_url, sha256 = recipe.source.query(metadata, f'=={version}')
+    assert release_url == url, \
+        f'{recipe.title} {version} is listed at {release_url}, not {url}.'
+    return sha256
+
+
+# "./configure --prefix && make install" in source_dir
+def build_configure(recipe, source_dir, install_dir, configure_args, timings):
+    start = time.monotonic()
+    with run_report.stage(recipe.name, 'configure'):
+        subprocess.run(['./configure', f'--prefix={install_dir}', '--quiet'] +
+                       configure_args,
+                       cwd=source_dir,
+                       check=True)
+    timings['configure'] = time.monotonic() - start
+
+    start = time.monotonic()
+    with run_report.stage(recipe.name, 'make install'):
+        subprocess.run(['make', 'install', f'-j{os.cpu_count()}', '-s'],
+                       cwd=source_dir,
+                       check=True)
+    timings['make install'] = time.monotonic() - start
+
+
+BUILDERS = {
+    'configure': build_configure,
+}
+
+
+# Assert that the installed executable works with its absolute path and is
+# the expected version, and return its path
+def check_executable(command, version, install_dir):
+    executable = os.path.join(install_dir, 'bin', command)
+    assert os.path.isfile(
+        executable), f'Executable {executable} does not exist.'
+
+    version_proc = subprocess.run([executable, '--version'],
+                                  capture_output=True,
+                                  text=True)
+    assert version_proc.returncode == 0, version_proc.stderr
+    assert version in version_proc.stdout, \
+        f'{executable} is not the expected version: {version_proc.stdout}'
+    return executable
+
+
+# Write the Lmod modulefile <package>/<version> under module_base and return
+# its module name. env lists its (command, variable, value) lines.
+def write_modulefile(module_base, package, title, version, install_dir, env):
+    module_name = os.path.join(package, version)
+    module_file = os.path.join(module_base, module_name)
+    os.makedirs(os.path.dirname(module_file), exist_ok=True)
+
+    module_file_content = textwrap.dedent(f'''\
+    #%Module
+    proc ModulesHelp {{ }} {{
+      puts stderr {{{title} {version}}}
+    }}
+    module-whatis {{{title} {version}}}
+    set root    {install_dir}
+    conflict    {package}
+    ''') + ''.join(f'{command:<16}{variable:<16}{value}\n'
+                   for command, variable, value in env)
+
+    with open(module_file, 'w') as fh:
+        fh.write(module_file_content)
+
+    return module_name
+
+
+def check_module(module_name, command, executable, version, module_file=None):
+    # Make sure Lmod shows the module from module_file, and that loading it
+    # puts the expected executable of the expected version in the path. All
+    # checks run in a single shell.
+    lmod_check.check_modules([
+        lmod_check.ModuleCheck(module_name,
+                               command,
+                               executable=executable,
+                               version=version,
+                               module_file=module_file)
+    ])
+
+
+# A release pinned by a lockfile, a dict with its "version", artifact "url",
+# "sha256" digest and optionally the "configure_args" to build it with, is
+# fetched as is, without querying the upstream
+def fetch_stage(recipe,
+                module_dir,
+                work_dir='.',
+                verify=False,
+                cache=None,
+                metadata=None,
+                index=None,
+                version_spec=None,
+                release=None):
+    if cache is None:
+        cache = artifact_cache.ArtifactCache(None)
+    if metadata is None:
+        metadata = metadata_cache.MetadataCache(None)
+
+    if release is None:
+        print(f'Querying {recipe.source.listing_url} for the latest '
+              f'{recipe.title} release...',
+              end='',
+              flush=True)
+        with run_report.stage(recipe.name, 'query'):
+            version, url, sha256 = recipe.source.query(metadata, version_spec)
+        print(f'\x1b[1K\rLatest {recipe.title}: {version}, Tarball: {url}')
+    else:
+        version, url, sha256 = release['version'], release['url'], release[
+            'sha256']
+        print(f'Locked {recipe.title}: {version}, Tarball: {url}')
+
+    # Skip the download if this version is already installed and intact
+    if index is not None and index.is_current(recipe.name, version):
+        print(f'{recipe.title} {version} is already up to date.')
+        return None
+    assert sha256 or not verify, f'No upstream SHA-256 digest found for {url}.'
+
+    # Extract the tarball while it downloads
+    source_dir = os.path.join(work_dir, f'{recipe.name}-{version}')
+    print(f'Downloading and extracting {url}...', end='', flush=True)
+    try:
+        with run_report.stage(recipe.name, 'download and extract'):
+            extract_stats = cache.fetch_extract(
+                url, work_dir, sha256=sha256, status=f'Downloading {url}...')
+    except BaseException:
+        shutil.rmtree(source_dir, ignore_errors=True)
+        raise
+    assert os.path.isdir(
+        source_dir), f'Source directory {source_dir} does not exist.'
+    print(f'\x1b[1K\rDownloaded and extracted {url} ({extract_stats}).')
+
+    return {
+        'version': version,
+        'install_dir': os.path.join(module_dir, recipe.name, version),
+        'source_dir': source_dir,
+        'sha256': sha256,
+        'configure_args': (release or {}).get('configure_args',
+                                              recipe.configure_args),
+    }
+
+
+# With a binary cache, a build of the same version with the same
+# configuration and toolchain is restored instead of built
+def install_stage(recipe, module_base, fetched, index=None, binaries=None):
+    version = fetched['version']
+    install_dir = fetched['install_dir']
+    source_dir = fetched['source_dir']
+    configure_args = fetched['configure_args']
+
+    build_key = None
+    restored = False
+    if binaries is not None:
+        build_key, build = binaries.key(recipe.name, version,
+                                        [recipe.build] + configure_args)
+        print(f'Looking up {recipe.title} {version} in the binary cache...',
+              end='',
+              flush=True)
+        start = time.monotonic()
+        with run_report.stage(recipe.name, 'binary cache'):
+            restored = binaries.restore(build_key, install_dir)
+        if restored:
+            print(f'\x1b[1K\rRestored {recipe.title} {version} in '
+                  f'{install_dir} from the binary cache in '
+                  f'{time.monotonic() - start:.1f}s.')
+        else:
+            print(f'\x1b[1K\r{recipe.title} {version} is not in the binary '
+                  f'cache.')
+
+    if restored:
+        executable = check_executable(recipe.command, version, install_dir)
+    else:
+        print(f'Installing {recipe.title} {version} in {install_dir}...',
+              end='',
+              flush=True)
+        timings = {}
+        BUILDERS[recipe.build](recipe, source_dir, install_dir,
+                               configure_args, timings)
+        executable = check_executable(recipe.command, version, install_dir)
+        print(f'\x1b[1K\rInstalled {recipe.title} {version} in '
+              f'{install_dir} (' + ', '.join(
+                  f'{step}: {seconds:.1f}s'
+                  for step, seconds in timings.items()) + ').')
+        if build_key is not None:
+            print('Storing the build in the binary cache...',
+                  end='',
+                  flush=True)
+            with run_report.stage(recipe.name, 'binary cache store'):
+                binaries.store(build_key, build, install_dir)
+            print('\x1b[1K\rStored the build in the binary cache.')
+
+    print(f'Removing {source_dir}...', end='', flush=True)
+    shutil.rmtree(source_dir, ignore_errors=True)
+    print(f'\x1b[1K\rRemoved {source_dir}.')
+
+    print(f'Creating module file under {module_base}...', end='', flush=True)
+    module_name = write_modulefile(module_base, recipe.name, recipe.title,
+                                   version, install_dir, recipe.env)
+    print(f'\x1b[1K\rCreated module file {module_name} under {module_base}.')
+
+    print(f'Check created module {module_name}...', end='', flush=True)
+    with run_report.stage(recipe.name, 'lmod check'):
+        check_module(module_name, recipe.command, executable, version,
+                     os.path.join(module_base, module_name))
+    print(f'\x1b[1K\rChecked created module {module_name}.')
+
+    if index is not None:
+        index.record(recipe.name, version, install_dir,
+                     os.path.join(module_base, module_name), executable,
+                     fetched['sha256'])
+
+    return module_name
+
+
+# Check the module base directory and return the artifact cache, metadata
+# cache and install index of an install run. With an offline mirror, every
+# query and download is served from it instead.
+def setup(module_base,
+          cache_dir=artifact_cache.DEFAULT_CACHE_DIR,
+          cache_max_size=artifact_cache.DEFAULT_MAX_SIZE,
+          metadata_ttl=metadata_cache.DEFAULT_TTL,
+          segments=1,
+          offline_mirror=None):
+    assert os.path.isdir(
+        module_base), f'Module base directory {module_base} does not exist.'
+    print(f'Using module base directory {module_base}.')
+
+    if offline_mirror:
+        # The mirror is local already, so there is nothing to cache
+        print(f'Using offline mirror {offline_mirror}.')
+        http_client.offline_mirror = offline_mirror
+        cache_dir = None
+
+    return (artifact_cache.ArtifactCache(cache_dir, cache_max_size, segments),
+            metadata_cache.MetadataCache(cache_dir, metadata_ttl),
+            install_index.InstallIndex(module_base))
+
+
+# Print the download statistics at the end of an install run
+def finish():
+    print(artifact_cache.stats)
+    print(http_client.stats)
+
+    print('Done.')
+
+
+def main(recipe,
+         module_base,
+         module_dir,
+         verify=False,
+         cache_dir=artifact_cache.DEFAULT_CACHE_DIR,
+         cache_max_size=artifact_cache.DEFAULT_MAX_SIZE,
+         metadata_ttl=metadata_cache.DEFAULT_TTL,
+         force=False,
+         offline_mirror=None,
+         use_binary_cache=True,
+         version_spec=None,
+         segments=1):
+    cache, metadata, index = setup(module_base, cache_dir, cache_max_size,
+                                   metadata_ttl, segments, offline_mirror)
+    fetched = fetch_stage(recipe,
+                          module_dir,
+                          verify=verify,
+                          cache=cache,
+                          metadata=metadata,
+                          index=None if force else index,
+                          version_spec=version_spec)
+    if fetched is not None:
+        install_stage(
+            recipe, module_base, fetched, index,
+            binary_cache.BinaryCache(cache) if use_binary_cache else None)
+    finish()
+
+
+# Command line flags shared by the install scripts, as add_argument's
+# arguments
+ARGUMENTS = [
+    ('--module-base-dir', {
+        'type': str,
+        'default': os.path.expanduser('~/.local/modules/'),
+        'help': 'The base directory for the module files.',
+    }),
+    ('--module-dir', {
+        'type': str,
+        'default': os.path.expanduser('~/.local/'),
+        'help': 'The directory for the module files.',
+    }),
+    ('--verify', {
+        'action': 'store_true',
+        'help': 'Fail before installing if the upstream SHA-256 digest is unavailable.',
+    }),
+    ('--cache-dir', {
+        'type': str,
+        'default': artifact_cache.DEFAULT_CACHE_DIR,
+        'help': 'The shared download cache directory. Pass an empty string to disable it.',
+    }),
+    ('--cache-max-size', {
+        'type': int,
+        'default': artifact_cache.DEFAULT_MAX_SIZE // 2**20,
+        'help': 'The download cache size limit in MiB.',
+    }),
+    ('--metadata-ttl', {
+        'type': int,
+        'default': metadata_cache.DEFAULT_TTL,
+        'help': 'Seconds during which cached release metadata is used without querying upstream.',
+    }),
+    ('--force', {
+        'action': 'store_true',
+        'help': 'Reinstall even if the latest version is already installed.',
+    }),
+    ('--segments', {
+        'type': int,
+        'default': 1,
+        'help': 'Download large artifacts with this many concurrent range requests.',
+    }),
+    ('--offline-mirror', {
+        'type': str,
+        'default': None,
+        'help': 'Serve all queries and downloads from this directory, populated by mirror.py sync.',
+    }),
+    ('--no-binary-cache', {
+        'action': 'store_true',
+        'help': 'Always build from source instead of restoring a cached build.',
+    }),
+    ('--version-spec', {
+        'type': str,
+        'default': None,
+        'help': "Install the latest version that satisfies this spec, e.g. '>=3.27,<3.29' or '~=2.44', instead of the latest one.",
+    }),
+    ('--report', {
+        'type': str,
+        'default': None,
+        'help': 'Write the JSON run report to this file.',
+    }),
+    ('--history', {
+        'type': str,
+        'default': None,
+        'help': 'Append the JSON run report to this history file.',
+    }),
+]
+
+
+# Command line parser with the shared flags, or only those named in only,
+# less those in skip. Scripts add their own flags on top.
+def argument_parser(description, skip=(), only=None):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--version', action='version', version='%(prog)s 1.0')
+    for flag, options in ARGUMENTS:
+        if flag not in skip and (only is None or flag in only):
+            parser.add_argument(flag, **options)
+    return parser
+
+
+# Command line of a recipe's install script
+def cli(recipe):
+    args = argument_parser(
+        f'Download, build and install the latest {recipe.title} release and generate a module.'
+    ).parse_args()
+
+    with run_report.run(recipe.name, args.report, args.history):
+        main(recipe, args.module_base_dir, args.module_dir, args.verify,
+             args.cache_dir, args.cache_max_size * 2**20, args.metadata_ttl,
+             args.force, args.offline_mirror, not args.no_binary_cache,
+             args.version_spec, args.segments)
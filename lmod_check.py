@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+# Python version must be at least 3.6
+import sys
+if sys.version_info[0] < 3 or sys.version_info[1] < 6:
+    print("Python version must be at least 3.6")
+    sys.exit(1)
+
+# Verify Lmod modules in bulk. The "module show", "module load && which" and
+# "module load && <tool> --version" checks of any number of modules run as one
+# batched shell script, so Lmod's shell initialization is paid once instead of
+# three times per module. Each check's output is delimited by a marker line
+# and parsed back per module.
+
+import argparse
+import os
+import shlex
+import subprocess
+import uuid
+
+
+class ModuleCheck:
+    # module_name is checked with "module show". If command is given, it must
+    # resolve to executable (if given) after "module load" and its --version
+    # output must contain version (if given). If module_file is given, it must
+    # be the file "module show" reports.
+    def __init__(self,
+                 module_name,
+                 command=None,
+                 executable=None,
+                 version=None,
+                 module_file=None):
+        self.module_name = module_name
+        self.command = command
+        self.executable = executable
+        self.version = version
+        self.module_file = module_file
+
+
+# module_paths are added to the MODULEPATH before the checks
+def build_script(checks, marker, module_paths=()):
+    lines = [f'module use {shlex.quote(path)}' for path in module_paths]
+    for i, check in enumerate(checks):
+        module_name = shlex.quote(check.module_name)
+        lines += [
+            f'echo "{marker} {i} show"',
+            f'module show {module_name} 2>&1',
+            f'echo "{marker} {i} show-status $?"',
+        ]
+        if check.command is None:
+            continue
+        command = shlex.quote(check.command)
+        # Load each module in a subshell so modules do not leak into the
+        # checks of the modules that follow
+        lines += [
+            '(',
+            f'module load {module_name} >/dev/null 2>&1',
+            'load_status=$?',
+            f'echo "{marker} {i} load-status $load_status"',
+            '[ $load_status -eq 0 ] || exit 0',
+            f'echo "{marker} {i} which"',
+            f'which {command} 2>&1',
+            f'echo "{marker} {i} which-status $?"',
+            f'echo "{marker} {i} version"',
+            f'{command} --version 2>&1',
+            f'echo "{marker} {i} version-status $?"',
+            ')',
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+# Split the batched output back into {'show': (status, output), ...} per check
+def parse_output(output, marker, num_checks):
+    results = [{} for _ in range(num_checks)]
+    section = None
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) >= 3 and fields[0] == marker:
+            result = results[int(fields[1])]
+            if fields[2].endswith('-status'):
+                name = fields[2][:-len('-status')]
+                text = result.get(name, (None, ''))[1]
+                result[name] = (int(fields[3]), text)
+                section = None
+            else:
+                result.setdefault(fields[2], (None, ''))
+                section = (result, fields[2])
+        elif section is not None:
+            result, name = section
+            status, text = result[name]
+            result[name] = (status, text + line + '\n')
+    return results
+
+
+# Run all checks in a single shell and return their parsed results. If
+# command is given, it is run instead of a local shell and reads the script
+# from its stdin, e.g. "ssh <host> bash -l -s" to check the modules of another
+# host.
+def run_checks(checks, command=None, module_paths=()):
+    marker = f'@@lmod-check-{uuid.uuid4().hex}@@'
+    script = build_script(checks, marker, module_paths)
+    if command is None:
+        lmod_proc = subprocess.run(script,
+                                   shell=True,
+                                   capture_output=True,
+                                   text=True,
+                                   env=dict(os.environ, LMOD_PAGER=''))
+    else:
+        lmod_proc = subprocess.run(command,
+                                   input='export LMOD_PAGER=\n' + script,
+                                   capture_output=True,
+                                   text=True)
+    return parse_output(lmod_proc.stdout, marker, len(checks))
+
+
+# Return the list of problems found for one check
+def find_problems(check, result):
+    problems = []
+    show_status, show_output = result.get('show', (None, ''))
+    if show_status != 0:
+        problems.append(f'Lmod failed to show the module {check.module_name}.\n' +
+                        show_output)
+    elif check.module_file is not None and check.module_file not in show_output:
+        problems.append(
+            f'Lmod did not load {check.module_name} from {check.module_file}.')
+    if check.command is None:
+        return problems
+
+    if result.get('load', (None, ''))[0] != 0:
+        problems.append(f'Lmod failed to load the module {check.module_name}.')
+        return problems
+
+    which_status, which_output = result.get('which', (None, ''))
+    if which_status != 0:
+        problems.append(
+            f'{check.command} executable is not in the PATH set by the Lmod modulefile {check.module_name}.')
+    elif check.executable is not None and not (
+            os.path.exists(which_output.rstrip())
+            and os.path.samefile(which_output.rstrip(), check.executable)):
+        problems.append(
+            f'{check.command} executable loaded by Lmod is not the expected {check.executable}. {which_output}')
+
+    version_status, version_output = result.get('version', (None, ''))
+    if version_status != 0:
+        problems.append(f'Failed to run the {check.command} executable.\n' +
+                        version_output)
+    elif check.version is not None and check.version not in version_output:
+        problems.append(
+            f'{check.command} executable loaded in the Lmod file is not the expected {check.version} version: {version_output}')
+    return problems
+
+
+# Run all checks in a single shell and assert that none of them failed
+def check_modules(checks):
+    results = run_checks(checks)
+    problems = []
+    for check, result in zip(checks, results):
+        problems += find_problems(check, result)
+    assert not problems, '\n'.join(problems)
+
+
+def main(specs):
+    checks = []
+    for spec in specs:
+        module_name, _, command = spec.partition(':')
+        version = module_name.split('/', 1)[1] if '/' in module_name else None
+        checks.append(
+            ModuleCheck(module_name,
+                        command or module_name.split('/')[0],
+                        version=version))
+
+    print(f'Checking {len(checks)} modules...', end='', flush=True)
+    results = run_checks(checks)
+    print(f'\x1b[1K\rChecked {len(checks)} modules.')
+
+    num_failed = 0
+    for check, result in zip(checks, results):
+        problems = find_problems(check, result)
+        if problems:
+            num_failed += 1
+            print(f'FAILED {check.module_name}:')
+            for problem in problems:
+                print(f'  {problem.rstrip()}')
+        else:
+            print(f'ok     {check.module_name}')
+    return 1 if num_failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Check that Lmod modules load and provide a working executable of the expected version.'
+    )
+    parser.add_argument('--version', action='version', version='%(prog)s 1.0')
+    parser.add_argument(
+        'modules',
+        nargs='+',
+        help='Modules to check as name/version[:command]. The command defaults to the module name.')
+    args = parser.parse_args()
+
+    sys.exit(main(args.modules))
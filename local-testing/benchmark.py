@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+
+# Python version must be at least 3.6
+import sys
+if sys.version_info[0] < 3 or sys.version_info[1] < 6:
+    print("Python version must be at least 3.6")
+    sys.exit(1)
+
+# Benchmark the install pipeline against a local fake upstream. A local HTTP
+# server stands in for cmake.org's cmake-latest-files-v1.json, the kernel.org
+# Git index and the GitHub releases API, and serves synthetic artifacts of a
+# configurable size. Each installer runs cold (empty caches) and warm (the
+# caches of the cold run) in a fresh process, and the stages of its run
+# report are timed. The artifacts are deterministic, so results written with
+# --output can be compared across commits with --compare.
+#
+# Lmod checks fail on hosts without Lmod. The stages before them are timed
+# all the same.
+
+import argparse
+import email.utils
+import hashlib
+import http.server
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import traceback
+import zipfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import artifact_cache
+import binary_cache
+import http_client
+import install_all
+import install_index
+import metadata_cache
+import run_report
+
+PACKAGES = ['cmake', 'git', 'ninja']
+
+# Versions of the synthetic releases, newer than any real one
+CMAKE_VERSION = '3.99.0'
+GIT_VERSION = '2.99.0'
+NINJA_VERSION = '1.99.0'
+
+CMAKE_FILES_JSON = 'https://cmake.org/files/LatestRelease/cmake-latest-files-v1.json'
+GIT_INDEX = 'https://mirrors.edge.kernel.org/pub/software/scm/git/'
+NINJA_RELEASE = 'https://api.github.com/repos/ninja-build/ninja/releases/latest'
+
+
+# size bytes of deterministic data, half random and half text, so it
+# compresses about as well as a source tree
+def payload(size, seed):
+    rng = random.Random(seed)
+    words = [b'static', b'int', b'return', b'const', b'char', b'struct',
+             b'if', b'else', b'for', b'void', b'(', b')', b';', b'{', b'}']
+    data = io.BytesIO()
+    while data.tell() < size:
+        block = min(32768, size - data.tell())
+        if rng.random() < 0.5:
+            data.write(rng.getrandbits(8 * block).to_bytes(block, 'little'))
+        else:
+            data.write((b' '.join(rng.choice(words) for _ in range(block // 3))
+                        + b'\n')[:block])
+    return data.getvalue()
+
+
+def add_bytes(archive, name, data, mode=0o644):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    info.mtime = 0
+    archive.addfile(info, io.BytesIO(data))
+
+
+# Split size bytes of payload over num_files files under prefix
+def add_payload(archive, prefix, size, num_files, seed):
+    for i in range(num_files):
+        add_bytes(archive, f'{prefix}/src/file{i:05d}.c',
+                  payload(size // num_files, f'{seed}-{i}'))
+
+
+def write_file(upstream_dir, url, data):
+    path = http_client.mirror_path(upstream_dir, url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fh:
+        fh.write(data)
+
+
+# A self-extracting installer like CMake's: a shell script followed by a gzip
+# tarball. install_cmake checks that the installer is larger than 5 MiB, so a
+# payload that compresses below that is padded with random data.
+def cmake_installer(size, num_files):
+    min_size = 5 * 2**20 + 2**16
+    padding = 0
+    while True:
+        tarball = io.BytesIO()
+        with tarfile.open(fileobj=tarball, mode='w:gz',
+                          compresslevel=6) as archive:
+            add_bytes(archive, 'bin/cmake',
+                      f'#!/bin/sh\necho "cmake version {CMAKE_VERSION}"\n'.encode(),
+                      0o755)
+            add_payload(archive, f'share/cmake-{CMAKE_VERSION[:4]}', size,
+                        num_files, 'cmake')
+            if padding:
+                add_bytes(archive, f'share/cmake-{CMAKE_VERSION[:4]}/padding',
+                          random.Random('cmake-padding').getrandbits(
+                              8 * padding).to_bytes(padding, 'little'))
+        if len(tarball.getvalue()) >= min_size:
+            break
+        padding += min_size - len(tarball.getvalue())
+    script = '\n'.join([
+        '#!/bin/sh',
+        'prefix=',
+        'for arg; do case $arg in --prefix=*) prefix=${arg#--prefix=};; esac; done',
+        f'echo "CMake Installer Version: {CMAKE_VERSION}"',
+        'echo "The archive will be extracted to: $prefix"',
+        'tail -c +OFFSET "$0" | tar xzf - -C "$prefix" || exit 1',
+        'echo "Unpacking finished successfully"',
+        'exit 0',
+        '',
+    ])
+    # The offset is padded to a fixed width, so the length of the script is
+    # known before it is filled in
+    header_size = len(script) - len('OFFSET') + 10
+    header = script.replace('OFFSET', f'{header_size + 1:<10}')
+    return header.encode() + tarball.getvalue()
+
+
+# A source tarball like Git's, with a configure script and a Makefile that
+# install a git executable
+def git_tarball(size, num_files):
+    top = f'git-{GIT_VERSION}'
+    configure = '\n'.join([
+        '#!/bin/sh',
+        'for arg; do case $arg in --prefix=*) prefix=${arg#--prefix=};; esac; done',
+        'echo "prefix = $prefix" >config.mak',
+        '',
+    ])
+    makefile = '\n'.join([
+        'include config.mak',
+        'install:',
+        '\tmkdir -p $(prefix)/bin $(prefix)/share/git-core',
+        '\tcp -R src $(prefix)/share/git-core/',
+        f"\tprintf '#!/bin/sh\\necho \"git version {GIT_VERSION}\"\\n' >$(prefix)/bin/git",
+        '\tchmod +x $(prefix)/bin/git',
+        '',
+    ])
+    tarball = io.BytesIO()
+    with tarfile.open(fileobj=tarball, mode='w:xz', preset=1) as archive:
+        add_bytes(archive, f'{top}/configure', configure.encode(), 0o755)
+        add_bytes(archive, f'{top}/Makefile', makefile.encode())
+        add_payload(archive, top, size, num_files, 'git')
+    return tarball.getvalue()
+
+
+# A release zip like Ninja's, with a single executable of the given size
+def ninja_zip(size):
+    executable = (f'#!/bin/sh\necho {NINJA_VERSION}\nexit 0\n'.encode() +
+                  payload(size, 'ninja'))
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as archive:
+        info = zipfile.ZipInfo('ninja', (1980, 1, 1, 0, 0, 0))
+        info.external_attr = 0o755 << 16
+        info.compress_type = zipfile.ZIP_DEFLATED
+        archive.writestr(info, executable)
+    return data.getvalue()
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Populate upstream_dir with the release metadata and synthetic artifacts of
+# every package, in the layout of the offline mirror
+def make_upstream(upstream_dir, size, num_files):
+    installer_name = f'cmake-{CMAKE_VERSION}-linux-{os.uname().machine}.sh'
+    installer = cmake_installer(size, num_files)
+    write_file(upstream_dir, CMAKE_FILES_JSON, json.dumps({
+        'version': {'string': CMAKE_VERSION},
+        'files': [{
+            'os': [os.uname().sysname],
+            'architecture': [os.uname().machine],
+            'class': 'installer',
+            'name': installer_name,
+        }],
+    }).encode())
+    write_file(upstream_dir,
+               f'{os.path.dirname(CMAKE_FILES_JSON)}/{installer_name}',
+               installer)
+    write_file(upstream_dir,
+               f'{os.path.dirname(CMAKE_FILES_JSON)}/cmake-{CMAKE_VERSION}-SHA-256.txt',
+               f'{sha256(installer)}  {installer_name}\n'.encode())
+
+    git_name = f'git-{GIT_VERSION}.tar.xz'
+    tarball = git_tarball(size, num_files)
+    write_file(upstream_dir, GIT_INDEX, ''.join(
+        f'<a href="{name}">{name}</a>\n'
+        for name in ['git-2.9.0.tar.xz', git_name]).encode())
+    write_file(upstream_dir, GIT_INDEX + git_name, tarball)
+    write_file(upstream_dir, GIT_INDEX + 'sha256sums.asc',
+               f'{sha256(tarball)}  {git_name}\n'.encode())
+
+    ninja_url = ('https://github.com/ninja-build/ninja/releases/download/'
+                 f'v{NINJA_VERSION}/ninja-linux.zip')
+    archive = ninja_zip(size)
+    write_file(upstream_dir, NINJA_RELEASE, json.dumps({
+        'tag_name': f'v{NINJA_VERSION}',
+        'assets': [{
+            'name': 'ninja-linux.zip',
+            'browser_download_url': ninja_url,
+            'digest': f'sha256:{sha256(archive)}',
+        }],
+    }).encode())
+    write_file(upstream_dir, ninja_url, archive)
+
+
+# Serves a directory in the layout of the offline mirror, with the range
+# requests, validators and keep-alive connections of a real upstream. rate
+# limits the bytes per second of each response, if set.
+class UpstreamHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    upstream_dir = None
+    rate = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_file(head=True)
+
+    def do_GET(self):
+        self.send_file(head=False)
+
+    def send_file(self, head):
+        try:
+            path = http_client.mirror_path(self.upstream_dir,
+                                           'https:/' + self.path)
+            fh = open(path, 'rb')
+        except (AssertionError, OSError):
+            self.send_error(404)
+            return
+        with fh:
+            st = os.fstat(fh.fileno())
+            etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+            start, end = 0, st.st_size - 1
+            status = 200
+            match = re.fullmatch(r'bytes=(\d*)-(\d*)',
+                                 self.headers.get('Range', ''))
+            if match and self.headers.get('If-Range', etag) == etag:
+                if match.group(1):
+                    start = int(match.group(1))
+                    if match.group(2):
+                        end = min(int(match.group(2)), end)
+                elif match.group(2):
+                    start = max(st.st_size - int(match.group(2)), 0)
+                if start >= st.st_size or start > end:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{st.st_size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                status = 206
+            self.send_response(status)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified',
+                             email.utils.formatdate(st.st_mtime, usegmt=True))
+            if status == 206:
+                self.send_header('Content-Range',
+                                 f'bytes {start}-{end}/{st.st_size}')
+            self.end_headers()
+            if head:
+                return
+            fh.seek(start)
+            remaining = end - start + 1
+            started = time.monotonic()
+            sent = 0
+            while remaining > 0:
+                data = fh.read(min(65536, remaining))
+                if not data:
+                    break
+                self.wfile.write(data)
+                remaining -= len(data)
+                sent += len(data)
+                if self.rate:
+                    delay = sent / self.rate - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+
+
+def start_server(upstream_dir, rate=None):
+    handler = type('Handler', (UpstreamHandler, ), {
+        'upstream_dir': upstream_dir,
+        'rate': rate,
+    })
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Install package from the upstream server in a forked process and write its
+# run report to report_file. The installer's output goes to a log file.
+def run_installer(package, run_dir, cache_dir, server_url, segments,
+                  report_file):
+    with open(os.path.join(run_dir, 'install.log'), 'w') as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+    http_client.upstream_server = server_url
+    installer = install_all.INSTALLERS[package]
+    module_base = os.path.join(run_dir, 'modules')
+    os.makedirs(module_base)
+    cache = artifact_cache.ArtifactCache(cache_dir,
+                                         artifact_cache.DEFAULT_MAX_SIZE,
+                                         segments)
+    metadata = metadata_cache.MetadataCache(cache_dir)
+    index = install_index.InstallIndex(module_base)
+    binaries = binary_cache.BinaryCache(
+        cache) if package in install_all.BINARY_CACHED else None
+    report = run_report.start(package)
+    try:
+        fetch_options = {
+            'binaries': binaries
+        } if package in install_all.BINARY_CACHED_FETCH else {}
+        fetched = installer.fetch_stage(os.path.join(run_dir, 'prefix'),
+                                        os.path.join(run_dir, 'work'), True,
+                                        cache, metadata, index,
+                                        **fetch_options)
+        install_all.install_fetched(installer, module_base, fetched, index,
+                                    binaries)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        report.finish()
+        report.write(report_file)
+        sys.stdout.flush()
+
+
+def run_once(package, run_dir, cache_dir, server_url, segments):
+    os.makedirs(os.path.join(run_dir, 'work'))
+    report_file = os.path.join(run_dir, 'report.json')
+    process = multiprocessing.get_context('fork').Process(
+        target=run_installer,
+        args=(package, run_dir, cache_dir, server_url, segments, report_file))
+    process.start()
+    process.join()
+    with open(report_file) as fh:
+        return json.load(fh)
+
+
+# Median wall time, CPU time and bytes received of each stage of the reports
+# of a package and mode, in the order the stages ran
+def summarize(reports):
+    stages = {}
+    for report in reports:
+        for stage in report['stages']:
+            stages.setdefault(stage['stage'], []).append(stage)
+    summary = {
+        name: {
+            'wall_time':
+            statistics.median(stage['wall_time'] for stage in runs),
+            'cpu_time':
+            statistics.median(stage['cpu_time'] + stage['children_cpu_time']
+                              for stage in runs),
+            'bytes_received':
+            statistics.median(stage['bytes_received'] for stage in runs),
+            'failed':
+            any(stage['error'] for stage in runs),
+        }
+        for name, runs in stages.items()
+    }
+    summary['total'] = {
+        'wall_time': statistics.median(report['wall_time']
+                                       for report in reports),
+        'cpu_time': sum(stage['cpu_time'] for stage in summary.values()),
+        'bytes_received': sum(stage['bytes_received']
+                              for stage in summary.values()),
+        'failed': any(stage['failed'] for stage in summary.values()),
+    }
+    return summary
+
+
+def git_commit():
+    git_proc = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=REPO_DIR,
+                              capture_output=True,
+                              text=True)
+    return git_proc.stdout.strip() or None
+
+
+def print_results(results, baseline=None):
+    header = f'{"Stage":<32}{"Wall":>10}{"CPU":>10}{"MB":>9}'
+    if baseline is not None:
+        header += f'{"Baseline":>11}{"Change":>9}'
+    print(header)
+    for key, summary in results.items():
+        for name, stage in summary.items():
+            line = (f'{key + ":" + name:<32}{stage["wall_time"]:9.3f}s'
+                    f'{stage["cpu_time"]:9.3f}s'
+                    f'{stage["bytes_received"] / 1e6:9.1f}')
+            base = (baseline or {}).get(key, {}).get(name)
+            if base is not None:
+                change = (stage['wall_time'] / base['wall_time'] - 1
+                          if base['wall_time'] else 0)
+                line += f'{base["wall_time"]:10.3f}s{change:+9.1%}'
+            if stage['failed']:
+                line += ' (failed)'
+            print(line)
+
+
+def main(packages, size, num_files, repeat, segments, rate, work_dir,
+         upstream_dir, output, compare):
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='rostam-benchmark-')
+    else:
+        os.makedirs(work_dir, exist_ok=True)
+    print(f'Using work directory {work_dir}.')
+
+    synthetic = upstream_dir is None
+    if synthetic:
+        upstream_dir = os.path.join(work_dir, 'upstream')
+        print(f'Generating {size / 2**20:.0f} MiB artifacts in {num_files} '
+              f'files under {upstream_dir}...',
+              end='',
+              flush=True)
+        start = time.monotonic()
+        make_upstream(upstream_dir, size, num_files)
+        print(f'\x1b[1K\rGenerated the artifacts under {upstream_dir} in '
+              f'{time.monotonic() - start:.1f}s.')
+
+    server = start_server(upstream_dir, rate)
+    server_url = f'http://127.0.0.1:{server.server_address[1]}/'
+    print(f'Serving {upstream_dir} at {server_url}.')
+
+    reports = {}
+    for i in range(repeat):
+        for package in packages:
+            # The cold run starts with empty caches, the warm run reuses them
+            cache_dir = os.path.join(work_dir, f'cache-{package}-{i}')
+            for mode in ['cold', 'warm']:
+                run_dir = os.path.join(work_dir, f'run-{package}-{mode}-{i}')
+                shutil.rmtree(run_dir, ignore_errors=True)
+                print(f'Running {package} {mode} ({i + 1}/{repeat})...',
+                      end='',
+                      flush=True)
+                report = run_once(package, run_dir, cache_dir, server_url,
+                                  segments)
+                reports.setdefault(f'{package}:{mode}', []).append(report)
+                print(f'\x1b[1K\rRan {package} {mode} ({i + 1}/{repeat}) in '
+                      f'{report["wall_time"]:.2f}s.')
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    server.shutdown()
+
+    results = {key: summarize(runs) for key, runs in reports.items()}
+    baseline = None
+    if compare:
+        with open(compare) as fh:
+            baseline_file = json.load(fh)
+        print(f'Comparing with {compare} '
+              f'(commit {baseline_file["commit"]}).')
+        baseline = baseline_file['results']
+    print_results(results, baseline)
+
+    if output:
+        with open(output, 'w') as fh:
+            json.dump(
+                {
+                    'commit': git_commit(),
+                    'host': platform.node(),
+                    'python': platform.python_version(),
+                    'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    'config': {
+                        'packages': packages,
+                        'size': size,
+                        'files': num_files,
+                        'repeat': repeat,
+                        'segments': segments,
+                        'rate': rate,
+                        'synthetic': synthetic,
+                    },
+                    'results': results,
+                    'reports': reports,
+                },
+                fh,
+                indent=2)
+        print(f'Wrote the results to {output}.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time each installer stage cold and warm against a local fake upstream serving synthetic artifacts.'
+    )
+    parser.add_argument('--version', action='version', version='%(prog)s 1.0')
+    parser.add_argument('--packages',
+                        nargs='+',
+                        choices=PACKAGES,
+                        default=PACKAGES,
+                        help='The installers to benchmark.')
+    parser.add_argument('--size',
+                        type=int,
+                        default=64,
+                        help='The size of each synthetic artifact in MiB, before compression. CMake installers that compress below install_cmake\'s 5 MB size check are padded.')
+    parser.add_argument('--files',
+                        type=int,
+                        default=1000,
+                        help='The number of files in each synthetic archive.')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=3,
+                        help='The number of cold and warm runs of each installer. Stage times are their medians.')
+    parser.add_argument('--segments',
+                        type=int,
+                        default=1,
+                        help='Download large artifacts with this many concurrent range requests.')
+    parser.add_argument('--rate',
+                        type=float,
+                        default=None,
+                        help='Limit each response of the fake upstream to this many MB/s.')
+    parser.add_argument('--work-dir',
+                        type=str,
+                        default=None,
+                        help='The directory for the artifacts, caches and installs. Defaults to a new temporary directory.')
+    parser.add_argument('--upstream-dir',
+                        type=str,
+                        default=None,
+                        help='Serve this directory, e.g. an offline mirror populated by mirror.py sync, instead of synthetic artifacts.')
+    parser.add_argument('--output',
+                        type=str,
+                        default=None,
+                        help='Write the results as JSON to this file.')
+    parser.add_argument('--compare',
+                        type=str,
+                        default=None,
+                        help='Compare the stage times with the results in this file, written by an earlier --output.')
+    args = parser.parse_args()
+
+    main(args.packages, args.size * 2**20, args.files, args.repeat,
+         args.segments, args.rate and args.rate * 1e6, args.work_dir,
+         args.upstream_dir, args.output, args.compare)
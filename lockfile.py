@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+# Python version must be at least 3.6
+import sys
+if sys.version_info[0] < 3 or sys.version_info[1] < 6:
+    print("Python version must be at least 3.6")
+    sys.exit(1)
+
+# Reproducible bulk installs from a lockfile, which pins every package to a
+# version, the URL and SHA-256 digest of its artifact, and the configure
+# arguments of packages built from source:
+#
+#   {"format": 1, "arch": "x86_64", "packages": {"git": {"version": "2.44.2",
+#    "url": "https://...", "sha256": "...", "configure_args": [...]}, ...}}
+#
+# "lock" resolves the latest releases, or those matching --version-spec,
+# against all upstreams at once and writes the lockfile. "plan" compares the
+# lockfile with the install index of the module base directory, without any
+# network access, and lists the packages that are missing, broken or were
+# installed from a different artifact. "apply" installs those with
+# install_all's scheduler, fetching the pinned artifacts directly instead of
+# querying the upstreams, so applying a satisfied lockfile only reads the
+# install index. A plan written by "plan --plan" is only applied to the module
+# base directory and install index it was made for, and, if --lockfile is
+# given, only if it was made from that lockfile.
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import platform
+import tempfile
+import time
+
+import artifact_cache
+import discovery
+import http_client
+import install_all
+import install_index
+import installer_engine
+import metadata_cache
+import run_report
+
+LOCKFILE_FORMAT = 1
+
+
+# configure arguments an installer builds its package with, or None if it
+# installs a binary release
+def configure_args(installer):
+    recipe = getattr(installer, 'RECIPE', None)
+    if recipe is not None:
+        return recipe.configure_args
+    return getattr(installer, 'CONFIGURE_ARGS', None)
+
+
+def write_json(json_file, data):
+    json_dir = os.path.dirname(os.path.abspath(json_file))
+    tmp_fd, tmp_file = tempfile.mkstemp(dir=json_dir)
+    try:
+        with os.fdopen(tmp_fd, 'w') as fh:
+            json.dump(data, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+        os.replace(tmp_file, json_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def read_lockfile(lockfile):
+    with open(lockfile, 'rb') as fh:
+        content = fh.read()
+    locked = json.loads(content)
+    assert locked.get('format') == LOCKFILE_FORMAT, \
+        f'{lockfile} is not a lockfile of format {LOCKFILE_FORMAT}.'
+    # The artifacts of binary releases are built for one architecture
+    assert locked['arch'] == platform.machine(), \
+        f'{lockfile} was locked on {locked["arch"]}, not {platform.machine()}.'
+    for package in locked['packages']:
+        assert package in install_all.INSTALLERS, \
+            f'Unknown package {package} in {lockfile}.'
+    locked['sha256'] = hashlib.sha256(content).hexdigest()
+    return locked
+
+
+# SHA-256 digest of the install index of module_base, or None if there is none
+def index_digest(module_base):
+    try:
+        with open(install_index.InstallIndex(module_base).index_file,
+                  'rb') as fh:
+            return hashlib.sha256(fh.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+# Resolve the releases of packages and their digests and write them to
+# lockfile. Returns 1 if an upstream could not be queried.
+def lock(lockfile,
+         packages,
+         cache_dir=artifact_cache.DEFAULT_CACHE_DIR,
+         metadata_ttl=metadata_cache.DEFAULT_TTL,
+         timeout=discovery.DEFAULT_TIMEOUT,
+         offline_mirror=None,
+         version_specs=None):
+    if offline_mirror:
+        print(f'Using offline mirror {offline_mirror}.')
+        http_client.offline_mirror = offline_mirror
+        cache_dir = None
+
+    metadata = metadata_cache.MetadataCache(cache_dir, metadata_ttl)
+    print(f'Resolving {len(packages)} packages...', end='', flush=True)
+    start = time.monotonic()
+    releases = discovery.discover(
+        {package: install_all.INSTALLERS[package]
+         for package in packages}, metadata, timeout, version_specs)
+    failed = [release for release in releases if release['error']]
+    if failed:
+        print(f'\x1b[1K\rFailed to resolve '
+              f'{", ".join(release["package"] for release in failed)}.')
+        for release in failed:
+            print(f'{release["package"]}: {release["error"]}')
+        return 1
+
+    # Digests live in separate listings for some upstreams, so look them up
+    # concurrently too
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(releases), 1)) as executor:
+        digests = list(
+            executor.map(
+                lambda release: install_all.INSTALLERS[release[
+                    'package']].query_digest(release['version'], release[
+                        'url'], metadata), releases))
+    print(f'\x1b[1K\rResolved {len(packages)} packages in '
+          f'{time.monotonic() - start:.1f}s.')
+
+    entries = {}
+    for release, sha256 in zip(releases, digests):
+        package = release['package']
+        entry = {
+            'version': release['version'],
+            'url': release['url'],
+            'sha256': sha256,
+        }
+        args = configure_args(install_all.INSTALLERS[package])
+        if args is not None:
+            entry['configure_args'] = list(args)
+        entries[package] = entry
+        print(f'{package:<12}{release["version"]:<16}' +
+              (sha256 or 'no upstream digest'))
+    write_json(lockfile, {
+        'format': LOCKFILE_FORMAT,
+        'arch': platform.machine(),
+        'packages': entries,
+    })
+    print(f'Wrote {lockfile}.')
+    return 0
+
+
+# Compare the locked releases with the install index of module_base and
+# return the plan: the releases to install, with the reason why, and the
+# packages that are installed as locked already
+def plan(locked, module_base):
+    index = install_index.InstallIndex(module_base)
+    index_sha256 = index_digest(module_base)
+    installed = index.load()
+    work = {}
+    satisfied = []
+    for package, release in sorted(locked['packages'].items()):
+        entry = installed.get(package, {}).get(release['version'])
+        if entry is None:
+            reason = 'not installed'
+        elif not index.is_intact(entry):
+            reason = 'broken'
+        elif (release['sha256'] and entry['sha256']
+              and release['sha256'] != entry['sha256']):
+            reason = 'different artifact'
+        else:
+            satisfied.append(package)
+            continue
+        work[package] = dict(release, reason=reason)
+    return {
+        'format': LOCKFILE_FORMAT,
+        'lockfile_sha256': locked['sha256'],
+        'module_base': os.path.abspath(module_base),
+        'index_sha256': index_sha256,
+        'install': work,
+        'satisfied': satisfied,
+    }
+
+
+def format_plan(plan):
+    lines = []
+    for package, release in sorted(plan['install'].items()):
+        lines.append(f'install {package} {release["version"]} '
+                     f'({release["reason"]})')
+    lines.append(f'{len(plan["install"])} to install, '
+                 f'{len(plan["satisfied"])} satisfied.')
+    return '\n'.join(lines)
+
+
+# Assert that a plan read from a file still applies: to module_base, to the
+# install index as it was when the plan was made and, if given, to the
+# lockfile locked
+def check_plan(work, module_base, locked=None):
+    assert work['module_base'] == os.path.abspath(module_base), \
+        f'The plan is for {work["module_base"]}, not {module_base}.'
+    assert work['index_sha256'] == index_digest(module_base), \
+        f'The install index of {module_base} changed since the plan was made.'
+    assert locked is None or work['lockfile_sha256'] == locked['sha256'], \
+        'The plan was not made from this lockfile.'
+
+
+# Install the releases of plan concurrently. Returns 1 if any failed.
+def apply(plan,
+          module_dir,
+          work_dir,
+          network_jobs=None,
+          build_jobs=1,
+          verify=False,
+          cache_dir=artifact_cache.DEFAULT_CACHE_DIR,
+          cache_max_size=artifact_cache.DEFAULT_MAX_SIZE,
+          segments=1,
+          offline_mirror=None,
+          use_binary_cache=True):
+    if not plan['install']:
+        print(f'All {len(plan["satisfied"])} locked packages are installed.')
+        return 0
+    packages = sorted(plan['install'])
+    # The plan decided what to install, so the installers do not check the
+    # install index again
+    return install_all.main(plan['module_base'],
+                            module_dir,
+                            packages,
+                            work_dir,
+                            network_jobs or len(packages),
+                            build_jobs,
+                            verify,
+                            cache_dir,
+                            cache_max_size,
+                            force=True,
+                            segments=segments,
+                            offline_mirror=offline_mirror,
+                            use_binary_cache=use_binary_cache,
+                            releases=plan['install'])
+
+
+if __name__ == '__main__':
+    parser = installer_engine.argument_parser(
+        'Lock package versions and reproducibly install them.',
+        skip=['--verify', '--force', '--version-spec'])
+    parser.add_argument('command',
+                        choices=['lock', 'plan', 'apply'],
+                        help='lock: resolve the packages into the lockfile. '
+                        'plan: list what applying the lockfile would install. '
+                        'apply: install the plan, or the plan of the lockfile.')
+    parser.add_argument('--lockfile',
+                        type=str,
+                        default=None,
+                        help='The lockfile to write with lock and to read with plan and apply.')
+    parser.add_argument('--plan',
+                        type=str,
+                        default=None,
+                        help='The plan file to write with plan and to read with apply instead of the lockfile.')
+    parser.add_argument('--packages',
+                        nargs='+',
+                        choices=sorted(install_all.INSTALLERS),
+                        default=sorted(install_all.INSTALLERS),
+                        help='The packages to lock.')
+    parser.add_argument('--version-spec',
+                        action='append',
+                        default=[],
+                        metavar='PACKAGE:SPEC',
+                        help="Lock the latest version of PACKAGE that satisfies SPEC, e.g. 'cmake:>=3.27,<3.29' or 'git:~=2.44'. May be repeated.")
+    parser.add_argument('--work-dir',
+                        type=str,
+                        default='.',
+                        help='The directory for downloads and build trees.')
+    parser.add_argument('--network-jobs',
+                        type=int,
+                        default=None,
+                        help='The number of concurrent downloads. Defaults to one per package.')
+    parser.add_argument('--build-jobs',
+                        type=int,
+                        default=1,
+                        help='The number of concurrent install stages.')
+    parser.add_argument('--verify',
+                        action='store_true',
+                        help='Fail before installing a package whose lockfile entry has no SHA-256 digest.')
+    parser.add_argument('--query-timeout',
+                        type=float,
+                        default=discovery.DEFAULT_TIMEOUT,
+                        help='Seconds to wait for each upstream with lock.')
+    args = parser.parse_args()
+
+    if args.command == 'lock':
+        assert args.lockfile, 'lock needs --lockfile.'
+        version_specs = dict(
+            version_spec.split(':', 1) for version_spec in args.version_spec)
+        for package in version_specs:
+            assert package in args.packages, \
+                f'--version-spec for {package}, which is not locked.'
+        sys.exit(
+            lock(args.lockfile, args.packages, args.cache_dir,
+                 args.metadata_ttl, args.query_timeout, args.offline_mirror,
+                 version_specs))
+
+    if args.command == 'plan':
+        assert args.lockfile, 'plan needs --lockfile.'
+        work = plan(read_lockfile(args.lockfile), args.module_base_dir)
+        print(format_plan(work))
+        if args.plan:
+            write_json(args.plan, work)
+            print(f'Wrote {args.plan}.')
+        sys.exit(0)
+
+    if args.plan:
+        with open(args.plan) as fh:
+            work = json.load(fh)
+        assert work.get('format') == LOCKFILE_FORMAT, \
+            f'{args.plan} is not a plan of format {LOCKFILE_FORMAT}.'
+        check_plan(
+            work, args.module_base_dir,
+            read_lockfile(args.lockfile) if args.lockfile else None)
+    else:
+        assert args.lockfile, 'apply needs --lockfile or --plan.'
+        work = plan(read_lockfile(args.lockfile), args.module_base_dir)
+    print(format_plan(work))
+    with run_report.run('lockfile', args.report, args.history):
+        sys.exit(
+            apply(work, args.module_dir, args.work_dir, args.network_jobs,
+                  args.build_jobs, args.verify, args.cache_dir,
+                  args.cache_max_size * 2**20, args.segments,
+                  args.offline_mirror, not args.no_binary_cache))
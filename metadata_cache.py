@@ -0,0 +1,117 @@
+# Persistent cache for release metadata (cmake.org JSON, kernel.org indexes,
+# GitHub API responses and digest listings). Within the TTL a cached response
+# is served without touching the network. After that the request is repeated
+# with If-None-Match/If-Modified-Since, so an unchanged response costs a 304
+# and, for GitHub, does not count against the API rate limit. A stale entry is
+# also served when the upstream cannot be reached, rate limits or fails.
+
+import copy
+import hashlib
+import http.client
+import json
+import os
+import tempfile
+import time
+import urllib.error
+
+import artifact_cache
+import http_client
+
+DEFAULT_TTL = 3600
+
+
+class MetadataCache:
+    # A cache_dir of None (or '') disables caching and read() always queries
+    # the upstream.
+    def __init__(self, cache_dir=artifact_cache.DEFAULT_CACHE_DIR,
+                 ttl=DEFAULT_TTL):
+        self.cache_dir = cache_dir or None
+        self.ttl = ttl
+        # time.monotonic() by which upstream queries must have answered
+        self.deadline = None
+
+    # Return a copy of the cache whose upstream queries all have to answer
+    # within timeout seconds from now
+    def with_timeout(self, timeout):
+        timed = copy.copy(self)
+        timed.deadline = time.monotonic() + timeout
+        return timed
+
+    def timeout(self, url):
+        return http_client.remaining(self.deadline, url)
+
+    def entry_path(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, 'metadata', key)
+
+    # An entry is a JSON header line followed by the raw response body
+    def load(self, url):
+        try:
+            with open(self.entry_path(url), 'rb') as fh:
+                header = json.loads(fh.readline())
+                body = fh.read()
+        except (OSError, ValueError):
+            return None, None
+        if header.get('url') != url:
+            return None, None
+        return header, body
+
+    def store(self, url, header, body):
+        entry_file = self.entry_path(url)
+        os.makedirs(os.path.dirname(entry_file), exist_ok=True)
+        tmp_fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(entry_file))
+        try:
+            with os.fdopen(tmp_fd, 'wb') as fh:
+                fh.write(json.dumps(dict(header, url=url)).encode() + b'\n')
+                fh.write(body)
+            os.replace(tmp_file, entry_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    # Return the body of url decoded as UTF-8
+    def read(self, url):
+        if self.cache_dir is None:
+            with http_client.urlopen(
+                    url, timeout=self.timeout(url)) as http_response:
+                assert http_response.status == 200, f'Failed to query {url}'
+                return http_response.read().decode('utf-8')
+
+        header, body = self.load(url)
+        if header is not None and time.time() - header['fetched'] < self.ttl:
+            return body.decode('utf-8')
+
+        request_headers = {}
+        if header is not None and header.get('etag'):
+            request_headers['If-None-Match'] = header['etag']
+        if header is not None and header.get('last_modified'):
+            request_headers['If-Modified-Since'] = header['last_modified']
+
+        try:
+            with http_client.urlopen(
+                    url, request_headers,
+                    timeout=self.timeout(url)) as http_response:
+                assert http_response.status == 200, f'Failed to query {url}'
+                body = http_response.read()
+                header = {
+                    'etag': http_response.headers.get('ETag'),
+                    'last_modified': http_response.headers.get('Last-Modified'),
+                }
+        except urllib.error.HTTPError as e:
+            if header is None:
+                raise
+            # Serve the stale entry when the upstream is rate limiting (as
+            # GitHub does with 403 and 429) or failing
+            if e.code in (403, 429) or e.code >= 500:
+                return body.decode('utf-8')
+            if e.code != 304:
+                raise
+        except (OSError, http.client.HTTPException):
+            # Serve the stale entry when the upstream is unreachable
+            if header is None:
+                raise
+            return body.decode('utf-8')
+
+        header['fetched'] = time.time()
+        self.store(url, header, body)
+        return body.decode('utf-8')
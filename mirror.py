@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Python version must be at least 3.6
+import sys
+if sys.version_info[0] < 3 or sys.version_info[1] < 6:
+    print("Python version must be at least 3.6")
+    sys.exit(1)
+
+# Populate an offline mirror for hosts without outbound network. "sync" runs
+# each installer's fetch stage against the upstreams and stores every release
+# metadata response, digest listing and artifact it fetches under
+# <mirror>/<host>/<path>, the layout http_client.mirror_path() maps URLs to.
+# The installers' --offline-mirror option then serves all of them from there.
+
+import os
+import tempfile
+
+import artifact_cache
+import downloader
+import extractor
+import http_client
+import install_all
+import installer_engine
+import metadata_cache
+
+
+# Stands in for both the metadata cache and the artifact cache of a fetch
+# stage, and copies everything that passes through it into the mirror
+class MirrorRecorder:
+    def __init__(self, mirror_dir, metadata, cache):
+        self.mirror_dir = mirror_dir
+        self.metadata = metadata
+        self.cache = cache
+        # Same as MetadataCache.cache_dir, where version_index.load keeps the
+        # parsed indexes
+        self.cache_dir = metadata.cache_dir
+        self.num_files = 0
+        self.num_bytes = 0
+
+    def store(self, url, body):
+        mirrored_file = http_client.mirror_path(self.mirror_dir, url)
+        os.makedirs(os.path.dirname(mirrored_file), exist_ok=True)
+        tmp_fd, tmp_file = tempfile.mkstemp(
+            dir=os.path.dirname(mirrored_file))
+        try:
+            with os.fdopen(tmp_fd, 'wb') as fh:
+                fh.write(body)
+            os.replace(tmp_file, mirrored_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        self.num_files += 1
+        self.num_bytes += len(body)
+
+    # Same as MetadataCache.read
+    def read(self, url):
+        body = self.metadata.read(url)
+        self.store(url, body.encode('utf-8'))
+        return body
+
+    # Same as ArtifactCache.fetch. Artifacts already in the mirror are not
+    # downloaded again.
+    def fetch(self, url, dest_file, sha256=None, status=None):
+        mirrored_file = http_client.mirror_path(self.mirror_dir, url)
+        if not os.path.isfile(mirrored_file):
+            os.makedirs(os.path.dirname(mirrored_file), exist_ok=True)
+            self.cache.fetch(url, mirrored_file, sha256, status)
+        self.num_files += 1
+        self.num_bytes += artifact_cache.link_or_copy(mirrored_file, dest_file)
+
+    # Same as ArtifactCache.fetch_extract
+    def fetch_extract(self, url, dest_dir, sha256=None, status=None):
+        mirrored_file = http_client.mirror_path(self.mirror_dir, url)
+        if not os.path.isfile(mirrored_file):
+            os.makedirs(os.path.dirname(mirrored_file), exist_ok=True)
+            self.cache.fetch(url, mirrored_file, sha256, status)
+        self.num_files += 1
+        self.num_bytes += os.path.getsize(mirrored_file)
+        with open(mirrored_file, 'rb') as fh:
+            return extractor.extract_stream(fh, dest_dir)
+
+
+def sync(mirror_dir, packages, cache_dir, cache_max_size, segments=1):
+    os.makedirs(mirror_dir, exist_ok=True)
+    print(f'Using mirror directory {mirror_dir}.')
+
+    # Always ask the upstreams, but with conditional requests
+    recorder = MirrorRecorder(
+        mirror_dir, metadata_cache.MetadataCache(cache_dir, 0),
+        artifact_cache.ArtifactCache(cache_dir, cache_max_size, segments))
+    for package in packages:
+        # The fetch stage's downloads are hard links into the mirror and are
+        # thrown away afterwards
+        with tempfile.TemporaryDirectory(prefix='.sync-',
+                                         dir=mirror_dir) as work_dir:
+            install_all.INSTALLERS[package].fetch_stage(work_dir,
+                                                        work_dir,
+                                                        cache=recorder,
+                                                        metadata=recorder)
+
+    print(f'Mirrored {recorder.num_files} files, '
+          f'{downloader.format_size(recorder.num_bytes)}.')
+    print(artifact_cache.stats)
+    print(http_client.stats)
+
+    print('Done.')
+
+
+if __name__ == '__main__':
+    parser = installer_engine.argument_parser(
+        'Mirror the release metadata and artifacts of the installers for offline installs.',
+        only=['--cache-dir', '--cache-max-size', '--segments'])
+    parser.add_argument('command',
+                        choices=['sync'],
+                        help='sync: fetch the latest releases into the mirror directory.')
+    parser.add_argument('--mirror-dir',
+                        type=str,
+                        required=True,
+                        help='The mirror directory, to be passed to the installers as --offline-mirror.')
+    parser.add_argument('--packages',
+                        nargs='+',
+                        choices=sorted(install_all.INSTALLERS),
+                        default=sorted(install_all.INSTALLERS),
+                        help='The packages to mirror.')
+    args = parser.parse_args()
+
+    sync(args.mirror_dir, args.packages, args.cache_dir,
+         args.cache_max_size * 2**20, args.segments)
@@ -0,0 +1,41 @@
+# Helpers for moving an installed tree to another prefix. Text files that
+# mention the old prefix can be rewritten; binaries that embed it (compiled-in
+# paths) cannot, so a tree with such binaries only works at its original
+# prefix.
+
+import os
+
+
+# Return the text files and the binary files under root that mention prefix,
+# relative to root. Symbolic links are not followed.
+def find_prefix_files(root, prefix):
+    prefix = os.fsencode(prefix)
+    text_files = []
+    binary_files = []
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as fh:
+                data = fh.read()
+            if prefix not in data:
+                continue
+            if b'\0' in data:
+                binary_files.append(os.path.relpath(path, root))
+            else:
+                text_files.append(os.path.relpath(path, root))
+    return text_files, binary_files
+
+
+# Replace old_prefix with new_prefix in the given files under root, keeping
+# their permissions
+def relocate_files(root, files, old_prefix, new_prefix):
+    old_prefix = os.fsencode(old_prefix)
+    new_prefix = os.fsencode(new_prefix)
+    for name in files:
+        path = os.path.join(root, name)
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        with open(path, 'wb') as fh:
+            fh.write(data.replace(old_prefix, new_prefix))
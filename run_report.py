@@ -0,0 +1,152 @@
+# Timing instrumentation for the installers. Each stage of a run (query,
+# download, extraction, configure, make install, Lmod checks, ...) records its
+# wall time, the CPU time of the process, including the pool threads it
+# starts, and that of the processes it ran, and the bytes received over HTTP.
+# The resident set size is only known as a high-water mark since the process
+# started, so stages record the process and largest child peaks as of their
+# end. The run is summarized at the end, written as a JSON report, and can be
+# appended to a JSON lines history file to track regressions over time.
+#
+# Stages record into the report started by start(), so the installers' stage
+# functions are instrumented whether they run from their own main or from
+# install_all.py. The CPU times and HTTP bytes are process-wide, so they
+# overlap between stages that run concurrently.
+
+import contextlib
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+
+import artifact_cache
+import http_client
+
+
+class RunReport:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.stages = []
+        self.started = time.time()
+        self.start = time.monotonic()
+        self.wall_time = None
+
+    @contextlib.contextmanager
+    def stage(self, package, name):
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        process = resource.getrusage(resource.RUSAGE_SELF)
+        bytes_received = http_client.stats.bytes_received
+        start = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            wall_time = time.monotonic() - start
+            process_end = resource.getrusage(resource.RUSAGE_SELF)
+            children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+            with self.lock:
+                self.stages.append({
+                    'package': package,
+                    'stage': name,
+                    'wall_time': wall_time,
+                    'cpu_time':
+                    process_end.ru_utime - process.ru_utime +
+                    process_end.ru_stime - process.ru_stime,
+                    'children_cpu_time':
+                    children_end.ru_utime - children.ru_utime +
+                    children_end.ru_stime - children.ru_stime,
+                    'bytes_received':
+                    http_client.stats.bytes_received - bytes_received,
+                    # Linux reports kilobytes
+                    'process_peak_rss': process_end.ru_maxrss * 1024,
+                    'largest_child_peak_rss': children_end.ru_maxrss * 1024,
+                    'error': error,
+                })
+
+    def finish(self):
+        self.wall_time = time.monotonic() - self.start
+
+    def as_dict(self):
+        with self.lock:
+            stages = list(self.stages)
+        return {
+            'name': self.name,
+            'command': sys.argv,
+            'host': platform.node(),
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S%z',
+                                     time.localtime(self.started)),
+            'wall_time': self.wall_time,
+            'process_peak_rss':
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            'http': http_client.stats.as_dict(),
+            'artifact_cache': artifact_cache.stats.as_dict(),
+            'stages': stages,
+        }
+
+    # Write the JSON report to report_file and append it as one line to
+    # history_file, if they are given
+    def write(self, report_file=None, history_file=None):
+        report = self.as_dict()
+        if report_file:
+            with open(report_file, 'w') as fh:
+                json.dump(report, fh, indent=2)
+        if history_file:
+            os.makedirs(os.path.dirname(os.path.abspath(history_file)),
+                        exist_ok=True)
+            # A single write of a line in append mode keeps concurrent runs
+            # from interleaving their entries
+            with open(history_file, 'a') as fh:
+                fh.write(json.dumps(report) + '\n')
+
+    def __str__(self):
+        with self.lock:
+            stages = list(self.stages)
+        lines = ['Stages:']
+        for stage in stages:
+            lines.append(
+                f'  {stage["package"] + ":" + stage["stage"]:<28}'
+                f'{stage["wall_time"]:8.2f}s wall '
+                f'{stage["cpu_time"] + stage["children_cpu_time"]:8.2f}s CPU '
+                f'{stage["bytes_received"] / 1e6:8.1f} MB '
+                f'{stage["process_peak_rss"] / 2**20:6.0f} MiB process peak RSS' +
+                (' (failed)' if stage['error'] else ''))
+        if self.wall_time is not None:
+            lines.append(f'Total: {self.wall_time:.2f}s.')
+        return '\n'.join(lines)
+
+
+# The report that stage() records into
+current = None
+
+
+def start(name):
+    global current
+    current = RunReport(name)
+    return current
+
+
+# Start a report for the enclosed run and summarize and write it when the run
+# ends, also when it fails
+@contextlib.contextmanager
+def run(name, report_file=None, history_file=None):
+    report = start(name)
+    try:
+        yield report
+    finally:
+        report.finish()
+        print(report)
+        report.write(report_file, history_file)
+
+
+# Record the enclosed code as a stage of package in the current report, if a
+# run report was started
+def stage(package, name):
+    if current is None:
+        return contextlib.nullcontext()
+    return current.stage(package, name)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Python version must be at least 3.6
+import sys
+if sys.version_info[0] < 3 or sys.version_info[1] < 6:
+    print("Python version must be at least 3.6")
+    sys.exit(1)
+
+# Validate every modulefile under a module base directory: the Tcl syntax, the
+# "set root" directory, every prepend-path target, and that the package's
+# executable runs and reports the module's version. Modulefiles are checked
+# concurrently by a worker pool and the results are written as a JSON report.
+
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import subprocess
+
+import lmod_check
+
+# Seconds to wait for "<command> --version"
+VERSION_TIMEOUT = 30
+
+
+def find_modulefiles(module_base):
+    for dir_path, dir_names, file_names in os.walk(module_base):
+        # Hidden files hold Lmod settings and installer state
+        dir_names[:] = sorted(d for d in dir_names if not d.startswith('.'))
+        for file_name in sorted(file_names):
+            if not file_name.startswith('.'):
+                yield os.path.join(dir_path, file_name)
+
+
+# Substitute $name, ${name} and $env(NAME) references
+def substitute(value, variables):
+    def replace(match):
+        if match.group('env'):
+            return os.environ.get(match.group('env'), '')
+        name = match.group('braced') or match.group('plain')
+        return variables.get(name, match.group(0))
+
+    return re.sub(
+        r'\$env\((?P<env>\w+)\)|\$\{(?P<braced>\w+)\}|\$(?P<plain>\w+)',
+        replace, value)
+
+
+# Parse the top-level commands of a Tcl modulefile into a list of word lists,
+# skipping the bodies of braced blocks such as "proc ModulesHelp". Returns the
+# commands and a list of syntax problems.
+def parse_modulefile(content):
+    problems = []
+    if not content.startswith('#%Module'):
+        problems.append('Missing #%Module header.')
+
+    commands = []
+    depth = 0
+    for line_number, line in enumerate(content.splitlines(), 1):
+        stripped = line.strip()
+        if depth == 0 and stripped and not stripped.startswith('#'):
+            commands.append(stripped.split())
+        for char in line:
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if depth < 0:
+                    problems.append(f'Unbalanced "}}" on line {line_number}.')
+                    depth = 0
+    if depth != 0:
+        problems.append('Unbalanced "{" at the end of the file.')
+    return commands, problems
+
+
+def validate_modulefile(module_base, module_file):
+    module_name = os.path.relpath(module_file, module_base)
+    result = {
+        'module': module_name,
+        'module_file': os.path.abspath(module_file),
+        'problems': [],
+    }
+    problems = result['problems']
+
+    if module_file.endswith('.lua'):
+        result['skipped'] = 'Lua modulefiles are not validated.'
+        return result
+
+    try:
+        with open(module_file) as fh:
+            content = fh.read()
+    except (OSError, UnicodeDecodeError) as e:
+        problems.append(f'Failed to read the modulefile: {e}')
+        return result
+
+    commands, syntax_problems = parse_modulefile(content)
+    problems += syntax_problems
+
+    variables = {}
+    path_dirs = []
+    for words in commands:
+        if words[0] == 'set' and len(words) >= 3:
+            variables[words[1]] = substitute(' '.join(words[2:]), variables)
+            if words[1] == 'root' and not os.path.isdir(variables['root']):
+                problems.append(
+                    f'Root directory {variables["root"]} does not exist.')
+        elif words[0] in ('prepend-path', 'append-path'):
+            if len(words) < 3:
+                problems.append(f'Malformed command: {" ".join(words)}')
+                continue
+            for target in words[2:]:
+                target = substitute(target, variables)
+                if not os.path.exists(target):
+                    problems.append(
+                        f'{words[0]} {words[1]} target {target} does not exist.')
+                elif words[1] == 'PATH':
+                    path_dirs.append(target)
+
+    # Run the executable named after the package, as check_module does
+    command, _, version = module_name.partition(os.sep)
+    for path_dir in path_dirs:
+        executable = os.path.join(path_dir, command)
+        if not os.access(executable, os.X_OK):
+            continue
+        result['executable'] = executable
+        try:
+            version_proc = subprocess.run([executable, '--version'],
+                                          capture_output=True,
+                                          text=True,
+                                          timeout=VERSION_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            problems.append(f'Failed to run {executable} --version: {e}')
+            break
+        if version_proc.returncode != 0:
+            problems.append(f'{executable} --version failed.\n' +
+                            version_proc.stderr)
+        elif version and version not in version_proc.stdout + version_proc.stderr:
+            problems.append(
+                f'{executable} is not the expected {version} version: {version_proc.stdout}')
+        break
+    return result
+
+
+def main(module_base, jobs, report_file, lmod):
+    assert os.path.isdir(
+        module_base), f'Module base directory {module_base} does not exist.'
+
+    module_files = list(find_modulefiles(module_base))
+    print(f'Validating {len(module_files)} modulefiles under {module_base}...',
+          end='',
+          flush=True,
+          file=sys.stderr)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(
+            pool.map(lambda f: validate_modulefile(module_base, f),
+                     module_files))
+
+    # Ask Lmod itself about every module, in one batched shell
+    if lmod:
+        results_by_module = {result['module']: result for result in results}
+        checks = [
+            lmod_check.ModuleCheck(result['module'],
+                                   module_file=result['module_file'])
+            for result in results if 'skipped' not in result
+        ]
+        # Resolve the modules in the tree being validated, not in whatever
+        # MODULEPATH the caller has
+        lmod_results = lmod_check.run_checks(checks,
+                                             module_paths=[module_base])
+        for check, lmod_result in zip(checks, lmod_results):
+            results_by_module[check.module_name]['problems'] += \
+                lmod_check.find_problems(check, lmod_result)
+
+    num_broken = sum(1 for result in results if result['problems'])
+    print(f'\x1b[1K\rValidated {len(module_files)} modulefiles under '
+          f'{module_base}, {num_broken} broken.',
+          file=sys.stderr)
+
+    report = {
+        'module_base': module_base,
+        'num_modules': len(results),
+        'num_broken': num_broken,
+        'modules': results,
+    }
+    if report_file:
+        with open(report_file, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 1 if num_broken else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Validate every modulefile under the module base directory.'
+    )
+    parser.add_argument('--version', action='version', version='%(prog)s 1.0')
+    parser.add_argument('--module-base-dir',
+                        type=str,
+                        default=os.path.expanduser('~/.local/modules/'),
+                        help='The base directory for the module files.')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=4 * (os.cpu_count() or 1),
+                        help='The number of modulefiles validated concurrently.')
+    parser.add_argument('--report',
+                        type=str,
+                        default=None,
+                        help='Write the JSON report to this file instead of stdout.')
+    parser.add_argument('--lmod',
+                        action='store_true',
+                        help='Also check that Lmod can show every module.')
+    args = parser.parse_args()
+
+    sys.exit(main(args.module_base_dir, args.jobs, args.report, args.lmod))
@@ -0,0 +1,237 @@
+# Parsed, sorted indexes of the releases an upstream lists. A page (a
+# directory index, a tags listing, ...) is parsed once into releases keyed by
+# their versions as integer tuples, sorted, so the latest release, the latest
+# of a series and an exact version are found by bisection instead of
+# re-scanning the page. An index is cached on disk next to the SHA-256 digest
+# of the page it was parsed from, and in memory, so an unchanged page is not
+# parsed again.
+#
+# A version spec is a comma-separated list of constraints like
+# ">=3.27,<3.29", "~=2.44" or "==2.44.*", with the meaning they have in pip.
+# A bare version is an exact one.
+
+import bisect
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+
+# Versions compare by their numeric components, so 2.10 is newer than 2.9
+def parse_version(version):
+    return tuple(int(x) for x in re.findall(r'\d+', version))
+
+
+# Drop trailing zero components, so 3.28 and 3.28.0 compare equal
+def normalize(key):
+    key = tuple(key)
+    while key and key[-1] == 0:
+        key = key[:-1]
+    return key
+
+
+class VersionSpec:
+    def __init__(self, spec):
+        self.spec = spec
+        # (operator, version key, whether it ends in .*)
+        self.constraints = []
+        for clause in spec.split(','):
+            match = re.fullmatch(
+                r'\s*(~=|==|!=|>=|<=|>|<)?\s*(\d+(?:\.\d+)*)(\.\*)?\s*',
+                clause)
+            assert match, f'Invalid version constraint {clause!r} in {spec!r}.'
+            operator = match.group(1) or '=='
+            key = parse_version(match.group(2))
+            wildcard = bool(match.group(3))
+            assert not wildcard or operator in ('==', '!='), \
+                f'Only == and != take a .* version in {spec!r}.'
+            if operator == '~=':
+                assert len(key) > 1, f'~= needs at least two components in {spec!r}.'
+                self.constraints += [('>=', key, False),
+                                     ('==', key[:-1], True)]
+            else:
+                self.constraints.append((operator, key, wildcard))
+
+    def __str__(self):
+        return self.spec
+
+    # Whether the version with key satisfies every constraint
+    def matches(self, key):
+        for operator, version, wildcard in self.constraints:
+            if wildcard:
+                same = tuple(key[:len(version)]) == version
+                if same != (operator == '=='):
+                    return False
+                continue
+            a, b = normalize(key), normalize(version)
+            if not {
+                    '==': a == b,
+                    '!=': a != b,
+                    '>=': a >= b,
+                    '<=': a <= b,
+                    '>': a > b,
+                    '<': a < b,
+            }[operator]:
+                return False
+        return True
+
+    # Whether some version of the series prefix (e.g. 3.27 for 3.27.x) can
+    # satisfy every constraint, to skip series without listing them
+    def allows_series(self, prefix):
+        prefix = tuple(prefix)
+        lowest = normalize(prefix)
+        above = normalize(prefix[:-1] + (prefix[-1] + 1, ))
+        for operator, version, wildcard in self.constraints:
+            if wildcard or operator == '==':
+                length = min(len(prefix), len(version))
+                padded = version + (0, ) * (len(prefix) - len(version))
+                if operator == '==' and (
+                        prefix[:length] != version[:length] if wildcard else
+                        padded[:len(prefix)] != prefix):
+                    return False
+            elif operator in ('>=', '>') and not normalize(version) < above:
+                return False
+            elif operator == '<' and not lowest < normalize(version):
+                return False
+            elif operator == '<=' and not lowest <= normalize(version):
+                return False
+        return True
+
+    # Key that no matching version exceeds, or None
+    def upper_bound(self):
+        bounds = [
+            version for operator, version, _ in self.constraints
+            if operator in ('<', '<=')
+        ]
+        return min(bounds) if bounds else None
+
+
+class VersionIndex:
+    # releases is an iterable of (version, data) pairs, where data is what
+    # the upstream lists for the release, such as its file name or URL, and
+    # must be JSON serializable
+    def __init__(self, releases):
+        self.releases = sorted(
+            ((parse_version(version), version, data)
+             for version, data in releases),
+            key=lambda release: release[0])
+        self.keys = [release[0] for release in self.releases]
+
+    def __len__(self):
+        return len(self.releases)
+
+    def versions(self):
+        return [release[1] for release in self.releases]
+
+    # Return the (version, data) of the latest release, or of the latest one
+    # whose version starts with the components of series, e.g. 2.44 for
+    # 2.44.x. Returns None if there is none.
+    def latest(self, series=None):
+        if series is None:
+            end = len(self.keys)
+        else:
+            prefix = parse_version(series)
+            end = bisect.bisect_left(self.keys,
+                                     prefix[:-1] + (prefix[-1] + 1, ))
+            if not end or self.keys[end - 1][:len(prefix)] != prefix:
+                return None
+        if not end:
+            return None
+        return self.releases[end - 1][1:]
+
+    # Return the (version, data) of version, or None if it is not listed
+    def exact(self, version):
+        key = parse_version(version)
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.releases[i][1:]
+        return None
+
+    # Return the (version, data) of the latest release that satisfies spec,
+    # a VersionSpec or a string, or None if there is none. The scan starts
+    # at the spec's upper bound.
+    def resolve(self, spec):
+        if not isinstance(spec, VersionSpec):
+            spec = VersionSpec(spec)
+        end = len(self.keys)
+        bound = spec.upper_bound()
+        if bound is not None:
+            # Keys of the bound with trailing zeros sort after it, so they are
+            # included and left to matches()
+            end = bisect.bisect_right(self.keys, bound + (0, ) * 8)
+        for i in range(end - 1, -1, -1):
+            if spec.matches(self.keys[i]):
+                return self.releases[i][1:]
+        return None
+
+    def as_dict(self):
+        return {'releases': [list(release) for release in self.releases]}
+
+    @classmethod
+    def from_dict(cls, entries):
+        index = cls(())
+        index.releases = [(tuple(key), version, data)
+                          for key, version, data in entries['releases']]
+        index.keys = [release[0] for release in index.releases]
+        return index
+
+
+# Indexes parsed by this process, keyed by their URL, parser and page digest
+loaded = {}
+loaded_lock = threading.Lock()
+
+
+def index_path(cache_dir, url, parser):
+    key = hashlib.sha256(f'{parser}\n{url}'.encode()).hexdigest()
+    return os.path.join(cache_dir, 'versions', f'{key}.json')
+
+
+def store(index_file, entries):
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    tmp_fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(index_file))
+    try:
+        with os.fdopen(tmp_fd, 'w') as fh:
+            json.dump(entries, fh)
+        os.replace(tmp_file, index_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+# Return the VersionIndex of the page at url, read through the metadata
+# cache. parse(page) returns the (version, data) pairs of the releases on the
+# page, and parser names it, so indexes of the same page parsed differently
+# are kept apart.
+def load(metadata, url, parser, parse):
+    page = metadata.read(url)
+    digest = hashlib.sha256(page.encode('utf-8')).hexdigest()
+    with loaded_lock:
+        index = loaded.get((url, parser, digest))
+    if index is not None:
+        return index
+
+    index_file = None
+    if metadata.cache_dir is not None:
+        index_file = index_path(metadata.cache_dir, url, parser)
+        try:
+            with open(index_file) as fh:
+                entries = json.load(fh)
+            if (entries['url'] == url and entries['parser'] == parser
+                    and entries['page_sha256'] == digest):
+                index = VersionIndex.from_dict(entries)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    if index is None:
+        index = VersionIndex(parse(page))
+        if index_file is not None:
+            store(index_file,
+                  dict(index.as_dict(),
+                       url=url,
+                       parser=parser,
+                       page_sha256=digest))
+    with loaded_lock:
+        loaded[(url, parser, digest)] = index
+    return index